@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import shutil
+from types import SimpleNamespace
+import yaml
+from simulador_servicos import Simulador, FORMATOS
+
+# Scripts de sincronização medidos, executados como na máquina (main do módulo)
+SCRIPTS = ['download_all_files_with_subfolder', 'download_files_recentes']
+# Queda máxima (%) de arquivos/s e MB/s em relação à base antes de considerar regressão
+TOLERANCIA = 10
+DIRETORIO_PROJETO = os.path.dirname(os.path.abspath(__file__))
+# Módulos com o tempo de importação medido (o que um worker ou uma execução agendada curta paga antes de começar)
+MODULOS_IMPORTACAO = ['sync', 'modulo_fluig', 'office365_api', 'download_all_files_with_subfolder',
+                      'download_files_recentes', 'sincroniza_fluig_sharepoint', 'planejador', 'sync_distribuido']
+# Tempo máximo de importação de cada módulo em ms (0 desliga a verificação)
+ORCAMENTO_IMPORTACAO_MS = 250
+
+
+def _mescla(base, extra):
+    """Mescla o yaml extra na configuração gerada (seção por seção)"""
+    for chave, valor in (extra or {}).items():
+        if isinstance(valor, dict) and isinstance(base.get(chave), dict):
+            _mescla(base[chave], valor)
+        else:
+            base[chave] = valor
+    return base
+
+
+def monta_config(simulador, diretorio, extra=None):
+    """config.yaml apontando para os servidores simulados, com estado, cache e métricas dentro do diretório da execução"""
+    config = {
+        'sharepoint': {
+            'sharepoint_email': 'benchmark@local',
+            'sharepoint_password': 'benchmark',
+            'sharepoint_url_site': simulador.url_sharepoint,
+            'sharepoint_site_name': simulador.site,
+            'sharepoint_doc_library': simulador.biblioteca,
+            'pasta_local_download': os.path.join(diretorio, 'download'),
+            'access_token': 'benchmark',
+        },
+        'fluig': {
+            'client_key': 'benchmark',
+            'client_secret': 'benchmark',
+            'resource_owner_key': 'benchmark',
+            'resource_owner_secret': 'benchmark',
+            'dominio': simulador.url_fluig,
+        },
+        'estado': {'arquivo': os.path.join(diretorio, 'estado_sync.db')},
+        'metricas': {'arquivo_json': os.path.join(diretorio, 'metricas.json')},
+        #Sem espera longa entre as tentativas, o Retry-After do simulador continua valendo
+        'retry': {'espera_base': 0.05, 'espera_maxima': 5},
+    }
+    return _mescla(config, extra)
+
+
+def executa_script(script, diretorio):
+    """Roda o main do script em um processo novo (configuração, sessões e caches ficam no processo) e retorna o tempo"""
+    ambiente = dict(os.environ)
+    ambiente['SYNC_CONFIG'] = os.path.join(diretorio, 'config.yaml')
+    ambiente['PYTHONPATH'] = os.pathsep.join(filter(None, [DIRETORIO_PROJETO, ambiente.get('PYTHONPATH')]))
+    inicio = time.perf_counter()
+    processo = subprocess.run([sys.executable, '-c', f'import {script}; {script}.main()'],
+                              cwd=diretorio, env=ambiente, capture_output=True, text=True)
+    tempo = time.perf_counter() - inicio
+    if processo.returncode != 0:
+        raise RuntimeError(f'{script} terminou com código {processo.returncode}: {processo.stderr[-2000:]}')
+    return tempo
+
+
+def _rodada(simulador, script, diretorio, nome):
+    simulador.zerar_contadores()
+    tempo = executa_script(script, diretorio)
+    contadores = simulador.contadores()
+    requisicoes = contadores['requisicoes']
+    arquivos = requisicoes.get('fluig.upload', 0) + requisicoes.get('fluig.nova_versao', 0)
+    megabytes = contadores['bytes']['conteudo'] / 1024 / 1024
+    erros = 0
+    caminho_log = os.path.join(diretorio, 'log')
+    #Cada rodada conta só os próprios erros, o log da rodada fica guardado com o nome dela
+    for nome_log in os.listdir(caminho_log):
+        if re.fullmatch(r'app-[\d-]+\.log', nome_log):
+            with open(os.path.join(caminho_log, nome_log), encoding='utf-8', errors='replace') as f:
+                erros += sum(1 for linha in f if ' - ERROR - ' in linha)
+            os.replace(os.path.join(caminho_log, nome_log), os.path.join(caminho_log, f'{nome_log[:-4]}-{nome}.log'))
+    return {
+        'rodada': nome,
+        'tempo_s': round(tempo, 3),
+        'arquivos_publicados': arquivos,
+        'arquivos_por_s': round(arquivos / tempo, 2),
+        'mb_baixados': round(megabytes, 2),
+        'mb_por_s': round(megabytes / tempo, 2),
+        'requisicoes_sharepoint': sum(v for k, v in requisicoes.items() if k.startswith('sharepoint.')),
+        'requisicoes_fluig': sum(v for k, v in requisicoes.items() if k.startswith('fluig.')),
+        'erros_log': erros,
+        'requisicoes': requisicoes,
+    }
+
+
+def executa_cenario(formato, script, latencia_ms=0, taxa_throttling=0.0, alterados=0.1, extra=None, manter=False):
+    """Executa a sincronização completa e, se alterados > 0, uma incremental depois de alterar essa fração dos arquivos"""
+    simulador = Simulador(formato, latencia_ms=latencia_ms, taxa_throttling=taxa_throttling).iniciar()
+    diretorio = tempfile.mkdtemp(prefix=f'benchmark-{formato}-')
+    try:
+        os.makedirs(os.path.join(diretorio, 'log'))
+        os.makedirs(os.path.join(diretorio, 'download'))
+        with open(os.path.join(diretorio, 'config.yaml'), 'w', encoding='utf-8') as f:
+            yaml.safe_dump(monta_config(simulador, diretorio, extra), f, allow_unicode=True)
+        rodadas = [_rodada(simulador, script, diretorio, 'completa')]
+        if alterados:
+            simulador.modificar(alterados)
+            rodadas.append(_rodada(simulador, script, diretorio, 'incremental'))
+        return {
+            'formato': formato,
+            'script': script,
+            'arquivos': simulador.total_arquivos,
+            'mb': round(simulador.total_bytes / 1024 / 1024, 2),
+            'latencia_ms': latencia_ms,
+            'taxa_throttling': taxa_throttling,
+            'rodadas': rodadas,
+        }
+    finally:
+        simulador.parar()
+        if not manter:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def mede_importacao(modulos=None, repeticoes=3):
+    """Tempo de importação (ms) de cada módulo em um processo novo, o menor de algumas repetições.
+    A configuração aponta para servidores inexistentes: importar não pode abrir conexões"""
+    diretorio = tempfile.mkdtemp(prefix='benchmark-importacao-')
+    try:
+        servidor = 'http://127.0.0.1:9'
+        simulador = SimpleNamespace(url_sharepoint=servidor, url_fluig=servidor, site='benchmark', biblioteca='Documentos')
+        with open(os.path.join(diretorio, 'config.yaml'), 'w', encoding='utf-8') as f:
+            yaml.safe_dump(monta_config(simulador, diretorio), f, allow_unicode=True)
+        ambiente = dict(os.environ)
+        ambiente['SYNC_CONFIG'] = os.path.join(diretorio, 'config.yaml')
+        ambiente['PYTHONPATH'] = DIRETORIO_PROJETO + os.pathsep + ambiente.get('PYTHONPATH', '')
+        tempos = {}
+        for modulo in modulos or MODULOS_IMPORTACAO:
+            codigo = f'import time; t = time.perf_counter(); import {modulo}; print(time.perf_counter() - t)'
+            medidas = []
+            for _ in range(repeticoes):
+                saida = subprocess.run([sys.executable, '-c', codigo], cwd=diretorio, env=ambiente,
+                                       capture_output=True, text=True, check=True)
+                medidas.append(float(saida.stdout.strip().splitlines()[-1]) * 1000)
+            tempos[modulo] = round(min(medidas), 1)
+        return tempos
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def verifica_importacao(tempos, orcamento_ms=ORCAMENTO_IMPORTACAO_MS, base=None, tolerancia=TOLERANCIA):
+    """Lista os módulos acima do orçamento ou mais lentos que na base além da tolerância"""
+    regressoes = []
+    for modulo, tempo in tempos.items():
+        if orcamento_ms and tempo > orcamento_ms:
+            regressoes.append(f"importação de {modulo}: {tempo}ms acima do orçamento de {orcamento_ms}ms")
+        anterior = (base or {}).get(modulo)
+        #Diferenças de poucos ms são ruído da criação do processo
+        if anterior and tempo > anterior * (1 + tolerancia / 100) and tempo - anterior > 10:
+            regressoes.append(f"importação de {modulo}: {anterior}ms -> {tempo}ms")
+    return regressoes
+
+
+def compara(resultados, base, tolerancia=TOLERANCIA):
+    """Lista as rodadas com arquivos/s ou MB/s abaixo da base menos a tolerância"""
+    anteriores = {(r['formato'], r['script'], rodada['rodada']): rodada
+                  for r in base for rodada in r['rodadas']}
+    regressoes = []
+    for resultado in resultados:
+        for rodada in resultado['rodadas']:
+            anterior = anteriores.get((resultado['formato'], resultado['script'], rodada['rodada']))
+            if anterior is None:
+                continue
+            for medida in ('arquivos_por_s', 'mb_por_s'):
+                if not anterior[medida]:
+                    continue
+                variacao = (rodada[medida] / anterior[medida] - 1) * 100
+                if variacao < -tolerancia:
+                    regressoes.append(f"{resultado['formato']}/{resultado['script']}/{rodada['rodada']} {medida}: "
+                                      f"{anterior[medida]} -> {rodada[medida]} ({variacao:.1f}%)")
+    return regressoes
+
+
+def imprime(resultados):
+    if not resultados:
+        return
+    print(f"{'formato':<16}{'script':<36}{'rodada':<13}{'tempo(s)':>9}{'arq/s':>9}{'MB/s':>9}"
+          f"{'req SP':>8}{'req fluig':>10}{'erros':>7}")
+    for resultado in resultados:
+        for rodada in resultado['rodadas']:
+            print(f"{resultado['formato']:<16}{resultado['script']:<36}{rodada['rodada']:<13}{rodada['tempo_s']:>9}"
+                  f"{rodada['arquivos_por_s']:>9}{rodada['mb_por_s']:>9}{rodada['requisicoes_sharepoint']:>8}"
+                  f"{rodada['requisicoes_fluig']:>10}{rodada['erros_log']:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark da sincronização contra SharePoint e Fluig simulados')
+    parser.add_argument('--formatos', nargs='+', default=list(FORMATOS), choices=list(FORMATOS))
+    parser.add_argument('--scripts', nargs='+', default=SCRIPTS, choices=SCRIPTS)
+    parser.add_argument('--latencia-ms', type=float, default=0, help='latência adicionada a cada requisição')
+    parser.add_argument('--throttling', type=float, default=0.0, help='fração das requisições respondidas com 429')
+    parser.add_argument('--alterados', type=float, default=0.1, help='fração de arquivos alterados antes da rodada incremental')
+    parser.add_argument('--config', help='yaml mesclado na configuração gerada (ex: pipeline, delta, streaming)')
+    parser.add_argument('--saida', help='grava os resultados em json')
+    parser.add_argument('--base', help='json de uma execução anterior para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA, help='queda máxima de arquivos/s e MB/s em %%')
+    parser.add_argument('--manter', action='store_true', help='mantém o diretório da execução (logs, estado)')
+    parser.add_argument('--orcamento-importacao-ms', type=float, default=ORCAMENTO_IMPORTACAO_MS,
+                        help='tempo máximo de importação de cada módulo (0 desliga)')
+    parser.add_argument('--so-importacao', action='store_true', help='só mede o tempo de importação dos módulos')
+    args = parser.parse_args(argv)
+
+    extra = None
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            extra = yaml.safe_load(f)
+    importacao = mede_importacao()
+    for modulo, tempo in importacao.items():
+        print(f"importação {modulo:<36}{tempo:>9}ms")
+    resultados = [] if args.so_importacao else [
+        executa_cenario(formato, script, args.latencia_ms, args.throttling, args.alterados, extra, args.manter)
+        for formato in args.formatos for script in args.scripts
+    ]
+    imprime(resultados)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'cenarios': resultados, 'importacao': importacao}, f, ensure_ascii=False, indent=2)
+    base = {}
+    if args.base:
+        with open(args.base, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        #Bases antigas têm só a lista de cenários
+        if isinstance(base, list):
+            base = {'cenarios': base}
+    regressoes = compara(resultados, base.get('cenarios', []), args.tolerancia)
+    regressoes += verifica_importacao(importacao, args.orcamento_importacao_ms, base.get('importacao'), args.tolerancia)
+    for regressao in regressoes:
+        print(f'REGRESSÃO {regressao}')
+    return 1 if regressoes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import threading
+import json
+import os
+import logging
+
+
+class CachePastas:
+    """Cache caminho -> documentId das pastas do fluig a partir da pasta raiz.
+
+    buscar(nome, parent_id) retorna o documentId da pasta ou None, criar(nome, parent_id) cria e retorna o documentId.
+    A criação é feita com um lock por caminho, evitando pastas duplicadas quando vários arquivos
+    da mesma pasta são enviados ao mesmo tempo.
+    """
+
+    def __init__(self, raiz, buscar, criar, arquivo=None):
+        self.raiz = str(raiz)
+        self._buscar = buscar
+        self._criar = criar
+        self.arquivo = arquivo
+        self._pastas = {}
+        #Caminhos consultados e inexistentes nessa execução, a busca não repete a consulta (o resolve cria a pasta)
+        self._ausentes = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+        if arquivo and os.path.exists(arquivo):
+            with open(arquivo, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+            #Só reaproveita o cache se ele foi montado a partir da mesma pasta raiz
+            if dados.get('raiz') == self.raiz:
+                self._pastas = {tuple(caminho.split('/')): documento_id for caminho, documento_id in dados['pastas'].items()}
+                logging.info(f"Cache de pastas do fluig carregado com {len(self._pastas)} pastas")
+
+    def _lock_caminho(self, caminho):
+        with self._lock:
+            if caminho not in self._locks:
+                self._locks[caminho] = threading.Lock()
+            return self._locks[caminho]
+
+    def carregar(self, pastas):
+        """Monta o cache de uma vez a partir da lista (documentId, descrição, parentId) de todas as pastas"""
+        filhos = {}
+        for documento_id, descricao, parent_id in pastas:
+            filhos.setdefault(str(parent_id), []).append((descricao, str(documento_id)))
+        pendentes = [((), self.raiz)]
+        with self._lock:
+            while pendentes:
+                caminho, documento_id = pendentes.pop()
+                for descricao, filho_id in filhos.get(documento_id, []):
+                    caminho_filho = caminho + (descricao,)
+                    #Se existirem pastas com o mesmo nome, mantém a primeira como na consulta pelo nome
+                    if caminho_filho not in self._pastas:
+                        self._pastas[caminho_filho] = filho_id
+                        pendentes.append((caminho_filho, filho_id))
+        logging.info(f"Cache de pastas do fluig carregado com {len(self._pastas)} pastas")
+
+    def busca(self, lista_pastas):
+        """Retorna o documentId da última pasta da lista sem criar nada, ou None se alguma pasta não existir"""
+        parent_id = self.raiz
+        for i, nome in enumerate(lista_pastas):
+            caminho = tuple(lista_pastas[:i + 1])
+            documento_id = self._pastas.get(caminho)
+            if documento_id is None:
+                #Com o lock, threads da mesma pasta esperam a primeira consulta em vez de repetir
+                with self._lock_caminho(caminho):
+                    documento_id = self._pastas.get(caminho)
+                    if documento_id is None:
+                        if caminho in self._ausentes:
+                            return None
+                        documento_id = self._buscar(nome, parent_id)
+                        if documento_id is None:
+                            self._ausentes.add(caminho)
+                            return None
+                        self._pastas[caminho] = str(documento_id)
+            parent_id = self._pastas[caminho]
+        return parent_id
+
+    def resolve(self, lista_pastas):
+        """Retorna o documentId da última pasta da lista, criando as que não existirem"""
+        parent_id = self.raiz
+        for i, nome in enumerate(lista_pastas):
+            caminho = tuple(lista_pastas[:i + 1])
+            documento_id = self._pastas.get(caminho)
+            if documento_id is None:
+                with self._lock_caminho(caminho):
+                    #Outra thread pode ter criado a pasta enquanto esperava o lock
+                    documento_id = self._pastas.get(caminho)
+                    if documento_id is None:
+                        documento_id = self._buscar(nome, parent_id)
+                        if documento_id is None:
+                            logging.info(f"Criando a pasta {nome}")
+                            documento_id = self._criar(nome, parent_id)
+                        self._pastas[caminho] = str(documento_id)
+            parent_id = self._pastas[caminho]
+        return parent_id
+
+    def por_documento(self):
+        """Mapa documentId -> caminho (lista de nomes a partir da raiz) das pastas em cache"""
+        with self._lock:
+            return {documento_id: list(caminho) for caminho, documento_id in self._pastas.items()}
+
+    def registra(self, lista_pastas, documento_id):
+        """Guarda no cache uma pasta criada fora do resolve (ex: pelo planejador)"""
+        with self._lock:
+            self._pastas[tuple(lista_pastas)] = str(documento_id)
+
+    def invalida(self, lista_pastas):
+        """Remove do cache a pasta e as subpastas (ex: pasta removida no fluig)"""
+        prefixo = tuple(lista_pastas)
+        with self._lock:
+            for caminho in [c for c in self._pastas if c[:len(prefixo)] == prefixo]:
+                del self._pastas[caminho]
+
+    def salvar(self):
+        """Grava o cache em disco, se configurado um arquivo"""
+        if not self.arquivo:
+            return
+        with self._lock:
+            dados = {'raiz': self.raiz, 'pastas': {'/'.join(caminho): documento_id for caminho, documento_id in self._pastas.items()}}
+        with open(self.arquivo, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False)
+
+
+class CachePastasAsync(CachePastas):
+    """Mesmo cache para o cliente asyncio: buscar e criar são coroutines e a criação usa um asyncio.Lock por caminho"""
+
+    def __init__(self, raiz, buscar, criar, arquivo=None):
+        super().__init__(raiz, buscar, criar, arquivo)
+        self._locks_async = {}
+
+    def _lock_caminho_async(self, caminho):
+        #O asyncio só é importado pelo cliente assíncrono, o cache síncrono não paga essa importação
+        import asyncio
+        if caminho not in self._locks_async:
+            self._locks_async[caminho] = asyncio.Lock()
+        return self._locks_async[caminho]
+
+    async def busca(self, lista_pastas):
+        """Retorna o documentId da última pasta da lista sem criar nada, ou None se alguma pasta não existir"""
+        parent_id = self.raiz
+        for i, nome in enumerate(lista_pastas):
+            caminho = tuple(lista_pastas[:i + 1])
+            documento_id = self._pastas.get(caminho)
+            if documento_id is None:
+                #Com o lock, tarefas da mesma pasta esperam a primeira consulta em vez de repetir
+                async with self._lock_caminho_async(caminho):
+                    documento_id = self._pastas.get(caminho)
+                    if documento_id is None:
+                        if caminho in self._ausentes:
+                            return None
+                        documento_id = await self._buscar(nome, parent_id)
+                        if documento_id is None:
+                            self._ausentes.add(caminho)
+                            return None
+                        self._pastas[caminho] = str(documento_id)
+            parent_id = self._pastas[caminho]
+        return parent_id
+
+    async def resolve(self, lista_pastas):
+        """Retorna o documentId da última pasta da lista, criando as que não existirem"""
+        parent_id = self.raiz
+        for i, nome in enumerate(lista_pastas):
+            caminho = tuple(lista_pastas[:i + 1])
+            documento_id = self._pastas.get(caminho)
+            if documento_id is None:
+                async with self._lock_caminho_async(caminho):
+                    #Outra tarefa pode ter criado a pasta enquanto esperava o lock
+                    documento_id = self._pastas.get(caminho)
+                    if documento_id is None:
+                        documento_id = await self._buscar(nome, parent_id)
+                        if documento_id is None:
+                            logging.info(f"Criando a pasta {nome}")
+                            documento_id = await self._criar(nome, parent_id)
+                        self._pastas[caminho] = str(documento_id)
+            parent_id = self._pastas[caminho]
+        return parent_id
@@ -0,0 +1,119 @@
+import os
+import logging
+import threading
+from datetime import datetime
+
+# Arquivos procurados quando nem o --config nem o SYNC_CONFIG foram informados
+CAMINHOS_PADRAO = (r'C:\Users\rpa\Documents\POC-SHAREPOINT\config.yaml', 'config.yaml')
+# Chaves lidas sem valor padrão pelos clientes, conferidas pelo sync check
+OBRIGATORIAS = {
+    'sharepoint': ('sharepoint_email', 'sharepoint_password', 'sharepoint_url_site', 'sharepoint_site_name',
+                   'sharepoint_doc_library', 'pasta_local_download'),
+    'fluig': ('dominio', 'client_key', 'client_secret', 'resource_owner_key', 'resource_owner_secret'),
+}
+
+_caminho = None
+_config = None
+# Funções chamadas com a configuração quando ela é lida e as Opcoes dos módulos (descartadas no definir)
+_ao_carregar = []
+_opcoes = []
+_lock = threading.Lock()
+
+
+class Opcoes:
+    """Valores de um módulo lidos da configuração no primeiro uso, assim importar o módulo não lê o arquivo.
+    Cada opção é (seção, chave) para as obrigatórias, (seção, chave, padrão) para as opcionais
+    ou uma função que recebe a configuração. O valor lido fica guardado e pode ser trocado por atribuição."""
+
+    def __init__(self, **opcoes):
+        self._opcoes = opcoes
+        _opcoes.append(self)
+
+    def __getattr__(self, nome):
+        try:
+            opcao = self.__dict__['_opcoes'][nome]
+        except KeyError:
+            raise AttributeError(nome) from None
+        config = carregar()
+        if callable(opcao):
+            valor = opcao(config)
+        elif len(opcao) == 2:
+            valor = config[opcao[0]][opcao[1]]
+        else:
+            valor = (config.get(opcao[0]) or {}).get(opcao[1], opcao[2])
+        setattr(self, nome, valor)
+        return valor
+
+    def _descarta(self):
+        for nome in self._opcoes:
+            self.__dict__.pop(nome, None)
+
+
+def definir(caminho):
+    """Usa o arquivo informado (ex: --config da linha de comando), deve ser chamada antes do primeiro uso da configuração.
+    Também vale para os processos filhos, que recebem o caminho pelo SYNC_CONFIG"""
+    global _caminho, _config
+    _caminho = os.path.abspath(caminho)
+    os.environ['SYNC_CONFIG'] = _caminho
+    _config = None
+    for opcoes in _opcoes:
+        opcoes._descarta()
+
+
+def caminho():
+    """Arquivo de configuração da execução: o definido, o SYNC_CONFIG ou o primeiro padrão que existir"""
+    if _caminho:
+        return _caminho
+    if os.environ.get('SYNC_CONFIG'):
+        return os.environ['SYNC_CONFIG']
+    return next((padrao for padrao in CAMINHOS_PADRAO if os.path.exists(padrao)), CAMINHOS_PADRAO[0])
+
+
+def carregar():
+    """Configuração da execução, lida no primeiro uso e compartilhada por todos os módulos.
+    Os módulos não chamam na importação, só quando precisam de um valor (ou pelas Opcoes)"""
+    global _config
+    if _config is None:
+        #O primeiro uso pode vir de várias threads ao mesmo tempo
+        with _lock:
+            if _config is None:
+                import yaml
+                with open(caminho(), 'r', encoding='utf-8') as params:
+                    config = yaml.safe_load(params) or {}
+                for funcao in _ao_carregar:
+                    funcao(config)
+                _config = config
+    return _config
+
+
+def ao_carregar(funcao):
+    """Chama a função com a configuração quando ela for lida (na hora, se já foi lida), ex: para ajustar
+    as sessões e o retry antes da primeira requisição sem ler o arquivo na importação"""
+    _ao_carregar.append(funcao)
+    if _config is not None:
+        funcao(_config)
+
+
+def valida():
+    """Lista das chaves obrigatórias que faltam na configuração (vazia se estiver completa)"""
+    config = carregar()
+    faltando = []
+    for secao, chaves in OBRIGATORIAS.items():
+        valores = config.get(secao) or {}
+        faltando.extend(f'{secao}.{chave}' for chave in chaves if chave not in valores)
+    return faltando
+
+
+def configura_log():
+    """Log em log/app-<data>.log, chamada pelos pontos de entrada (não na importação dos módulos).
+    Não faz nada se o log já foi configurado (ex: pelo serviço)"""
+    if logging.getLogger().handlers:
+        return
+    os.makedirs('log', exist_ok=True)
+    data_hoje = datetime.now().strftime(r"%d-%m-%Y")
+    # Configuração básica do logger
+    logging.basicConfig(
+        filename=f'log/app-{data_hoje}.log',  # Especifica o arquivo de log
+        level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
+        format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
+    )
@@ -0,0 +1,198 @@
+import logging
+import politica_retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from office365_api import SharePoint, _data_odata, opcoes as opcoes_sharepoint
+from inventario import monta_inventario, LIMITE_MEMORIA
+
+# Itens por página na listagem completa da biblioteca
+TAMANHO_PAGINA = 500
+# Máximo de mudanças retornadas por chamada ao GetChanges
+LIMITE_MUDANCAS = 1000
+# Quantidade de ids por consulta ao buscar os itens alterados ($filter com "or")
+IDS_POR_CONSULTA = 50
+# Campos lidos dos itens da lista, o File expandido traz as propriedades usadas no estado
+CAMPOS_ITEM = ['Id', 'FileRef', 'FSObjType', 'File']
+# Pastas listadas ao mesmo tempo na descoberta em paralelo
+WORKERS_DESCOBERTA = 4
+
+
+def descobrir_pastas(sharepoint, pasta_raiz, workers=WORKERS_DESCOBERTA):
+    """Percorre a árvore a partir da pasta raiz em largura, listando até workers pastas ao mesmo tempo.
+    Cada pasta é consultada uma única vez, trazendo subpastas e arquivos juntos.
+
+    Retorna ([(pasta, [propriedades])], completa), com as pastas na ordem em que foram encontradas;
+    completa é False se alguma pasta não pôde ser listada.
+    """
+    resultados = {}
+    completa = True
+    encontradas = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='descoberta') as executor:
+        pendentes = {executor.submit(sharepoint.get_folder_contents, pasta_raiz): (0, pasta_raiz)}
+        while pendentes:
+            concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                indice, pasta = pendentes.pop(futuro)
+                try:
+                    subpastas, arquivos = futuro.result()
+                except Exception as e:
+                    logging.error(f"Erro ao listar a pasta {pasta}: {e}")
+                    completa = False
+                    continue
+                resultados[indice] = (pasta, [SharePoint.file_properties(arquivo) for arquivo in arquivos])
+                for subpasta in subpastas:
+                    encontradas += 1
+                    caminho = '/'.join([pasta, subpasta.name])
+                    pendentes[executor.submit(sharepoint.get_folder_contents, caminho)] = (encontradas, caminho)
+    pastas = [resultados[indice] for indice in sorted(resultados)]
+    logging.info(f"Descoberta de {pasta_raiz}: {len(pastas)} pastas, {sum(len(a) for _, a in pastas)} arquivos")
+    return pastas, completa
+
+
+def descobrir_pastas_lote(lote, pasta_raiz):
+    """Mesmo resultado do descobrir_pastas, percorrendo a árvore nível a nível: as pastas de cada nível
+    são consultadas juntas em requisições $batch (LoteSharePoint), em vez de uma requisição por pasta"""
+    pastas = []
+    completa = True
+    nivel = [pasta_raiz]
+    while nivel:
+        resultados = lote.pastas(nivel)
+        proximo = []
+        for pasta in nivel:
+            resultado = resultados[pasta]
+            if isinstance(resultado, Exception):
+                logging.error(f"Erro ao listar a pasta {pasta}: {resultado}")
+                completa = False
+                continue
+            subpastas, arquivos = resultado
+            pastas.append((pasta, [SharePoint.file_properties(arquivo) for arquivo in arquivos]))
+            proximo.extend('/'.join([pasta, subpasta.name]) for subpasta in subpastas)
+        nivel = proximo
+    logging.info(f"Descoberta em lote de {pasta_raiz}: {len(pastas)} pastas, {sum(len(a) for _, a in pastas)} arquivos")
+    return pastas, completa
+
+
+class CrawlerSharePoint:
+    """Enumera os arquivos alterados de uma biblioteca com uma consulta paginada ou pelo change token,
+    em vez de listar pasta por pasta"""
+
+    def __init__(self, estado, biblioteca=None, sharepoint=None):
+        self.estado = estado
+        self.biblioteca = biblioteca or opcoes_sharepoint.SHAREPOINT_DOC
+        self.sharepoint = sharepoint or SharePoint()
+        #Token lido nessa execução, só é gravado no estado depois de confirmar o processamento
+        self._token_pendente = None
+        #Id do item da lista de cada arquivo retornado, para guardar os que não forem aplicados
+        self._ids_item = {}
+        self._removidos = set()
+
+    def _lista(self):
+        conn = self.sharepoint._auth()
+        return conn.web.get_list(f'/sites/{opcoes_sharepoint.SHAREPOINT_SITE_NAME}/{self.biblioteca}')
+
+    def _entrada(self, item):
+        """Converte o item da lista em (pasta, propriedades) no mesmo formato usado pelos scripts"""
+        file_ref = item.properties['FileRef']
+        #Pasta relativa ao site, igual a usada no download_file
+        pasta = file_ref.split(f'/sites/{opcoes_sharepoint.SHAREPOINT_SITE_NAME}/', 1)[-1].rsplit('/', 1)[0]
+        propriedades = SharePoint.file_properties(item.file)
+        self._ids_item[propriedades['file_id']] = item.properties['Id']
+        return pasta, propriedades
+
+    def _itens(self, filtro=None):
+        """Consulta paginada dos arquivos da biblioteca (recursiva, sem listar as pastas)"""
+        itens = self.sharepoint.iter_list_items(self.biblioteca, filtro, CAMPOS_ITEM, TAMANHO_PAGINA)
+        #FSObjType 1 são pastas
+        return [self._entrada(item) for item in itens if item.properties.get('FSObjType') == 0]
+
+    @staticmethod
+    def _filtro_data(modificado_desde):
+        if modificado_desde is None:
+            return None
+        return f"Modified ge datetime'{_data_odata(modificado_desde)}'"
+
+    def listar_tudo(self, modificado_desde=None):
+        """Lista todos os arquivos da biblioteca, opcionalmente só os modificados desde a data (filtro no servidor)"""
+        arquivos = self._itens(self._filtro_data(modificado_desde))
+        logging.info(f"Consulta da biblioteca {self.biblioteca} retornou {len(arquivos)} arquivos")
+        return arquivos
+
+    def listar_por_pasta(self, modificado_desde=None, limite_memoria=LIMITE_MEMORIA, arquivo=None):
+        """Mesma consulta do listar_tudo agrupada por pasta, no formato do descobrir_pastas.
+        Gera uma pasta por vez: a listagem fica no inventário compacto, que passa para o disco acima de
+        limite_memoria arquivos, então a memória não cresce com o tamanho da biblioteca"""
+        inventario, _ = monta_inventario(self.sharepoint, self.biblioteca, opcoes_sharepoint.SHAREPOINT_SITE_NAME,
+                                         self._filtro_data(modificado_desde), limite_memoria, arquivo, TAMANHO_PAGINA)
+        try:
+            for pasta, entradas in inventario.por_pasta():
+                yield pasta, [entrada.propriedades() for entrada in entradas]
+        finally:
+            inventario.fechar()
+
+    def _token_atual(self):
+        def _consulta():
+            return self._lista().select(['CurrentChangeToken']).get().execute_query()
+
+        lista = politica_retry.executa(_consulta, 'sharepoint', 'ao consultar o change token',
+                                       self.sharepoint._renova_se_expirado)
+        return lista.current_change_token.StringValue
+
+    def _busca_por_ids(self, ids):
+        """Busca os itens alterados em blocos, uma consulta para cada IDS_POR_CONSULTA itens"""
+        arquivos = []
+        ids = sorted(ids)
+        for i in range(0, len(ids), IDS_POR_CONSULTA):
+            bloco = ids[i:i + IDS_POR_CONSULTA]
+            arquivos.extend(self._itens(' or '.join(f'Id eq {item_id}' for item_id in bloco)))
+        return arquivos
+
+    def mudancas(self):
+        """Retorna (alterados, removidos) desde o último token gravado.
+
+        alterados é uma lista de (pasta, propriedades) e removidos uma lista de unique_id.
+        Na primeira execução não existe token, então lista a biblioteca inteira e guarda o token atual.
+        As mudanças que não foram aplicadas nas execuções anteriores voltam junto com as novas.
+        """
+        from office365.sharepoint.changes.query import ChangeQuery
+        from office365.sharepoint.changes.token import ChangeToken
+        from office365.sharepoint.changes.type import ChangeType
+        token = self.estado.get_token(self.biblioteca)
+        if token is None:
+            self._token_pendente = self._token_atual()
+            logging.info(f"Sem change token para {self.biblioteca}, listando a biblioteca inteira")
+            return self.listar_tudo(), []
+
+        ids_alterados, removidos = self.estado.pendentes_delta(self.biblioteca)
+        if ids_alterados or removidos:
+            logging.info(f"Refazendo {len(ids_alterados)} alterações e {len(removidos)} remoções pendentes de {self.biblioteca}")
+        while True:
+            query = ChangeQuery(item=True, add=True, update=True, system_update=False, delete_object=True,
+                                role_assignment_add=False, role_assignment_delete=False,
+                                change_token_start=ChangeToken(token), fetch_limit=LIMITE_MUDANCAS)
+            changes = politica_retry.executa(lambda: self._lista().get_changes(query).execute_query(), 'sharepoint',
+                                             'ao consultar o change log', self.sharepoint._renova_se_expirado)
+            for change in changes:
+                if change.change_type == ChangeType.DeleteObject:
+                    removidos.append(change.unique_id)
+                    ids_alterados.discard(change.item_id)
+                elif change.change_type != ChangeType.NoChange:
+                    ids_alterados.add(change.item_id)
+                token = change.change_token.StringValue
+            if len(changes) < LIMITE_MUDANCAS:
+                break
+        self._token_pendente = token
+        self._removidos = set(removidos)
+        logging.info(f"Change log de {self.biblioteca}: {len(ids_alterados)} itens alterados, {len(removidos)} removidos")
+        return self._busca_por_ids(ids_alterados), removidos
+
+    def confirma(self, nao_aplicados=()):
+        """Grava o token lido, chamada depois que as mudanças foram processadas. Os unique_ids em nao_aplicados
+        (alterações ou remoções que falharam) ficam gravados com o token e voltam na próxima consulta"""
+        if not self._token_pendente:
+            return
+        alterados = [self._ids_item[file_id] for file_id in nao_aplicados if file_id in self._ids_item]
+        removidos = [file_id for file_id in nao_aplicados if file_id in self._removidos]
+        if alterados or removidos:
+            logging.info(f"{len(alterados)} alterações e {len(removidos)} remoções não aplicadas em {self.biblioteca}, "
+                         f"ficam pendentes para a próxima execução")
+        self.estado.grava_token(self.biblioteca, self._token_pendente, alterados, removidos)
+        self._token_pendente = None
@@ -4,108 +4,369 @@ from pathlib import PurePath
 import time
 from datetime import datetime
 import modulo_fluig
+import gerenciador_sessao
+import metricas
+import pipeline
+from estado_sync import EstadoSync, ARQUIVO_ESTADO, ETAPA_LISTADO, ETAPA_BAIXADO, ETAPA_PUBLICADO
+from crawler_sharepoint import CrawlerSharePoint, descobrir_pastas, descobrir_pastas_lote, WORKERS_DESCOBERTA
+import hashlib
+from itertools import islice
 import shutil
 import logging
-import yaml
-
-data_hoje = datetime.now().strftime(r"%d-%m-%Y")
-# Configuração básica do logger
-logging.basicConfig(
-    filename=f'log/app-{data_hoje}.log',  # Especifica o arquivo de log
-    level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
-)
-
-with open(r'C:\Users\rpa\Documents\POC-SHAREPOINT\config.yaml', 'r', encoding='utf=8') as params:
-    config = yaml.safe_load(params)
-    sharepoint_doc = config['sharepoint']['sharepoint_doc_library']
-    pasta_download = config['sharepoint']['pasta_local_download']
+import configuracao
 
-#Pasta do sharepoint
-FOLDER_NAME = sharepoint_doc# r'COMUNICAO' #SHAREPOINT_DOC_LIBRARY no yaml
-#Pasta destino download
-FOLDER_DEST = pasta_download #r'C:\Users\rpa\Documents\POC-SHAREPOINT\download'
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    #Pasta do sharepoint
+    FOLDER_NAME=('sharepoint', 'sharepoint_doc_library'), # r'COMUNICAO' #SHAREPOINT_DOC_LIBRARY no yaml
+    #Pasta destino download
+    FOLDER_DEST=('sharepoint', 'pasta_local_download'), #r'C:\Users\rpa\Documents\POC-SHAREPOINT\download'
+    # Executa listagem, download e envio ao fluig em etapas paralelas (seção pipeline do yaml)
+    MODO_PIPELINE=('pipeline', 'ativo', False),
+    # Só transfere arquivos novos ou alterados, usando o índice de estado em vez de limpar a pasta de download
+    MODO_INCREMENTAL=('estado', 'ativo', True),
+    # Arquivo do índice de estado
+    ARQUIVO_ESTADO=('estado', 'arquivo', ARQUIVO_ESTADO),
+    # Remove do fluig os arquivos que foram removidos do SharePoint
+    REMOVER_NO_FLUIG=('estado', 'remover_no_fluig', False),
+    # Usa o change log do SharePoint (GetChanges) em vez de listar todas as pastas, depende do modo incremental
+    MODO_DELTA=lambda config: opcoes.MODO_INCREMENTAL and (config.get('delta') or {}).get('ativo', False),
+    # Lista a biblioteca inteira com uma consulta paginada em vez de percorrer as pastas
+    DESCOBERTA_RECURSIVA=('descoberta', 'recursiva', False),
+    # Envia o stream do SharePoint direto para o fluig, sem gravar o arquivo em disco
+    SEM_DISCO=('streaming', 'sem_disco', False),
+    # Agrupa as consultas de pastas e o download dos arquivos pequenos em requisições $batch
+    MODO_LOTE=('lote', 'ativo', False),
+)
 # Determina se são pastas e subpastas
 CRAWL_FOLDERS = "Yes"
+# Índice de estado da execução, aberto no main
+estado = None
+# Instância única, o contexto autenticado é reaproveitado em todas as chamadas
+sharepoint = SharePoint()
+# Cliente de $batch, criado pelo configura_lote só no modo lote (a lote_sharepoint importa boa parte da office365)
+lote = None
+
+def configura_lote():
+    "Cria o cliente de $batch se o modo lote estiver ativo"
+    global lote
+    if opcoes.MODO_LOTE and lote is None:
+        from lote_sharepoint import LoteSharePoint
+        lote = LoteSharePoint(sharepoint)
 
 def limpar_pasta_download():
     """Função para limpar a pasta de download do projeto"""
     #Verifica se a pasta existe
-    if os.path.exists(FOLDER_DEST):
-        shutil.rmtree(FOLDER_DEST)
+    if os.path.exists(opcoes.FOLDER_DEST):
+        shutil.rmtree(opcoes.FOLDER_DEST)
         logging.info("A pasta de download e todo o seu conteúdo foram excluídos.")
     else:
         logging.info("A pasta de download não existe.")
 
 def save_file(file_n, file_obj, subfolder):
     """Função para salvar arquivo localmente e no fluig"""
-    dir_path = PurePath(FOLDER_DEST, subfolder)
+    dir_path = PurePath(opcoes.FOLDER_DEST, subfolder)
     file_dir_path = PurePath(dir_path, file_n)
     with open(file_dir_path, 'wb') as f:
         f.write(file_obj)
+    return envia_fluig(file_dir_path)
+
+def envia_fluig(file_dir_path, conteudo=None, tamanho=None, impressao=None):
+    """Função para gravar o arquivo no fluig, a partir do arquivo local ou de um stream"""
     try:
-        modulo_fluig.main(file_dir_path)
+        documento_id = modulo_fluig.main(file_dir_path, conteudo, tamanho, impressao)
         logging.info(f"Arquivo salvo {file_dir_path}")
+        return documento_id
     except Exception as e:
         logging.error(f"Erro na hora de gravar no fluig: {e}")
         return e
 
 def create_dir(path):
     """Função para criar pasta se não existir"""
-    dir_path = PurePath(FOLDER_DEST, path)
+    dir_path = PurePath(opcoes.FOLDER_DEST, path)
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
         
 
-def get_file(file_n, folder):
-    "Função para obter o arquivo"
-    file_obj = SharePoint().download_file(file_n, folder)
-    save_file(file_n, file_obj, folder)
+def get_file(file_n, folder, propriedades=None):
+    "Função para obter o arquivo, baixado em stream para o disco ou enviado direto para o fluig"
+    file_dir_path = PurePath(opcoes.FOLDER_DEST, folder, file_n)
+    if publicado_anteriormente(propriedades, folder):
+        return
+    try:
+        if opcoes.SEM_DISCO:
+            with sharepoint.open_stream(file_n, folder) as response:
+                response.raw.decode_content = True
+                #Com Content-Encoding o Content-Length é do conteúdo compactado, então envia sem tamanho (chunked)
+                tamanho = None if response.headers.get('Content-Encoding') else response.headers.get('Content-Length')
+                documento_id = envia_fluig(file_dir_path, response.raw, int(tamanho) if tamanho else None)
+        else:
+            _, impressao = baixa_com_retomada(file_n, folder, propriedades)
+            documento_id = envia_fluig(file_dir_path, impressao=impressao)
+    except Exception as e:
+        logging.error(f"Erro ao baixar o arquivo {file_n}: {e}")
+        return
+    registra_estado(propriedades, folder, documento_id)
+
+def marca_jornada(propriedades, folder, etapa, **dados):
+    "Grava no journal a etapa concluída do arquivo, para uma execução interrompida continuar dela"
+    if estado is not None and propriedades is not None:
+        estado.marca_etapa(propriedades, folder, etapa, **dados)
+
+def etapa_jornada(propriedades):
+    "Etapa em que a mesma versão do arquivo parou numa execução interrompida, ou None"
+    if estado is None or propriedades is None:
+        return None
+    return estado.etapa_arquivo(propriedades)
+
+def publicado_anteriormente(propriedades, folder):
+    "Arquivo já publicado no fluig por uma execução interrompida antes de registrar o estado, só registra"
+    jornada = etapa_jornada(propriedades)
+    if jornada is None or jornada['etapa'] != ETAPA_PUBLICADO:
+        return False
+    logging.info(f"Arquivo {propriedades['file_name']} já publicado na execução anterior ({jornada['document_id']})")
+    registra_estado(propriedades, folder, jornada['document_id'])
+    return True
+
+def baixa_com_retomada(file_n, folder, propriedades):
+    "Baixa o arquivo para o disco aproveitando o que uma execução interrompida já baixou, retorna (tamanho, hash)"
+    file_dir_path = PurePath(opcoes.FOLDER_DEST, folder, file_n)
+    jornada = etapa_jornada(propriedades)
+    if jornada is not None and jornada['etapa'] == ETAPA_BAIXADO and os.path.exists(file_dir_path):
+        logging.info(f"Arquivo {file_n} já baixado na execução anterior")
+        return jornada['tamanho'], jornada['hash']
+    if jornada is None:
+        marca_jornada(propriedades, folder, ETAPA_LISTADO, caminho_local=file_dir_path)
+    #O .part só é continuado se for da mesma versão do arquivo (entrada do journal da execução anterior)
+    tamanho, impressao = sharepoint.download_file_to_path(file_n, folder, file_dir_path, retomar=jornada is not None)
+    marca_jornada(propriedades, folder, ETAPA_BAIXADO, tamanho=tamanho, hash_conteudo=impressao)
+    return tamanho, impressao
+
+def registra_estado(propriedades, folder, documento_id):
+    "Grava no índice de estado o arquivo que foi sincronizado com sucesso"
+    if estado is None or propriedades is None:
+        return
+    if documento_id is None or isinstance(documento_id, Exception):
+        return
+    #Publicado antes de registrar, se a execução cair aqui a próxima não envia de novo
+    marca_jornada(propriedades, folder, ETAPA_PUBLICADO, document_id=documento_id)
+    estado.registra(propriedades, folder, PurePath(opcoes.FOLDER_DEST, folder, propriedades['file_name']), documento_id)
+
+def arquivo_alterado(propriedades):
+    "Verifica no índice de estado se o arquivo precisa ser transferido"
+    return next(arquivos_alterados([propriedades]), None) is not None
+
+def arquivos_alterados(arquivos):
+    "Filtra os arquivos listados que precisam ser transferidos, marcando no índice os vistos de cada bloco de uma vez"
+    arquivos = iter(arquivos)
+    for bloco in iter(lambda: list(islice(arquivos, modulo_fluig.LOTE_NOMES)), []):
+        if estado is None:
+            yield from bloco
+            continue
+        #Marcados como vistos antes da transferência: se ela falhar, o arquivo continua no SharePoint e não é tratado como removido
+        estado.marca_vistos(bloco)
+        for propriedades in bloco:
+            if estado.mudou(propriedades):
+                yield propriedades
+            else:
+                logging.info(f"Arquivo sem alteração {propriedades['file_name']}")
   
 def get_files(folder):
     "Função para obter os arquivos"
-    files_list = SharePoint()._get_files_list(folder)
-    logging.info(f"Lista de arquivos: {files_list}")
+    # Arquivos lidos página a página, a pasta não é carregada inteira em memória
+    processa_arquivos(folder, (SharePoint.file_properties(file) for file in sharepoint.iter_files(folder)))
+
+def processa_arquivos(folder, arquivos):
+    "Transfere os arquivos novos ou alterados da pasta, a partir das propriedades listadas"
+    alterados = arquivos_alterados(arquivos)
+    #Em blocos: os nomes de cada bloco são consultados juntos no fluig e a pasta não fica inteira em memória
+    for bloco in iter(lambda: list(islice(alterados, modulo_fluig.LOTE_NOMES)), []):
+        modulo_fluig.prepara_arquivos(PurePath(opcoes.FOLDER_DEST, folder), [p['file_name'] for p in bloco])
+        if lote is not None and not opcoes.SEM_DISCO:
+            bloco = baixa_pequenos_em_lote(folder, bloco)
+        for propriedades in bloco:
+            get_file(propriedades['file_name'], folder, propriedades)
+
+def baixa_pequenos_em_lote(folder, alterados):
+    "Baixa juntos, em $batch, os arquivos pequenos da pasta e envia cada um ao fluig; retorna os que seguem no download normal"
+    import lote_sharepoint
+    tamanho_maximo = lote_sharepoint.opcoes.TAMANHO_MAXIMO
+    #Arquivos com entrada no journal continuam pelo caminho com retomada
+    pequenos = [p for p in alterados if (p['file_size'] or 0) <= tamanho_maximo and etapa_jornada(p) is None]
+    if len(pequenos) < 2:
+        return alterados
+    conteudos = lote.conteudos([(folder, p['file_name'], p['file_size']) for p in pequenos])
+    ids_pequenos = {p['file_id'] for p in pequenos}
+    restantes = [p for p in alterados if p['file_id'] not in ids_pequenos]
+    for propriedades in pequenos:
+        conteudo = conteudos[(folder, propriedades['file_name'])]
+        if isinstance(conteudo, Exception):
+            logging.info(f"Arquivo {propriedades['file_name']} não veio no lote ({conteudo}), baixando individualmente")
+            restantes.append(propriedades)
+            continue
+        grava_conteudo(propriedades, folder, conteudo)
+    return restantes
+
+def grava_conteudo(propriedades, folder, conteudo):
+    "Grava o conteúdo já baixado e envia ao fluig, com as mesmas etapas do journal do download em stream"
+    file_dir_path = PurePath(opcoes.FOLDER_DEST, folder, propriedades['file_name'])
+    with open(file_dir_path, 'wb') as f:
+        f.write(conteudo)
+    impressao = hashlib.sha256(conteudo).hexdigest()
+    marca_jornada(propriedades, folder, ETAPA_BAIXADO, caminho_local=file_dir_path, tamanho=len(conteudo),
+                  hash_conteudo=impressao)
+    documento_id = envia_fluig(file_dir_path, impressao=impressao)
+    registra_estado(propriedades, folder, documento_id)
+
+def descobre_pastas():
+    "Lista todas as pastas com os arquivos de cada uma, retorna ((pasta, [propriedades]), completa)"
+    if opcoes.DESCOBERTA_RECURSIVA:
+        #Gerador, uma pasta por vez: a listagem da biblioteca fica no inventário com memória limitada
+        crawler = CrawlerSharePoint(estado, opcoes.FOLDER_NAME, sharepoint)
+        return crawler.listar_por_pasta(**configuracao.carregar().get('inventario', {})), True
+    if lote is not None:
+        return descobrir_pastas_lote(lote, opcoes.FOLDER_NAME)
+    return descobrir_pastas(sharepoint, opcoes.FOLDER_NAME,
+                            configuracao.carregar().get('descoberta', {}).get('workers', WORKERS_DESCOBERTA))
+
+def remove_arquivo(file_id, file_name, folder, caminho_local, documento_id):
+    "Trata um arquivo do índice que não existe mais no SharePoint"
+    logging.info(f"Arquivo removido do SharePoint: {folder}/{file_name}")
+    if opcoes.REMOVER_NO_FLUIG and documento_id:
+        response = modulo_fluig.remove_documento(documento_id)
+        if response.status_code not in (200, 204, 404):
+            logging.error(f"Erro ao remover documento {documento_id} do fluig: {response.status_code}")
+            return
+    if caminho_local and os.path.exists(caminho_local):
+        os.remove(caminho_local)
+    estado.remove(file_id)
 
-    for file in files_list:
-        get_file(file.name, folder)
+def processa_removidos():
+    "Trata os arquivos do índice que não foram vistos na listagem completa"
+    for linha in estado.removidos():
+        remove_arquivo(*linha)
 
+def main_delta():
+    "Processa só as mudanças da biblioteca desde o último change token"
+    crawler = CrawlerSharePoint(estado, opcoes.FOLDER_NAME, sharepoint)
+    alterados, removidos = crawler.mudancas()
+    #get_file e remove_arquivo registram o erro e seguem, o que não ficou no índice é refeito na próxima execução
+    nao_aplicados = []
+    for folder, propriedades in alterados:
+        create_dir(folder)
+        if arquivo_alterado(propriedades):
+            get_file(propriedades['file_name'], folder, propriedades)
+            if estado.mudou(propriedades):
+                nao_aplicados.append(propriedades['file_id'])
+    for file_id in removidos:
+        linha = estado.busca(file_id)
+        if linha is not None:
+            remove_arquivo(*linha)
+            if estado.busca(file_id) is not None:
+                nao_aplicados.append(file_id)
+    crawler.confirma(nao_aplicados)
+
+
+def listar_pasta(folder):
+    "Função da etapa de listagem do pipeline, retorna as subpastas e os arquivos da pasta"
+    create_dir(folder)
+    #Subpastas e arquivos na mesma consulta
+    folders, files = sharepoint.get_folder_contents(folder)
+    subpastas = ['/'.join([folder, subfolder.name]) for subfolder in folders] if CRAWL_FOLDERS == 'Yes' else []
+    arquivos = [(propriedades['file_name'], folder, propriedades)
+                for propriedades in arquivos_alterados(SharePoint.file_properties(file) for file in files)]
+    if arquivos:
+        modulo_fluig.prepara_arquivos(PurePath(opcoes.FOLDER_DEST, folder), [arquivo[0] for arquivo in arquivos])
+    return subpastas, arquivos
+
+def baixar_arquivo(arquivo):
+    "Função da etapa de download do pipeline, grava o arquivo localmente"
+    file_n, folder, propriedades = arquivo
+    file_dir_path = PurePath(opcoes.FOLDER_DEST, folder, file_n)
+    if publicado_anteriormente(propriedades, folder):
+        return None, 0
+    tamanho, impressao = baixa_com_retomada(file_n, folder, propriedades)
+    return (file_dir_path, arquivo, impressao), tamanho
+
+def publicar_arquivo(baixado):
+    "Função da etapa de envio do pipeline, grava o arquivo no fluig"
+    file_dir_path, (_, folder, propriedades), impressao = baixado
+    documento_id = modulo_fluig.main(file_dir_path, impressao=impressao)
+    logging.info(f"Arquivo salvo {file_dir_path}")
+    registra_estado(propriedades, folder, documento_id)
+
+def main_pipeline():
+    "Executa a cópia com as etapas em paralelo, retorna False se alguma pasta não pôde ser listada"
+    config_pipeline = configuracao.carregar().get('pipeline', {})
+    est_listagem, _, _ = pipeline.executar(
+        [opcoes.FOLDER_NAME],
+        listar_pasta,
+        baixar_arquivo,
+        publicar_arquivo,
+        workers_listagem=config_pipeline.get('workers_listagem', 2),
+        workers_download=config_pipeline.get('workers_download', 4),
+        workers_upload=config_pipeline.get('workers_upload', 4),
+        tamanho_fila=config_pipeline.get('tamanho_fila', 50),
+    )
+    return est_listagem.erros == 0
         
 # get back a list of subfolders from specific folder
 def get_folders(folder):
     l = []
-    folder_obj = SharePoint().get_folder_list(folder)
+    folder_obj = sharepoint.get_folder_list(folder)
     for subfolder_obj in folder_obj:
         subfolder = '/'.join([folder, subfolder_obj.name])
         l.append(subfolder)
     return l
 
 def main():
-    limpar_pasta_download()
+    global estado
+    configuracao.configura_log()
+    configura_lote()
+    if opcoes.MODO_INCREMENTAL:
+        estado = EstadoSync(opcoes.ARQUIVO_ESTADO)
+        modulo_fluig.configura_estado(estado)
+        pendentes = estado.pendentes_jornada()
+        if pendentes:
+            logging.info(f"Retomando a execução interrompida, arquivos em andamento por etapa: {pendentes}")
+    else:
+        limpar_pasta_download()
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
     start_time = time.time()
     logging.info(f"Inicio: {datetime.now()}")
 
     try:
-        if CRAWL_FOLDERS == 'Yes':
-            folder_list = get_folders(FOLDER_NAME)
-            for folder in folder_list:
-                for subfolder in get_folders(folder):
-                    folder_list.append(subfolder)
-                    
-            folder_list[:0] = [FOLDER_NAME]
-            logging.info(f"Pastas: {folder_list}")
-            for folder in folder_list:
+        listagem_completa = True
+        if opcoes.MODO_DELTA:
+            main_delta()
+            #Remoções já vêm do change log
+            listagem_completa = False
+        elif opcoes.MODO_PIPELINE:
+            listagem_completa = main_pipeline()
+        elif CRAWL_FOLDERS == 'Yes':
+            # Pastas e arquivos descobertos de uma vez, sem consultar cada pasta de novo
+            pastas, listagem_completa = descobre_pastas()
+            for folder, arquivos in pastas:
                 # Cria a pasta se ela não existir
                 create_dir(folder)
                 # Pega os arquivos especificos dessa pasta
                 logging.info(f"PASTA CRIADA {folder}, tentar criar os arquivos")
-                get_files(folder)
+                processa_arquivos(folder, arquivos)
         else:
-            get_files(FOLDER_NAME)
+            get_files(opcoes.FOLDER_NAME)
+        # Só é seguro detectar remoções se todas as pastas foram listadas
+        if estado is not None and CRAWL_FOLDERS == 'Yes' and listagem_completa:
+            processa_removidos()
     except Exception as e:
         logging.error(f"Erro: {e}")
         return e
-    
+    finally:
+        modulo_fluig.resumo_deduplicacao()
+        modulo_fluig.salvar_cache_pastas()
+        metricas.finaliza()
+        gerenciador_sessao.fechar()
+        if estado is not None:
+            estado.fechar()
     
     elapsed_time = time.time() - start_time
     logging.info(f"Tempo decorrido: {elapsed_time}")
@@ -1,115 +1,213 @@
 from office365_api import SharePoint
 import sys, os
 from pathlib import PurePath
+from itertools import islice
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import modulo_fluig
+import gerenciador_sessao
+import metricas
+from estado_sync import EstadoSync, ARQUIVO_ESTADO
+from crawler_sharepoint import CrawlerSharePoint, descobrir_pastas, WORKERS_DESCOBERTA
 import shutil
 import logging
-import yaml
-
-data_hoje = datetime.now().strftime(r"%d-%m-%Y")
-# Configuração básica do logger
-logging.basicConfig(
-    filename=f'log/app-{data_hoje}.log',  # Especifica o arquivo de log
-    level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
-)
-
-with open(r'C:\Users\rpa\Documents\POC-SHAREPOINT\config.yaml', 'r', encoding='utf=8') as params:
-    config = yaml.safe_load(params)
-    sharepoint_doc = config['sharepoint']['sharepoint_doc_library']
-    pasta_download = config['sharepoint']['pasta_local_download']
+import configuracao
 
-#Pasta do sharepoint
-FOLDER_NAME = sharepoint_doc #r'COMUNICAO' #SHAREPOINT_DOC_LIBRARY no yaml
-#Pasta destino download
-FOLDER_DEST = pasta_download #r'C:\Users\rpa\Documents\POC-SHAREPOINT\download'
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    #Pasta do sharepoint
+    FOLDER_NAME=('sharepoint', 'sharepoint_doc_library'), #r'COMUNICAO' #SHAREPOINT_DOC_LIBRARY no yaml
+    #Pasta destino download
+    FOLDER_DEST=('sharepoint', 'pasta_local_download'), #r'C:\Users\rpa\Documents\POC-SHAREPOINT\download'
+    # Só transfere arquivos novos ou alterados, usando o índice de estado em vez de limpar a pasta de download
+    MODO_INCREMENTAL=('estado', 'ativo', True),
+    # Arquivo do índice de estado
+    ARQUIVO_ESTADO=('estado', 'arquivo', ARQUIVO_ESTADO),
+    # Consulta única da biblioteca com o filtro de Modified no servidor, em vez de listar todas as pastas
+    MODO_DELTA=('delta', 'ativo', False),
+    # Lista a biblioteca inteira com uma consulta paginada (filtrando a data no SharePoint) em vez de percorrer as pastas
+    DESCOBERTA_RECURSIVA=('descoberta', 'recursiva', False),
+    # Envia o stream do SharePoint direto para o fluig, sem gravar o arquivo em disco
+    SEM_DISCO=('streaming', 'sem_disco', False),
+)
 # Determina se são pastas e subpastas
 CRAWL_FOLDERS = "Yes"
+# Dias considerados como recentes
+DIAS_RECENTES = 2
+# Data inicial informada na linha de comando (sync recent-since --desde), substitui os DIAS_RECENTES
+DATA_INICIAL = None
+# Índice de estado da execução, aberto no main
+estado = None
+# Instância única, o contexto autenticado é reaproveitado em todas as chamadas
+sharepoint = SharePoint()
 
 def limpar_pasta_download():
     """Função para limpar a pasta de download do projeto"""
     #Verifica se a pasta existe
-    if os.path.exists(FOLDER_DEST):
-        shutil.rmtree(FOLDER_DEST)
+    if os.path.exists(opcoes.FOLDER_DEST):
+        shutil.rmtree(opcoes.FOLDER_DEST)
         logging.info("A pasta de download e todo o seu conteúdo foram excluídos.")
     else:
         logging.info("A pasta de download não existe.")
 
+def data_inicial():
+    """A partir de quando os arquivos são considerados recentes: a data informada ou os últimos DIAS_RECENTES.
+    Em UTC sem fuso, como o TimeLastModified do SharePoint usado no filtro e na comparação"""
+    if DATA_INICIAL is not None:
+        #A data do --desde/--dias é local
+        return DATA_INICIAL.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=DIAS_RECENTES)
+
 def save_file(file_n, file_obj, subfolder):
     """Função para salvar arquivo localmente e no fluig"""
-    dir_path = PurePath(FOLDER_DEST, subfolder)
+    dir_path = PurePath(opcoes.FOLDER_DEST, subfolder)
     file_dir_path = PurePath(dir_path, file_n)
     with open(file_dir_path, 'wb') as f:
         f.write(file_obj)
+    return envia_fluig(file_dir_path)
+
+def envia_fluig(file_dir_path, conteudo=None, tamanho=None, impressao=None):
+    """Função para gravar o arquivo no fluig, a partir do arquivo local ou de um stream"""
     try:
-        modulo_fluig.main(file_dir_path)
+        documento_id = modulo_fluig.main(file_dir_path, conteudo, tamanho, impressao)
         logging.info(f"Arquivo salvo {file_dir_path}")
+        return documento_id
     except Exception as e:
         logging.error(f"Erro na hora de gravar no fluig: {e}")
 
 def create_dir(path):
     """Função para criar pasta se não existir"""
-    dir_path = PurePath(FOLDER_DEST, path)
+    dir_path = PurePath(opcoes.FOLDER_DEST, path)
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
 
-def get_file(file_n, folder):
-    "Função para obter o arquivo"
-    file_obj = SharePoint().download_file(file_n, folder)
-    save_file(file_n, file_obj, folder)
+def get_file(file_n, folder, propriedades=None):
+    "Função para obter o arquivo, baixado em stream para o disco ou enviado direto para o fluig"
+    file_dir_path = PurePath(opcoes.FOLDER_DEST, folder, file_n)
+    try:
+        if opcoes.SEM_DISCO:
+            with sharepoint.open_stream(file_n, folder) as response:
+                response.raw.decode_content = True
+                #Com Content-Encoding o Content-Length é do conteúdo compactado, então envia sem tamanho (chunked)
+                tamanho = None if response.headers.get('Content-Encoding') else response.headers.get('Content-Length')
+                documento_id = envia_fluig(file_dir_path, response.raw, int(tamanho) if tamanho else None)
+        else:
+            _, impressao = sharepoint.download_file_to_path(file_n, folder, file_dir_path)
+            documento_id = envia_fluig(file_dir_path, impressao=impressao)
+    except Exception as e:
+        logging.error(f"Erro ao baixar o arquivo {file_n}: {e}")
+        return
+    if estado is not None and propriedades is not None and documento_id is not None:
+        estado.registra(propriedades, folder, PurePath(opcoes.FOLDER_DEST, folder, file_n), documento_id)
  
 def get_files(folder):
     """Função para pegar os arquivos apenas pelos recentes, considerando 2 dias, configurado no timedelta"""
-    files_list = SharePoint()._get_files_list(folder)
-    logging.info(f"Lista de arquivos: {files_list}")
-    data_atual = datetime.now()
-    data_menos_2 = data_atual - timedelta(days=2)
-
-    for file in files_list:
-        #Condição verificando a propriedade do Sharepoint de Tempo da ultima modificação
-        if file.time_last_modified >= data_menos_2:
-            get_file(file.name, folder)
-        else:
-            logging.info(f"Arquivo não é recente {file.name}")
+    data_menos_2 = data_inicial()
+    # Só os modificados no período, filtrados e paginados no SharePoint
+    arquivos = sharepoint.iter_files(folder, modificado_desde=data_menos_2)
+    processa_arquivos(folder, (SharePoint.file_properties(file) for file in arquivos))
+
+def transferir(propriedades, data_menos_2):
+    """Verifica se o arquivo é recente e ainda não foi sincronizado"""
+    #Condição verificando a propriedade do Sharepoint de Tempo da ultima modificação
+    if propriedades['time_last_modified'] < data_menos_2:
+        logging.info(f"Arquivo não é recente {propriedades['file_name']}")
+        return False
+    #Arquivo recente mas já sincronizado em uma execução anterior
+    if estado is not None and not estado.mudou(propriedades):
+        logging.info(f"Arquivo sem alteração {propriedades['file_name']}")
+        return False
+    return True
+
+def processa_arquivos(folder, arquivos):
+    """Transfere os arquivos recentes da pasta, a partir das propriedades listadas"""
+    data_menos_2 = data_inicial()
+    recentes = (propriedades for propriedades in arquivos if transferir(propriedades, data_menos_2))
+    #Em blocos: os nomes de cada bloco são consultados juntos no fluig
+    for bloco in iter(lambda: list(islice(recentes, modulo_fluig.LOTE_NOMES)), []):
+        modulo_fluig.prepara_arquivos(PurePath(opcoes.FOLDER_DEST, folder), [p['file_name'] for p in bloco])
+        for propriedades in bloco:
+            get_file(propriedades['file_name'], folder, propriedades)
+
+
+def get_files_delta():
+    """Função para pegar os arquivos recentes com uma única consulta paginada, filtrando a data no SharePoint"""
+    crawler = CrawlerSharePoint(estado, opcoes.FOLDER_NAME, sharepoint)
+    data_menos_2 = data_inicial()
+    for folder, propriedades in crawler.listar_tudo(modificado_desde=data_menos_2):
+        if estado is not None and not estado.mudou(propriedades):
+            logging.info(f"Arquivo sem alteração {propriedades['file_name']}")
+            continue
+        create_dir(folder)
+        get_file(propriedades['file_name'], folder, propriedades)
                 
+def get_latest(folder):
+    """Função para transferir só o arquivo mais recente da pasta, ordenado no SharePoint"""
+    latest_files = sharepoint.get_latest_files(folder, 1)
+    if not latest_files:
+        logging.info(f"Nenhum arquivo na pasta {folder}")
+        return
+    propriedades = SharePoint.file_properties(latest_files[0])
+    if estado is not None and not estado.mudou(propriedades):
+        logging.info(f"Arquivo sem alteração {propriedades['file_name']}")
+        return
+    create_dir(folder)
+    get_file(propriedades['file_name'], folder, propriedades)
+
 def get_folders(folder):
     """Função para pegar uma lista de subpastas de uma pasta"""
     l = []
-    folder_obj = SharePoint().get_folder_list(folder)
+    folder_obj = sharepoint.get_folder_list(folder)
     for subfolder_obj in folder_obj:
         subfolder = '/'.join([folder, subfolder_obj.name])
         l.append(subfolder)
     return l
 
-def main():
-    limpar_pasta_download()
+def main(desde=None, pasta_mais_recente=None):
+    """Sincroniza os arquivos recentes. Com desde, considera recentes os modificados a partir da data;
+    com pasta_mais_recente, transfere só o arquivo mais recente dessa pasta"""
+    global estado, DATA_INICIAL
+    configuracao.configura_log()
+    if desde is not None:
+        DATA_INICIAL = desde
+    if opcoes.MODO_INCREMENTAL:
+        estado = EstadoSync(opcoes.ARQUIVO_ESTADO)
+        modulo_fluig.configura_estado(estado)
+    else:
+        limpar_pasta_download()
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
     start_time = time.time()
     logging.info(f"Inicio: {datetime.now()}")
 
     try:
-        if CRAWL_FOLDERS == 'Yes':
-            folder_list = get_folders(FOLDER_NAME)
-            for folder in folder_list:
-                for subfolder in get_folders(folder):
-                    folder_list.append(subfolder)
-                    
-            folder_list[:0] = [FOLDER_NAME]
-            logging.info(f"Pastas: {folder_list}")
-
-            for folder in folder_list:
+        if pasta_mais_recente is not None:
+            get_latest(pasta_mais_recente)
+        elif opcoes.MODO_DELTA or opcoes.DESCOBERTA_RECURSIVA:
+            get_files_delta()
+        elif CRAWL_FOLDERS == 'Yes':
+            # Pastas e arquivos descobertos de uma vez, listando várias pastas ao mesmo tempo
+            workers = configuracao.carregar().get('descoberta', {}).get('workers', WORKERS_DESCOBERTA)
+            pastas, _ = descobrir_pastas(sharepoint, opcoes.FOLDER_NAME, workers)
+            logging.info(f"Pastas: {[folder for folder, _ in pastas]}")
+
+            for folder, arquivos in pastas:
                 # Cria a pasta se ela não existir
                 create_dir(folder)
                 # Pega os arquivos especificos dessa pasta
                 logging.info(f"PASTA CRIADA {folder}, tentar criar os arquivos")
-                get_files(folder)
+                processa_arquivos(folder, arquivos)
         else:
-            get_files(FOLDER_NAME)
+            get_files(opcoes.FOLDER_NAME)
     except Exception as e:
         logging.error(f"Erro: {e}")
         return e
-    
+    finally:
+        modulo_fluig.resumo_deduplicacao()
+        modulo_fluig.salvar_cache_pastas()
+        metricas.finaliza()
+        gerenciador_sessao.fechar()
+        if estado is not None:
+            estado.fechar()
     
     elapsed_time = time.time() - start_time
     logging.info(f"Tempo decorrido: {elapsed_time}")
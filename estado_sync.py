@@ -0,0 +1,307 @@
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+
+# Arquivo padrão do índice de estado, fica ao lado dos scripts
+ARQUIVO_ESTADO = 'estado_sync.db'
+# Etapas do journal de cada arquivo em andamento, na ordem em que acontecem
+ETAPA_LISTADO = 'listado'
+ETAPA_BAIXADO = 'baixado'
+ETAPA_PUBLICADO = 'publicado'
+
+
+class EstadoSync:
+    """Índice persistente (SQLite) dos arquivos já sincronizados, chaveado pelo unique_id do SharePoint"""
+
+    def __init__(self, caminho=ARQUIVO_ESTADO):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS arquivos (
+                file_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                pasta TEXT,
+                time_last_modified TEXT,
+                file_size INTEGER,
+                major_version INTEGER,
+                minor_version INTEGER,
+                caminho_local TEXT,
+                document_id TEXT,
+                execucao TEXT
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tokens (
+                biblioteca TEXT PRIMARY KEY,
+                token TEXT
+            )"""
+        )
+        #Mudanças do change log que não foram aplicadas (falha no download/envio ou na remoção), refeitas na próxima
+        #consulta; tipo 'alterado' guarda o Id do item da lista e 'removido' o unique_id do arquivo
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pendentes_delta (
+                biblioteca TEXT,
+                tipo TEXT,
+                chave TEXT,
+                PRIMARY KEY (biblioteca, tipo, chave)
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS documentos_fluig (
+                document_id TEXT PRIMARY KEY,
+                hash TEXT,
+                tamanho INTEGER
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documentos_fluig_hash ON documentos_fluig (hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS arquivos_document_id ON arquivos (document_id)")
+        #Journal dos arquivos em andamento, a linha é removida quando o arquivo é registrado como sincronizado
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jornada (
+                file_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                pasta TEXT,
+                versao TEXT,
+                etapa TEXT,
+                caminho_local TEXT,
+                tamanho INTEGER,
+                hash TEXT,
+                document_id TEXT,
+                atualizado_em TEXT
+            )"""
+        )
+        #Sessões de upload em blocos para o SharePoint ainda não finalizadas
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS sessoes_upload (
+                destino TEXT PRIMARY KEY,
+                upload_id TEXT,
+                offset INTEGER,
+                tamanho INTEGER
+            )"""
+        )
+        #Última versão de cada documento do fluig já tratada pela sincronização reversa (fluig -> SharePoint)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS reverso (
+                document_id TEXT PRIMARY KEY,
+                versao TEXT,
+                hash TEXT
+            )"""
+        )
+        self._conn.commit()
+        #Identificador da execução atual, usado para detectar arquivos removidos
+        self.execucao = datetime.now().isoformat()
+
+    def mudou(self, propriedades):
+        """Retorna True se o arquivo é novo, foi alterado ou não chegou a ser gravado no fluig"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT time_last_modified, file_size, major_version, minor_version, document_id "
+                "FROM arquivos WHERE file_id = ?",
+                (propriedades['file_id'],)
+            ).fetchone()
+        if linha is None or linha[4] is None:
+            return True
+        atual = (str(propriedades['time_last_modified']), propriedades['file_size'],
+                 propriedades['major_version'], propriedades['minor_version'])
+        return tuple(linha[:4]) != atual
+
+    def marca_vistos(self, lista_propriedades):
+        """Marca os arquivos como presentes no SharePoint nessa execução, chamada para todo arquivo listado
+        (alterado ou não) antes da transferência; um único commit para a lista (ex: um bloco da pasta)"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE arquivos SET execucao = ? WHERE file_id = ?",
+                [(self.execucao, propriedades['file_id']) for propriedades in lista_propriedades]
+            )
+            self._conn.commit()
+
+    def registra(self, propriedades, pasta, caminho_local, document_id):
+        """Grava o estado do arquivo após a sincronização e encerra a entrada dele no journal"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (propriedades['file_id'], propriedades['file_name'], pasta,
+                 str(propriedades['time_last_modified']), propriedades['file_size'],
+                 propriedades['major_version'], propriedades['minor_version'],
+                 str(caminho_local), document_id, self.execucao)
+            )
+            self._conn.execute("DELETE FROM jornada WHERE file_id = ?", (propriedades['file_id'],))
+            self._conn.commit()
+
+    @staticmethod
+    def _versao(propriedades):
+        """Identifica a versão do arquivo no SharePoint, o journal só vale para a mesma versão"""
+        return '|'.join(str(propriedades[campo]) for campo in
+                        ('time_last_modified', 'file_size', 'major_version', 'minor_version'))
+
+    def marca_etapa(self, propriedades, pasta, etapa, caminho_local=None, tamanho=None, hash_conteudo=None,
+                    document_id=None):
+        """Grava no journal a etapa concluída do arquivo; os dados não informados mantêm o valor anterior"""
+        versao = self._versao(propriedades)
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT versao, caminho_local, tamanho, hash, document_id FROM jornada WHERE file_id = ?",
+                (propriedades['file_id'],)
+            ).fetchone()
+            #Entrada de outra versão do arquivo é descartada
+            anteriores = linha[1:] if linha is not None and linha[0] == versao else (None, None, None, None)
+            novos = (None if caminho_local is None else str(caminho_local), tamanho, hash_conteudo,
+                     None if document_id is None else str(document_id))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jornada VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (propriedades['file_id'], propriedades['file_name'], pasta, versao, etapa)
+                + tuple(novo if novo is not None else anterior for novo, anterior in zip(novos, anteriores))
+                + (datetime.now().isoformat(),)
+            )
+            self._conn.commit()
+
+    def etapa_arquivo(self, propriedades):
+        """Entrada do journal deixada por uma execução interrompida para essa mesma versão do arquivo, ou None.
+        Retorna um dict com etapa, caminho_local, tamanho, hash e document_id"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT etapa, caminho_local, tamanho, hash, document_id FROM jornada WHERE file_id = ? AND versao = ?",
+                (propriedades['file_id'], self._versao(propriedades))
+            ).fetchone()
+        if linha is None:
+            return None
+        return dict(zip(('etapa', 'caminho_local', 'tamanho', 'hash', 'document_id'), linha))
+
+    def pendentes_jornada(self):
+        """Quantidade de arquivos por etapa que ficaram em andamento"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT etapa, COUNT(*) FROM jornada GROUP BY etapa").fetchall())
+
+    def sessao_upload(self, destino):
+        """(upload_id, offset, tamanho) da sessão de upload em blocos interrompida para o destino, ou None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT upload_id, offset, tamanho FROM sessoes_upload WHERE destino = ?", (destino,)
+            ).fetchone()
+
+    def grava_sessao_upload(self, destino, upload_id, offset, tamanho):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessoes_upload VALUES (?, ?, ?, ?)",
+                               (destino, upload_id, offset, tamanho))
+            self._conn.commit()
+
+    def remove_sessao_upload(self, destino):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessoes_upload WHERE destino = ?", (destino,))
+            self._conn.commit()
+
+    def get_document_id(self, file_id):
+        """documentId no fluig do arquivo, se já foi sincronizado"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT document_id FROM arquivos WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def busca(self, file_id):
+        """Linha do arquivo no índice (file_id, file_name, pasta, caminho_local, document_id)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, file_name, pasta, caminho_local, document_id FROM arquivos WHERE file_id = ?",
+                (file_id,)
+            ).fetchone()
+
+    def busca_por_documento(self, document_id):
+        """Linha do arquivo do SharePoint sincronizado com o documento do fluig
+        (file_id, file_name, pasta, caminho_local, document_id), ou None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, file_name, pasta, caminho_local, document_id FROM arquivos WHERE document_id = ?",
+                (str(document_id),)
+            ).fetchone()
+
+    def versao_reversa(self, document_id):
+        """Versão do documento do fluig tratada por último na sincronização reversa"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT versao FROM reverso WHERE document_id = ?", (str(document_id),)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def grava_versao_reversa(self, document_id, versao, hash_conteudo):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO reverso VALUES (?, ?, ?)",
+                               (str(document_id), str(versao), hash_conteudo))
+            self._conn.commit()
+
+    def get_token(self, biblioteca):
+        """Último change token do SharePoint processado para a biblioteca"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT token FROM tokens WHERE biblioteca = ?", (biblioteca,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def grava_token(self, biblioteca, token, alterados=(), removidos=()):
+        """Grava o token junto com as mudanças que ficaram pendentes até ele, na mesma transação"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?)", (biblioteca, token))
+            self._conn.execute("DELETE FROM pendentes_delta WHERE biblioteca = ?", (biblioteca,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pendentes_delta VALUES (?, ?, ?)",
+                [(biblioteca, 'alterado', str(item_id)) for item_id in alterados]
+                + [(biblioteca, 'removido', str(file_id)) for file_id in removidos]
+            )
+            self._conn.commit()
+
+    def pendentes_delta(self, biblioteca):
+        """(ids de itens alterados, unique_ids removidos) que não foram aplicados nas execuções anteriores"""
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT tipo, chave FROM pendentes_delta WHERE biblioteca = ?", (biblioteca,)
+            ).fetchall()
+        alterados = {int(chave) for tipo, chave in linhas if tipo == 'alterado'}
+        removidos = [chave for tipo, chave in linhas if tipo == 'removido']
+        return alterados, removidos
+
+    def hash_documento(self, document_id):
+        """Hash do conteúdo enviado por último para o documento do fluig"""
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT hash FROM documentos_fluig WHERE document_id = ?", (str(document_id),)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def grava_hash_documento(self, document_id, hash_conteudo, tamanho):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documentos_fluig VALUES (?, ?, ?)",
+                (str(document_id), hash_conteudo, tamanho)
+            )
+            self._conn.commit()
+
+    def documentos_com_hash(self, hash_conteudo):
+        """documentIds do fluig que já têm esse mesmo conteúdo"""
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT document_id FROM documentos_fluig WHERE hash = ?", (hash_conteudo,)
+            ).fetchall()
+        return [linha[0] for linha in linhas]
+
+    def removidos(self):
+        """Arquivos que não foram vistos na execução atual (removidos do SharePoint), só vale depois de uma
+        listagem completa. Falhas de transferência não entram aqui, o arquivo já foi marcado como visto"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, file_name, pasta, caminho_local, document_id FROM arquivos WHERE execucao != ?",
+                (self.execucao,)
+            ).fetchall()
+
+    def remove(self, file_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM arquivos WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM jornada WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+        logging.info(f"Estado da sincronização gravado em {self.caminho}")
@@ -0,0 +1,190 @@
+import threading
+import time
+import logging
+import requests
+import politica_retry
+from requests.adapters import HTTPAdapter
+#A office365 e o requests_oauthlib são importados só na criação das sessões, a importação do módulo fica leve
+
+#Quantidade de conexões keep-alive mantidas por host
+POOL_SIZE = 10
+#Tempo de vida do token do SharePoint antes de autenticar novamente (cookie SAML expira em ~1h)
+TTL_SHAREPOINT = 50 * 60
+
+_lock = threading.Lock()
+_local = threading.local()
+_sessao_http = None
+_sessao_fluig = None
+_auth_sharepoint = None
+_auth_sharepoint_criado_em = 0
+_geracao_sharepoint = 0
+
+
+def configurar(pool_size=None, ttl_sharepoint_minutos=None):
+    """Ajusta os parâmetros das sessões, deve ser chamada antes da primeira requisição"""
+    global POOL_SIZE, TTL_SHAREPOINT
+    if pool_size:
+        POOL_SIZE = int(pool_size)
+    if ttl_sharepoint_minutos:
+        TTL_SHAREPOINT = int(ttl_sharepoint_minutos) * 60
+
+
+def _monta_adapter(sessao):
+    """Monta o pool de conexões keep-alive na sessão"""
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    sessao.mount('https://', adapter)
+    sessao.mount('http://', adapter)
+    return sessao
+
+
+def sessao_http():
+    """Sessão HTTP com pool de conexões usada pelas chamadas do SharePoint"""
+    global _sessao_http
+    with _lock:
+        if _sessao_http is None:
+            _sessao_http = _monta_adapter(requests.Session())
+        return _sessao_http
+
+
+class _SessaoFluig(requests.Session):
+    """Sessão OAuth1 com limite de taxa e novas tentativas para respostas de throttling/indisponibilidade"""
+
+    def __init__(self, client_key, client_secret, resource_owner_key, resource_owner_secret):
+        from requests_oauthlib import OAuth1
+        super().__init__()
+        self.auth = OAuth1(client_key, client_secret=client_secret, resource_owner_key=resource_owner_key,
+                           resource_owner_secret=resource_owner_secret)
+
+    def rebuild_auth(self, prepared_request, response):
+        #Em redirecionamentos a assinatura é refeita, o nonce não pode ser reaproveitado (como no OAuth1Session)
+        if 'Authorization' in prepared_request.headers:
+            prepared_request.headers.pop('Authorization', True)
+            prepared_request.prepare_auth(self.auth)
+
+    def request(self, method, url, *args, **kwargs):
+        corpo = kwargs.get('data')
+        #Corpos em stream só podem ser reenviados se puderem voltar ao início
+        reenviavel = corpo is None or isinstance(corpo, (bytes, str, dict)) or (hasattr(corpo, 'reinicia') and corpo.reinicia())
+        for tentativa in range(politica_retry.TENTATIVAS):
+            ultima = tentativa == politica_retry.TENTATIVAS - 1
+            if tentativa and hasattr(corpo, 'reinicia'):
+                corpo.reinicia()
+            politica_retry.limita('fluig')
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if ultima or not reenviavel or not politica_retry.pode_reenviar(method, erro=e):
+                    raise
+                segundos = politica_retry.espera(tentativa)
+                logging.info(f"Erro de conexão com o fluig: {e}, tentando novamente em {segundos:.1f}s")
+                time.sleep(segundos)
+                continue
+            #POST (cria_pasta, upload/publish, updateFile) só é repetido se o fluig não chegou a processá-lo
+            if ultima or not reenviavel or not politica_retry.pode_reenviar(method, response=response):
+                return response
+            segundos = politica_retry.espera(tentativa, response)
+            logging.info(f"Fluig respondeu {response.status_code}, tentando novamente em {segundos:.1f}s")
+            time.sleep(segundos)
+
+
+def _executa_com_pool(cliente, sessao):
+    """Substitui o execute_request_direct da biblioteca (que abre uma conexão por chamada) por um que usa a sessão"""
+    from office365.runtime.http.http_method import HttpMethod
+
+    def execute_request_direct(request):
+        cliente.beforeExecute.notify(request)
+        politica_retry.limita('sharepoint')
+        kwargs = {
+            'headers': request.headers,
+            'auth': request.auth,
+            'verify': request.verify,
+            'proxies': request.proxies,
+        }
+        if request.method in (HttpMethod.Post, HttpMethod.Patch):
+            if request.is_bytes or request.is_file:
+                kwargs['data'] = request.data
+            else:
+                kwargs['json'] = request.data
+        elif request.method == HttpMethod.Put:
+            kwargs['data'] = request.data
+        elif request.method == HttpMethod.Get:
+            kwargs['stream'] = request.stream
+        return sessao.request(request.method, request.url, **kwargs)
+    cliente.execute_request_direct = execute_request_direct
+
+
+def _autenticacao_sharepoint(site, usuario, senha, token=None):
+    """Autentica uma única vez e renova o token quando passa do TTL. Com token, usa o Bearer fixo no lugar do login"""
+    global _auth_sharepoint, _auth_sharepoint_criado_em, _geracao_sharepoint
+    from office365.runtime.auth.authentication_context import AuthenticationContext
+    from office365.runtime.auth.user_credential import UserCredential
+    from office365.runtime.auth.token_response import TokenResponse
+    with _lock:
+        expirado = time.time() - _auth_sharepoint_criado_em > TTL_SHAREPOINT
+        if _auth_sharepoint is None or expirado:
+            if _auth_sharepoint is not None:
+                logging.info("Token do SharePoint expirado, autenticando novamente")
+            auth = AuthenticationContext(site)
+            if token:
+                auth.with_access_token(lambda: TokenResponse(token, 'Bearer'))
+            else:
+                auth.with_credentials(UserCredential(usuario, senha))
+            _auth_sharepoint = auth
+            _auth_sharepoint_criado_em = time.time()
+            _geracao_sharepoint += 1
+        return _auth_sharepoint, _geracao_sharepoint
+
+
+def contexto_sharepoint(site, usuario, senha, token=None):
+    """ClientContext autenticado, um por thread (o ClientContext guarda a fila de consultas e não é thread-safe),
+    compartilhando a mesma autenticação e o mesmo pool de conexões"""
+    auth, geracao = _autenticacao_sharepoint(site, usuario, senha, token)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.geracao != geracao:
+        from office365.sharepoint.client_context import ClientContext
+        conn = ClientContext(site, auth)
+        _executa_com_pool(conn.pending_request(), sessao_http())
+        _local.conn = conn
+        _local.geracao = geracao
+    return conn
+
+
+def cliente_lote_sharepoint(conn, cliente):
+    """Prepara o cliente de $batch com a autenticação do contexto e o pool de conexões compartilhado"""
+    cliente.beforeExecute += conn._authenticate_request
+    cliente.beforeExecute += conn._ensure_form_digest
+    _executa_com_pool(cliente, sessao_http())
+    return cliente
+
+
+def renovar_sharepoint():
+    """Força nova autenticação no SharePoint na próxima chamada (ex: após um 401/403)"""
+    global _auth_sharepoint_criado_em
+    with _lock:
+        _auth_sharepoint_criado_em = 0
+
+
+def sessao_fluig(client_key, client_secret, resource_owner_key, resource_owner_secret):
+    """Sessão OAuth1 única para o Fluig, com pool de conexões keep-alive"""
+    global _sessao_fluig
+    with _lock:
+        if _sessao_fluig is None:
+            _sessao_fluig = _monta_adapter(
+                _SessaoFluig(client_key, client_secret, resource_owner_key, resource_owner_secret)
+            )
+        return _sessao_fluig
+
+
+def fechar():
+    """Fecha as conexões abertas, chamada no fim da execução"""
+    global _sessao_http, _sessao_fluig, _auth_sharepoint, _geracao_sharepoint
+    with _lock:
+        for sessao in (_sessao_http, _sessao_fluig):
+            if sessao is not None:
+                sessao.close()
+        _sessao_http = None
+        _sessao_fluig = None
+        _auth_sharepoint = None
+        #Os contextos das outras threads usam a sessão fechada: com a nova geração, são recriados no próximo uso
+        _geracao_sharepoint += 1
+    _local.__dict__.clear()
@@ -0,0 +1,197 @@
+import sys
+import os
+import uuid
+import sqlite3
+import calendar
+import tempfile
+import logging
+from itertools import groupby
+from operator import attrgetter
+from datetime import datetime, timedelta
+
+# Entradas mantidas em memória antes de passar para o arquivo em disco
+LIMITE_MEMORIA = 100000
+# Entradas gravadas por transação no arquivo em disco
+LOTE_DISCO = 5000
+# Campos lidos dos itens na listagem do inventário, só o necessário para montar as entradas
+CAMPOS_INVENTARIO = ['Id', 'FileRef', 'FSObjType', 'File/UniqueId', 'File/Name', 'File/Length',
+                     'File/TimeLastModified', 'File/MajorVersion', 'File/MinorVersion']
+_EPOCA = datetime(1970, 1, 1)
+
+
+def _epoca(data):
+    """Data do SharePoint (UTC, sem fuso) em segundos desde 1970"""
+    return calendar.timegm(data.timetuple())
+
+
+def _pasta(caminho):
+    """A mesma string é compartilhada por todas as entradas da pasta"""
+    return sys.intern(caminho)
+
+
+class FileEntry:
+    """Metadados de um arquivo com o mínimo de memória: sem dict por instância, id em 16 bytes,
+    data em segundos e a pasta compartilhada entre os arquivos dela"""
+    __slots__ = ('id', 'pasta', 'nome', 'tamanho', 'modificado', 'versao_maior', 'versao_menor', 'hash')
+
+    def __init__(self, file_id, pasta, nome, tamanho, modificado, versao_maior, versao_menor, hash_conteudo=None):
+        self.id = file_id if isinstance(file_id, bytes) else uuid.UUID(file_id).bytes
+        self.pasta = _pasta(pasta)
+        self.nome = nome
+        self.tamanho = tamanho
+        self.modificado = modificado if isinstance(modificado, int) else _epoca(modificado)
+        self.versao_maior = versao_maior
+        self.versao_menor = versao_menor
+        self.hash = hash_conteudo
+
+    @classmethod
+    def de_arquivo(cls, pasta, file):
+        """Entrada a partir do File da office365"""
+        return cls(file.unique_id, pasta, file.name, file.length, file.time_last_modified,
+                   file.major_version, file.minor_version)
+
+    @property
+    def file_id(self):
+        return str(uuid.UUID(bytes=self.id))
+
+    @property
+    def caminho(self):
+        return f'{self.pasta}/{self.nome}'
+
+    def propriedades(self):
+        """Dict no formato do SharePoint.file_properties, usado pelo índice de estado (sem time_created)"""
+        return {
+            'file_id': self.file_id,
+            'file_name': self.nome,
+            'major_version': self.versao_maior,
+            'minor_version': self.versao_menor,
+            'file_size': self.tamanho,
+            'time_created': None,
+            'time_last_modified': _EPOCA + timedelta(seconds=self.modificado),
+        }
+
+    def __repr__(self):
+        return f'FileEntry({self.caminho!r}, {self.tamanho} bytes, v{self.versao_maior}.{self.versao_menor})'
+
+
+class FolderEntry:
+    """Pasta encontrada na listagem (caminho relativo ao site)"""
+    __slots__ = ('caminho', 'item_id')
+
+    def __init__(self, caminho, item_id):
+        self.caminho = _pasta(caminho)
+        self.item_id = item_id
+
+    def __repr__(self):
+        return f'FolderEntry({self.caminho!r})'
+
+
+def listar_entradas(sharepoint, biblioteca, site, filtro=None, tamanho_pagina=None):
+    """Percorre a biblioteca inteira página a página gerando FileEntry e FolderEntry,
+    cada página de itens da office365 é descartada depois de convertida"""
+    prefixo = f'/sites/{site}/'
+    for item in sharepoint.iter_list_items(biblioteca, filtro, CAMPOS_INVENTARIO, tamanho_pagina):
+        caminho = item.properties['FileRef'].split(prefixo, 1)[-1]
+        #FSObjType 1 são pastas
+        if item.properties.get('FSObjType') == 1:
+            yield FolderEntry(caminho, item.properties['Id'])
+        else:
+            yield FileEntry.de_arquivo(caminho.rsplit('/', 1)[0], item.file)
+
+
+class Inventario:
+    """Coleção de FileEntry com memória limitada: acima de limite_memoria entradas, as mais antigas
+    vão para um SQLite em disco (temporário, ou o arquivo informado) e são lidas de volta na iteração"""
+
+    def __init__(self, limite_memoria=LIMITE_MEMORIA, arquivo=None):
+        self.limite_memoria = limite_memoria
+        self.arquivo = arquivo
+        self._memoria = []
+        self._conn = None
+        self._temporario = False
+        self._em_disco = 0
+        self.total_bytes = 0
+
+    def _abre_disco(self):
+        if self.arquivo is None:
+            descritor, self.arquivo = tempfile.mkstemp(prefix='inventario-', suffix='.db')
+            os.close(descritor)
+            self._temporario = True
+        self._conn = sqlite3.connect(self.arquivo)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("DROP TABLE IF EXISTS entradas")
+        self._conn.execute(
+            """CREATE TABLE entradas (
+                id BLOB, pasta TEXT, nome TEXT, tamanho INTEGER, modificado INTEGER,
+                versao_maior INTEGER, versao_menor INTEGER, hash TEXT
+            )"""
+        )
+        logging.info(f"Inventário passou de {self.limite_memoria} entradas, gravando em {self.arquivo}")
+
+    def _descarrega(self):
+        """Grava as entradas em memória no disco em lotes"""
+        if self._conn is None:
+            self._abre_disco()
+        for i in range(0, len(self._memoria), LOTE_DISCO):
+            self._conn.executemany(
+                "INSERT INTO entradas VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [tuple(getattr(entrada, campo) for campo in FileEntry.__slots__)
+                 for entrada in self._memoria[i:i + LOTE_DISCO]]
+            )
+            self._conn.commit()
+        self._em_disco += len(self._memoria)
+        self._memoria = []
+
+    def adiciona(self, entrada):
+        self._memoria.append(entrada)
+        self.total_bytes += entrada.tamanho
+        if len(self._memoria) >= self.limite_memoria:
+            self._descarrega()
+
+    def __len__(self):
+        return self._em_disco + len(self._memoria)
+
+    def __iter__(self):
+        """Entradas na ordem em que foram adicionadas, as do disco são lidas em lotes"""
+        if self._conn is not None:
+            cursor = self._conn.execute("SELECT * FROM entradas ORDER BY rowid")
+            for linhas in iter(lambda: cursor.fetchmany(LOTE_DISCO), []):
+                for linha in linhas:
+                    yield FileEntry(*linha)
+        yield from self._memoria
+
+    def por_pasta(self):
+        """Gera (pasta, [FileEntry]) em ordem de pasta, só uma pasta por vez fica montada em memória"""
+        if self._conn is None:
+            linhas = sorted(self._memoria, key=attrgetter('pasta'))
+        else:
+            self._descarrega()
+            linhas = (FileEntry(*linha) for linha in self._conn.execute("SELECT * FROM entradas ORDER BY pasta, rowid"))
+        for pasta, entradas in groupby(linhas, key=attrgetter('pasta')):
+            yield pasta, list(entradas)
+
+    def fechar(self):
+        """Fecha e remove o arquivo em disco, se for temporário"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            if self._temporario:
+                os.remove(self.arquivo)
+        self._memoria = []
+
+
+def monta_inventario(sharepoint, biblioteca, site, filtro=None, limite_memoria=LIMITE_MEMORIA, arquivo=None,
+                     tamanho_pagina=None):
+    """Inventário dos arquivos da biblioteca, com no máximo limite_memoria entradas em memória.
+    Retorna (inventario, pastas), pastas é a lista de FolderEntry"""
+    inventario = Inventario(limite_memoria, arquivo)
+    pastas = []
+    for entrada in listar_entradas(sharepoint, biblioteca, site, filtro, tamanho_pagina):
+        if isinstance(entrada, FolderEntry):
+            pastas.append(entrada)
+        else:
+            inventario.adiciona(entrada)
+    logging.info(f"Inventário de {biblioteca}: {len(inventario)} arquivos, {len(pastas)} pastas, "
+                 f"{inventario.total_bytes / 1024 / 1024:.2f} MB")
+    return inventario, pastas
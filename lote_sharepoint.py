@@ -0,0 +1,235 @@
+import json
+import re
+import time
+import logging
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import requote_uri
+from office365.runtime.client_request_exception import ClientRequestException
+from office365.runtime.client_result import ClientResult
+from office365.runtime.odata.request import ODataRequest
+from office365.runtime.odata.v3.batch_request import ODataBatchV3Request
+from office365.runtime.odata.v3.json_light_format import JsonLightFormat
+from office365.runtime.queries.batch import BatchQuery
+from office365.runtime.queries.read_entity import ReadEntityQuery
+import gerenciador_sessao
+import politica_retry
+import metricas
+import configuracao
+from office365_api import SharePoint, opcoes as opcoes_sharepoint
+
+opcoes = configuracao.Opcoes(
+    # Consultas por requisição $batch (o SharePoint aceita até 100 operações por lote)
+    ITENS_POR_LOTE=('lote', 'itens', 100),
+    # Soma dos tamanhos dos arquivos baixados em um mesmo lote, o conteúdo volta inteiro na resposta
+    BYTES_POR_LOTE=('lote', 'bytes_por_lote', 8 * 1024 * 1024),
+    # Arquivos até esse tamanho são baixados em lote, os maiores continuam no download em stream
+    TAMANHO_MAXIMO=('lote', 'tamanho_maximo', 256 * 1024),
+)
+# Status do $batch inteiro que indicam lote grande demais, o lote é dividido ao meio
+_STATUS_DIVIDIR = (400, 413)
+
+
+class _ConsultaConteudo(ReadEntityQuery):
+    """GET do $value do arquivo como consulta de leitura, assim vai no lote fora dos change sets"""
+
+    def __init__(self, file):
+        super().__init__(file)
+        self._return_type = ClientResult(file.context)
+
+    @property
+    def url(self):
+        return f'{self.binding_type.resource_url}/$value'
+
+
+def _resposta_http(dados):
+    """requests.Response a partir de uma resposta HTTP serializada dentro do lote (corpo binário preservado)"""
+    cabecalho, _, corpo = dados.partition(b'\r\n\r\n')
+    linhas = cabecalho.decode('latin-1').split('\r\n')
+    status = re.match(r'HTTP/1\.\d (\d{3}) ?(.*)$', linhas[0])
+    response = requests.Response()
+    response.status_code = int(status.group(1))
+    response.reason = status.group(2)
+    response.headers = CaseInsensitiveDict(linha.split(':', 1) for linha in linhas[1:] if ':' in linha)
+    for nome in list(response.headers):
+        response.headers[nome] = response.headers[nome].strip()
+    response._content = corpo
+    return response
+
+
+def _partes_multipart(conteudo, boundary):
+    """Corpo de cada parte do multipart/mixed, sem converter o conteúdo para texto"""
+    delimitador = b'--' + boundary.encode('latin-1')
+    for parte in conteudo.split(delimitador)[1:]:
+        if parte.startswith(b'--'):
+            return
+        #Cada parte é CRLF + cabeçalhos + linha em branco + corpo + CRLF antes do próximo delimitador
+        cabecalhos, _, corpo = parte[2:].partition(b'\r\n\r\n')
+        yield cabecalhos.decode('latin-1'), corpo[:-2] if corpo.endswith(b'\r\n') else corpo
+
+
+def _boundary(tipo):
+    encontrado = re.search(r'boundary="?([^";]+)"?', tipo or '')
+    return encontrado.group(1) if encontrado else None
+
+
+class _RequisicaoLote(ODataBatchV3Request):
+    """$batch OData v3 com o corpo montado em CRLF e urls codificadas, leitura binária das respostas e
+    erro por consulta: uma consulta que falha não impede o mapeamento das demais"""
+
+    def __init__(self):
+        super().__init__(JsonLightFormat())
+        self.erros = {}
+
+    def _prepare_payload(self, query):
+        delimitador = f'--{query.current_boundary}'
+        partes = []
+        for qry in query.ordered_queries:
+            request = qry.build_request()
+            linhas = [delimitador, 'Content-Type: application/http', 'Content-Transfer-Encoding: binary', '',
+                      f'{request.method} {requote_uri(request.url)} HTTP/1.1', 'Accept: application/json;odata=verbose']
+            corpo = ''
+            if request.data:
+                linhas.append('Content-Type: application/json;odata=verbose')
+                corpo = json.dumps(request.data)
+            partes.append('\r\n'.join(linhas + ['', corpo]))
+        return ('\r\n'.join(partes) + f'\r\n{delimitador}--\r\n').encode('utf-8')
+
+    def _extract_response(self, response, query):
+        consultas = iter(query.ordered_queries)
+        for cabecalhos, corpo in _partes_multipart(response.content, _boundary(response.headers.get('Content-Type'))):
+            tipo = re.search(r'content-type:\s*([^\r\n]+)', cabecalhos, re.I)
+            tipo = tipo.group(1) if tipo else ''
+            if tipo.startswith('multipart/mixed'):
+                #Resposta de change set, uma parte para cada consulta do change set
+                for _, sub_corpo in _partes_multipart(corpo, _boundary(tipo)):
+                    yield next(consultas), _resposta_http(sub_corpo)
+            elif tipo.startswith('application/http'):
+                yield next(consultas), _resposta_http(corpo)
+
+    def process_response(self, response, query):
+        respondidas = set()
+        for sub_qry, sub_resp in self._extract_response(response, query):
+            respondidas.add(sub_qry.id)
+            try:
+                sub_resp.raise_for_status()
+                ODataRequest.process_response(self, sub_resp, sub_qry)
+            except requests.HTTPError as e:
+                self.erros[sub_qry.id] = ClientRequestException(*e.args, response=e.response)
+        for qry in query.ordered_queries:
+            if qry.id not in respondidas:
+                self.erros[qry.id] = Exception('consulta sem resposta no $batch')
+
+
+class LoteSharePoint:
+    """Agrupa consultas de leitura do SharePoint (pastas, propriedades, conteúdo de arquivos pequenos e itens
+    de listas) em requisições $batch de até itens_por_lote consultas e bytes_por_lote de conteúdo.
+
+    Cada método recebe as chaves a consultar e retorna {chave: resultado}; a consulta que falhar tem a
+    exceção no lugar do resultado. Falhas temporárias do lote ou de uma consulta são tentadas de novo e
+    um lote recusado por tamanho é dividido ao meio.
+    """
+
+    def __init__(self, sharepoint=None, itens_por_lote=None, bytes_por_lote=None):
+        self.sharepoint = sharepoint or SharePoint()
+        self.itens_por_lote = itens_por_lote or opcoes.ITENS_POR_LOTE
+        self.bytes_por_lote = bytes_por_lote or opcoes.BYTES_POR_LOTE
+
+    @metricas.instrumenta('sharepoint.lote')
+    def _envia(self, conn, consultas):
+        """Um $batch com as consultas, retorna {id da consulta: exceção} das que falharam;
+        None se o SharePoint recusou o lote pelo tamanho"""
+        def _executa():
+            cliente = gerenciador_sessao.cliente_lote_sharepoint(conn, _RequisicaoLote())
+            try:
+                cliente.execute_query(BatchQuery(conn, list(consultas)))
+            except ClientRequestException as e:
+                if len(consultas) > 1 and e.response is not None and e.response.status_code in _STATUS_DIVIDIR:
+                    return None
+                raise
+            return cliente.erros
+
+        return politica_retry.executa(_executa, 'sharepoint', f'no $batch de {len(consultas)} consultas',
+                                      self.sharepoint._renova_se_expirado)
+
+    def _executa_grupo(self, conn, consultas):
+        """Executa o grupo tentando de novo só as consultas com falha temporária, retorna {id: exceção}"""
+        erros = {}
+        pendentes = consultas
+        for tentativa in range(politica_retry.TENTATIVAS):
+            falhas = self._envia(conn, pendentes)
+            if falhas is None:
+                meio = len(pendentes) // 2
+                logging.info(f"$batch de {len(pendentes)} consultas recusado, dividindo em dois")
+                erros.update(self._executa_grupo(conn, pendentes[:meio]))
+                erros.update(self._executa_grupo(conn, pendentes[meio:]))
+                return erros
+            erros.update(falhas)
+            temporarias = [qry for qry in pendentes if qry.id in falhas and politica_retry.retentavel(falhas[qry.id])]
+            if not temporarias or tentativa == politica_retry.TENTATIVAS - 1:
+                break
+            respostas = [getattr(falhas[qry.id], 'response', None) for qry in temporarias]
+            segundos = max(politica_retry.espera(tentativa, response) for response in respostas)
+            logging.info(f"{len(temporarias)} consultas do $batch com falha temporária, tentando novamente em {segundos:.1f}s")
+            time.sleep(segundos)
+            for qry in temporarias:
+                del erros[qry.id]
+            pendentes = temporarias
+        return erros
+
+    def _grupos(self, pedidos):
+        """Divide os pedidos (chave, consulta, peso) respeitando itens_por_lote e bytes_por_lote"""
+        grupo, peso_grupo = [], 0
+        for pedido in pedidos:
+            if grupo and (len(grupo) >= self.itens_por_lote or peso_grupo + pedido[2] > self.bytes_por_lote):
+                yield grupo
+                grupo, peso_grupo = [], 0
+            grupo.append(pedido)
+            peso_grupo += pedido[2]
+        if grupo:
+            yield grupo
+
+    def executa(self, pedidos, converte):
+        """pedidos é uma lista de (chave, consulta, peso); converte(chave, consulta) monta o resultado de cada
+        consulta bem sucedida. Retorna {chave: resultado ou exceção}"""
+        conn = self.sharepoint._auth()
+        resultados = {}
+        for grupo in self._grupos(pedidos):
+            erros = self._executa_grupo(conn, [consulta for _, consulta, _ in grupo])
+            for chave, consulta, _ in grupo:
+                erro = erros.get(consulta.id)
+                resultados[chave] = erro if erro is not None else converte(chave, consulta)
+        return resultados
+
+    def pastas(self, caminhos):
+        """Subpastas e arquivos de cada pasta (o get_folder_contents em lote), {caminho: (folders, files)}"""
+        conn = self.sharepoint._auth()
+        pedidos = [(caminho, ReadEntityQuery(conn.web.get_folder_by_server_relative_url(caminho)
+                                             .expand(['Files', 'Folders'])), 0)
+                   for caminho in caminhos]
+        return self.executa(pedidos, lambda _, consulta: (consulta.return_type.folders, consulta.return_type.files))
+
+    def propriedades(self, arquivos):
+        """Propriedades (file_properties) de cada (pasta, nome), None se o arquivo não existe"""
+        conn = self.sharepoint._auth()
+        pedidos = [((pasta, nome), ReadEntityQuery(conn.web.get_file_by_server_relative_path(
+                       f'/sites/{opcoes_sharepoint.SHAREPOINT_SITE_NAME}/{pasta}/{nome}')), 0)
+                   for pasta, nome in arquivos]
+        resultados = self.executa(pedidos, lambda _, consulta: SharePoint.file_properties(consulta.return_type))
+        #Arquivo inexistente não é erro, como no get_file_properties
+        return {chave: None if getattr(getattr(valor, 'response', None), 'status_code', None) == 404 else valor
+                for chave, valor in resultados.items()}
+
+    def conteudos(self, arquivos):
+        """Conteúdo de cada (pasta, nome, tamanho), {(pasta, nome): bytes}; o tamanho separa os lotes"""
+        conn = self.sharepoint._auth()
+        pedidos = [((pasta, nome), _ConsultaConteudo(conn.web.get_file_by_server_relative_path(
+                       f'/sites/{opcoes_sharepoint.SHAREPOINT_SITE_NAME}/{pasta}/{nome}')), tamanho or 0)
+                   for pasta, nome, tamanho in arquivos]
+        return self.executa(pedidos, lambda _, consulta: consulta.return_type.value)
+
+    def listas(self, nomes):
+        """Itens de cada lista pelo título (o get_list em lote), {nome: itens}"""
+        conn = self.sharepoint._auth()
+        pedidos = [(nome, ReadEntityQuery(conn.web.lists.get_by_title(nome).items), 0) for nome in nomes]
+        return self.executa(pedidos, lambda _, consulta: consulta.return_type)
@@ -0,0 +1,198 @@
+import threading
+import functools
+import random
+import time
+import json
+import os
+import logging
+
+# Quantidade máxima de latências guardadas por operação para os percentis (amostragem reservoir)
+AMOSTRAS_POR_OPERACAO = 10000
+# Limites (segundos) dos buckets do histograma no formato Prometheus
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_operacoes = {}
+_config = {}
+_emissor = None
+_parar_emissor = threading.Event()
+
+
+class _Operacao:
+    """Contadores de uma operação instrumentada"""
+
+    def __init__(self):
+        self.quantidade = 0
+        self.erros = 0
+        self.bytes = 0
+        self.tempo_total = 0.0
+        self.latencias = []
+        self.buckets = [0] * len(BUCKETS)
+
+    def registra(self, duracao, n_bytes, erro):
+        self.quantidade += 1
+        self.tempo_total += duracao
+        self.bytes += n_bytes or 0
+        if erro:
+            self.erros += 1
+        for i, limite in enumerate(BUCKETS):
+            if duracao <= limite:
+                self.buckets[i] += 1
+        if len(self.latencias) < AMOSTRAS_POR_OPERACAO:
+            self.latencias.append(duracao)
+        else:
+            posicao = random.randrange(self.quantidade)
+            if posicao < AMOSTRAS_POR_OPERACAO:
+                self.latencias[posicao] = duracao
+
+    def percentil(self, p):
+        if not self.latencias:
+            return 0.0
+        ordenadas = sorted(self.latencias)
+        return ordenadas[min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))]
+
+    def resumo(self):
+        return {
+            'quantidade': self.quantidade,
+            'erros': self.erros,
+            'bytes': self.bytes,
+            'tempo_total_s': round(self.tempo_total, 3),
+            'p50_s': round(self.percentil(50), 4),
+            'p95_s': round(self.percentil(95), 4),
+            'p99_s': round(self.percentil(99), 4),
+        }
+
+
+def registra(operacao, duracao, n_bytes=0, erro=False):
+    """Registra uma chamada da operação"""
+    with _lock:
+        if operacao not in _operacoes:
+            _operacoes[operacao] = _Operacao()
+        _operacoes[operacao].registra(duracao, n_bytes, erro)
+
+
+def _bytes_padrao(resultado):
+    """Bytes transferidos a partir do retorno mais comum das funções (conteúdo, tamanho ou response)"""
+    if isinstance(resultado, (bytes, bytearray)):
+        return len(resultado)
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], int):
+        return resultado[0]
+    request = getattr(resultado, 'request', None)
+    if request is not None:
+        enviado = request.headers.get('Content-Length')
+        recebido = getattr(resultado, 'headers', {}).get('Content-Length')
+        return int(enviado or 0) + int(recebido or 0)
+    return 0
+
+
+def _registra_resultado(operacao, inicio, resultado, conta_bytes):
+    status = getattr(resultado, 'status_code', None)
+    try:
+        n_bytes = conta_bytes(resultado)
+    except (TypeError, ValueError):
+        n_bytes = 0
+    registra(operacao, time.perf_counter() - inicio, n_bytes, status is not None and status >= 400)
+
+
+def instrumenta(operacao, conta_bytes=_bytes_padrao):
+    """Decorator que registra quantidade, bytes, latência e erros da função.
+    Respostas HTTP com status >= 400 também contam como erro."""
+    def decorator(funcao):
+        @functools.wraps(funcao)
+        def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception:
+                registra(operacao, time.perf_counter() - inicio, erro=True)
+                raise
+            _registra_resultado(operacao, inicio, resultado, conta_bytes)
+            return resultado
+        return wrapper
+    return decorator
+
+
+def instrumenta_async(operacao, conta_bytes=_bytes_padrao):
+    """Mesmo registro do instrumenta para funções async, medindo até o fim da coroutine"""
+    def decorator(funcao):
+        @functools.wraps(funcao)
+        async def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                resultado = await funcao(*args, **kwargs)
+            except Exception:
+                registra(operacao, time.perf_counter() - inicio, erro=True)
+                raise
+            _registra_resultado(operacao, inicio, resultado, conta_bytes)
+            return resultado
+        return wrapper
+    return decorator
+
+
+def resumo():
+    """Resumo de todas as operações da execução"""
+    with _lock:
+        return {operacao: dados.resumo() for operacao, dados in sorted(_operacoes.items())}
+
+
+def formato_prometheus():
+    """Métricas no formato textfile do Prometheus (node_exporter)"""
+    linhas = [
+        '# TYPE sync_operacao_total counter',
+        '# TYPE sync_operacao_erros_total counter',
+        '# TYPE sync_operacao_bytes_total counter',
+        '# TYPE sync_operacao_latencia_segundos histogram',
+    ]
+    with _lock:
+        for operacao, dados in sorted(_operacoes.items()):
+            rotulo = f'operacao="{operacao}"'
+            linhas.append(f'sync_operacao_total{{{rotulo}}} {dados.quantidade}')
+            linhas.append(f'sync_operacao_erros_total{{{rotulo}}} {dados.erros}')
+            linhas.append(f'sync_operacao_bytes_total{{{rotulo}}} {dados.bytes}')
+            for limite, quantidade in zip(BUCKETS, dados.buckets):
+                linhas.append(f'sync_operacao_latencia_segundos_bucket{{{rotulo},le="{limite}"}} {quantidade}')
+            linhas.append(f'sync_operacao_latencia_segundos_bucket{{{rotulo},le="+Inf"}} {dados.quantidade}')
+            linhas.append(f'sync_operacao_latencia_segundos_sum{{{rotulo}}} {dados.tempo_total:.6f}')
+            linhas.append(f'sync_operacao_latencia_segundos_count{{{rotulo}}} {dados.quantidade}')
+    return '\n'.join(linhas) + '\n'
+
+
+def configurar(arquivo_json=None, arquivo_prometheus=None, intervalo=None):
+    """Define os arquivos de saída (seção metricas do yaml) e, com intervalo, grava as métricas durante a execução"""
+    global _emissor
+    _config.update({'json': arquivo_json, 'prometheus': arquivo_prometheus})
+    if intervalo and _emissor is None:
+        _parar_emissor.clear()
+
+        def _emite_periodicamente():
+            while not _parar_emissor.wait(intervalo):
+                grava()
+
+        _emissor = threading.Thread(target=_emite_periodicamente, name='metricas', daemon=True)
+        _emissor.start()
+
+
+def grava():
+    """Grava as métricas nos arquivos configurados (o arquivo é substituído de uma vez)"""
+    if _config.get('json'):
+        temporario = f"{_config['json']}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(resumo(), f, ensure_ascii=False, indent=2)
+        os.replace(temporario, _config['json'])
+    if _config.get('prometheus'):
+        temporario = f"{_config['prometheus']}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(formato_prometheus())
+        os.replace(temporario, _config['prometheus'])
+
+
+def finaliza():
+    """Para a emissão periódica, grava e loga o resumo da execução"""
+    global _emissor
+    if _emissor is not None:
+        _parar_emissor.set()
+        _emissor.join()
+        _emissor = None
+    grava()
+    for operacao, dados in resumo().items():
+        logging.info(f"Métricas {operacao}: {dados}")
@@ -1,94 +1,595 @@
-from requests_oauthlib import OAuth1Session
-import yaml
+import configuracao
 import logging
+import io
+import os
+import re
+import uuid
+import hashlib
+from urllib.parse import urlencode
+from pathlib import PurePath
+import gerenciador_sessao
+import politica_retry
+import metricas
+import threading
+from cache_pastas_fluig import CachePastas
 from time import sleep
+from contextlib import contextmanager
 from datetime import datetime
 
-data_hoje = datetime.now().strftime(r"%d-%m-%Y")
-# Configuração básica do logger
-logging.basicConfig(
-    filename=f'log/app-{data_hoje}.log',  # Especifica o arquivo de log
-    level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
-)
-
 PESQUISA_PASTA = '1'
 PESQUISA_ARQUIVO = '2'
-PARENT_ID_PASTA_ENGETEC = '1553' # PASTA 8 é a correta, 1553 é a pasta de teste
+PASTA_RAIZ_PADRAO = '1553' # PASTA 8 é a correta, 1553 é a pasta de teste
+# Tamanho máximo da url das consultas em lote, acima disso a consulta é dividida
+LIMITE_URL = 6000
+# Nomes de arquivos passados por vez ao prepara_arquivos pelos scripts de download
+LOTE_NOMES = 500
+# Erro do fluig para a pasta de destino removida quando a resposta não é 404 (ex: 500 no upload)
+ERRO_PASTA_INEXISTENTE = re.compile(r'\b(pasta|folder|parent)\b.*\b(não encontrad|not found|inexistente|does not exist)',
+                                    re.IGNORECASE)
 
-with open('config.yaml', 'r', encoding='utf=8') as params:
-    config = yaml.safe_load(params)
-    CLIENT_KEY = config['fluig']['client_key']
-    CLIENT_SECRET = config['fluig']['client_secret']
-    RESOURCE_OWNER_KEY = config['fluig']['resource_owner_key']
-    RESOURCE_OWNER_SECRET = config['fluig']['resource_owner_secret']
-    DOMINIO = config['fluig']['dominio']
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    CLIENT_KEY=('fluig', 'client_key'),
+    CLIENT_SECRET=('fluig', 'client_secret'),
+    RESOURCE_OWNER_KEY=('fluig', 'resource_owner_key'),
+    RESOURCE_OWNER_SECRET=('fluig', 'resource_owner_secret'),
+    DOMINIO=('fluig', 'dominio'),
+    # Pasta local de download, as pastas do fluig seguem o caminho a partir dela
+    PASTA_DOWNLOAD=('sharepoint', 'pasta_local_download', None),
+    # Tamanho dos blocos enviados quando o tamanho do arquivo não é conhecido
+    CHUNK_SIZE=('streaming', 'chunk_size', 1024 * 1024),
+    # Arquivo para manter o cache de pastas entre execuções (opcional)
+    ARQUIVO_CACHE_PASTAS=('fluig', 'cache_pastas', None),
+    # Carrega todas as pastas com uma única consulta ao dataset no início
+    PRECARREGAR_PASTAS=('fluig', 'precarregar_pastas', False),
+    # Máximo de registros que o dataset retorna, se a consulta em lote atingir esse valor ela é dividida
+    LIMITE_RESULTADOS=('fluig', 'limite_resultados', 5000),
+    # Atualiza o documento existente com uma nova versão em vez de deletar e enviar de novo
+    ATUALIZAR_VERSAO=('fluig', 'atualizar_versao', True),
+    # Pasta raiz da sincronização no fluig (cada job da sincronização distribuída pode ter a sua)
+    PARENT_ID_PASTA_ENGETEC=lambda config: str(config['fluig'].get('pasta_raiz', PASTA_RAIZ_PADRAO)),
+)
 
 
-def envia_arquivo(nome_arquivo, id_pasta, caminho_arquivo):
-    """Função para enviar uma arquivo para o fluig"""
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET) 
-    #Url da api do Fluig para criar arquivo
-    url = fr'{DOMINIO}/content-management/api/v2/documents/upload/{nome_arquivo}/{id_pasta}/publish'
-    #Abrir o arquivo em formato binario
+def _configura_sessoes(config):
+    """Ajusta as sessões e o retry quando a configuração é lida, antes da primeira requisição"""
+    gerenciador_sessao.configurar(**config.get('sessao', {}))
+    politica_retry.configurar(**config.get('retry', {}))
+
+configuracao.ao_carregar(_configura_sessoes)
+
+# Índice de estado da execução (estado_sync), usado para guardar o hash do conteúdo de cada documento
+_estado = None
+# Contadores de deduplicação da execução
+_deduplicacao = {'arquivos_ignorados': 0, 'bytes_economizados': 0, 'duplicados_outras_pastas': 0}
+_lock_deduplicacao = threading.Lock()
+_cache_pastas = None
+_lock_cache = threading.Lock()
+# Arquivos já conhecidos de cada pasta (parentId -> {nome: documentId})
+_arquivos_pasta = {}
+_lock_arquivos_pasta = threading.Lock()
+#Lock por pasta: só uma thread consulta os arquivos de cada pasta, as outras esperam o resultado dela
+_locks_consulta_pasta = {}
+# Pastas acima do limite do dataset: arquivos já consultados pelo nome (parentId -> {nome: documentId ou None})
+_arquivos_consultados = {}
+# A área de upload do usuário guarda um arquivo por nome, envios de versão com o mesmo nome não podem se cruzar
+_travas_upload = {}
+_lock_travas_upload = threading.Lock()
+# Trava externa por nome (ex: entre os processos da sincronização distribuída), substitui a trava local
+_trava_upload_externa = None
+
+
+def _sessao():
+    """Sessão OAuth1 compartilhada do Fluig"""
+    return gerenciador_sessao.sessao_fluig(opcoes.CLIENT_KEY, opcoes.CLIENT_SECRET,
+                                           opcoes.RESOURCE_OWNER_KEY, opcoes.RESOURCE_OWNER_SECRET)
+
+
+class PastaInexistente(Exception):
+    """Pasta do fluig (parent_id) removida ou movida, ex: id que ficou no cache de pastas persistido"""
+
+    def __init__(self, parent_id):
+        super().__init__(f"Pasta ({parent_id}) não encontrada no fluig")
+        self.parent_id = str(parent_id)
+
+
+def pasta_inexistente(response):
+    """Resposta do fluig indicando que a pasta de destino não existe: 404, ou outro erro com a mensagem (ou o código)
+    específica de pasta não encontrada. Outros erros que só mencionam "não encontrado" não invalidam a pasta"""
+    if response.status_code == 404:
+        return True
+    if response.status_code < 400:
+        return False
+    try:
+        corpo = response.json()
+    except ValueError:
+        return False
+    if not isinstance(corpo, dict):
+        return False
+    mensagem = corpo.get('message')
+    if isinstance(mensagem, dict):
+        #Erros da api pública: {"message": {"message": ..., "detail": ...}}
+        mensagem = mensagem.get('message')
+    return any(isinstance(texto, str) and ERRO_PASTA_INEXISTENTE.search(texto.replace('_', ' '))
+               for texto in (mensagem, corpo.get('code')))
+
+
+class _MultipartStream:
+    """Corpo multipart/form-data lido em blocos, o arquivo é enviado sem ser carregado em memória"""
+
+    def __init__(self, origem, tamanho):
+        self.boundary = uuid.uuid4().hex
+        cabecalho = (f'--{self.boundary}\r\n'
+                     'Content-Disposition: form-data; name="file"; filename="file"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        rodape = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self._cabecalho = cabecalho
+        self._rodape = rodape
+        self._origem = origem
+        self._inicio_origem = origem.tell() if hasattr(origem, 'seekable') and origem.seekable() else None
+        self._partes = [io.BytesIO(cabecalho), origem, io.BytesIO(rodape)]
+        self._tamanho = len(cabecalho) + tamanho + len(rodape)
+
+    def reinicia(self):
+        """Volta o corpo para o início para reenviar (novas tentativas), só é possível com arquivo local"""
+        if self._inicio_origem is None:
+            return False
+        self._origem.seek(self._inicio_origem)
+        self._partes = [io.BytesIO(self._cabecalho), self._origem, io.BytesIO(self._rodape)]
+        return True
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self._tamanho
+
+    def read(self, n=-1):
+        blocos = []
+        while self._partes and (n < 0 or n > 0):
+            bloco = self._partes[0].read(n)
+            if not bloco:
+                self._partes.pop(0)
+                continue
+            blocos.append(bloco)
+            if n > 0:
+                n -= len(bloco)
+        return b''.join(blocos)
+
+
+def _post_stream(oauth, url, origem, tamanho):
+    """Envia o conteúdo em stream; sem o tamanho o envio é feito com Transfer-Encoding: chunked"""
+    corpo = _MultipartStream(origem, tamanho or 0)
+    headers = {'Content-Type': corpo.content_type}
+    if tamanho is None:
+        def gerador():
+            while True:
+                bloco = corpo.read(opcoes.CHUNK_SIZE)
+                if not bloco:
+                    break
+                yield bloco
+        return oauth.post(url, data=gerador(), headers=headers)
+    return oauth.post(url, data=corpo, headers=headers)
+
+
+def _envia_conteudo(oauth, url, caminho_arquivo, tamanho=None):
+    """Envia o arquivo local ou o stream já aberto (ex: download do SharePoint sem passar pelo disco)"""
+    if hasattr(caminho_arquivo, 'read'):
+        return _post_stream(oauth, url, caminho_arquivo, tamanho)
+    #Abrir o arquivo em formato binario e enviar em blocos
     with open(caminho_arquivo, 'rb') as file:
-        file_content = file.read()
+        response = _post_stream(oauth, url, file, os.path.getsize(caminho_arquivo))
+    return response
+
+
+@metricas.instrumenta('fluig.envia_arquivo')
+def envia_arquivo(nome_arquivo, id_pasta, caminho_arquivo, tamanho=None):
+    """Função para enviar uma arquivo para o fluig, caminho_arquivo pode ser o caminho local ou um stream já aberto"""
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
+    #Url da api do Fluig para criar arquivo
+    url = fr'{opcoes.DOMINIO}/content-management/api/v2/documents/upload/{nome_arquivo}/{id_pasta}/publish'
     #Chamada a api
-    response = oauth.post(url, files={'file': file_content})
+    return _envia_conteudo(oauth, url, caminho_arquivo, tamanho)
+
+
+@metricas.instrumenta('fluig.envia_versao')
+def envia_versao(documento_id, nome_arquivo, caminho_arquivo, tamanho=None):
+    """Envia o conteúdo como nova versão do mesmo documento, mantendo o documentId e o histórico"""
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
+    with trava_upload(nome_arquivo):
+        #Envia o arquivo para a área de upload do usuário, sem publicar
+        url = fr'{opcoes.DOMINIO}/content-management/api/v2/documents/upload/{nome_arquivo}'
+        logging.info(f"Chamada a api para enviar nova versão do documento ({documento_id}), url: {url}")
+        response = _envia_conteudo(oauth, url, caminho_arquivo, tamanho)
+        if response.status_code != 200:
+            return response
+        #Check-in do arquivo enviado como nova versão do documento
+        url = f'{opcoes.DOMINIO}/api/public/ecm/document/updateFile'
+        body = {"id": documento_id, "attachments": [{"fileName": nome_arquivo, "principal": True}]}
+        logging.info(f"Chamada a api para atualizar a versão do documento ({documento_id}), url: {url}")
+        response = oauth.post(url, json=body)
     return response
+
+
+def hash_arquivo(caminho_arquivo):
+    """SHA-256 do arquivo, lido em blocos"""
+    sha = hashlib.sha256()
+    with open(caminho_arquivo, 'rb') as file:
+        for bloco in iter(lambda: file.read(opcoes.CHUNK_SIZE), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def configura_estado(estado):
+    """Define o índice de estado usado para comparar o conteúdo antes de atualizar um documento"""
+    global _estado
+    _estado = estado
+
+
+def configura_trava_upload(trava):
+    """Define a trava usada no envio de versões, trava(nome) é um context manager"""
+    global _trava_upload_externa
+    _trava_upload_externa = trava
+
+
+@contextmanager
+def trava_upload(nome_arquivo):
+    """Exclusividade do nome na área de upload do usuário, do envio até o check-in da versão"""
+    if _trava_upload_externa is not None:
+        with _trava_upload_externa(nome_arquivo):
+            yield
+        return
+    with _lock_travas_upload:
+        trava = _travas_upload.setdefault(nome_arquivo, threading.Lock())
+    with trava:
+        yield
+
+
+def grava_hash(documento_id, caminho_arquivo, impressao=None):
+    """Guarda o hash do conteúdo enviado para o documento"""
+    if _estado is None or documento_id is None or hasattr(caminho_arquivo, 'read'):
+        return
+    impressao = impressao or hash_arquivo(caminho_arquivo)
+    _estado.grava_hash_documento(documento_id, impressao, os.path.getsize(caminho_arquivo))
+
+
+def conteudo_repetido(documento_id, caminho_arquivo, impressao=None):
+    """Compara o arquivo local com o último conteúdo enviado ao documento, retorna (repetido, impressao).
+    Conteúdo repetido é contado na deduplicação e o envio pode ser ignorado"""
+    if _estado is None:
+        return False, impressao
+    impressao = impressao or hash_arquivo(caminho_arquivo)
+    if _estado.hash_documento(documento_id) != impressao:
+        return False, impressao
+    logging.info(f"Conteúdo igual ao do documento ({documento_id}), envio ignorado")
+    _conta_deduplicacao('arquivos_ignorados', os.path.getsize(caminho_arquivo))
+    return True, impressao
+
+
+def conta_duplicado(impressao):
+    """Conta o arquivo novo com conteúdo idêntico já publicado em outra pasta, só para o relatório
+    (o fluig não tem cópia pelo servidor)"""
+    if impressao and _estado is not None and _estado.documentos_com_hash(impressao):
+        _conta_deduplicacao('duplicados_outras_pastas')
+
+
+def _conta_deduplicacao(chave, n_bytes=0):
+    with _lock_deduplicacao:
+        _deduplicacao[chave] += 1
+        _deduplicacao['bytes_economizados'] += n_bytes
+
+
+def resumo_deduplicacao():
+    """Loga e retorna os contadores de deduplicação da execução"""
+    with _lock_deduplicacao:
+        resumo = dict(_deduplicacao)
+    logging.info(f"Deduplicação: {resumo['arquivos_ignorados']} envios ignorados, "
+                 f"{resumo['bytes_economizados'] / 1024 / 1024:.2f} MB economizados, "
+                 f"{resumo['duplicados_outras_pastas']} arquivos com conteúdo já publicado em outra pasta")
+    return resumo
     
 
+@metricas.instrumenta('fluig.cria_pasta')
 def cria_pasta(nome_pasta, parent_id):
     """Função para criar uma pasta no fluig"""
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET)
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
     #Url da api do Fluig para criar pasta
-    url = fr'{DOMINIO}/content-management/api/v2/folders/{parent_id}'
+    url = fr'{opcoes.DOMINIO}/content-management/api/v2/folders/{parent_id}'
     body = {"alias": nome_pasta}
     #Chamada a api
     logging.info(f"Chamada a api para criar pasta ({nome_pasta}), url: {url}")
     response = oauth.post(url, json=body)
     return response
 
+@metricas.instrumenta('fluig.verifica_existencia_arquivo')
 def verifica_existencia_arquivo(nome_arquivo):
     """Função para verificar a existência do arquivo pelo nome"""
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET)
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
     #Url da api do Fluig para procurar arquivo
-    url= f'{DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&constraintsField=documentDescription&constraintsField=documentType&constraintsField=deleted&constraintsInitialValue={nome_arquivo}&constraintsInitialValue={PESQUISA_ARQUIVO}&constraintsInitialValue=false&constraintsFinalValue={nome_arquivo}&constraintsFinalValue={PESQUISA_ARQUIVO}&constraintsFinalValue=false&constraintsType=MUST&constraintsType=MUST'
+    url= f'{opcoes.DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&constraintsField=documentDescription&constraintsField=documentType&constraintsField=deleted&constraintsInitialValue={nome_arquivo}&constraintsInitialValue={PESQUISA_ARQUIVO}&constraintsInitialValue=false&constraintsFinalValue={nome_arquivo}&constraintsFinalValue={PESQUISA_ARQUIVO}&constraintsFinalValue=false&constraintsType=MUST&constraintsType=MUST'
     #Chamada a api
     logging.info(f"Chamada a api para verificar existencia de arquivo ({nome_arquivo}), url: {url}")
     response = oauth.get(url)
     return response
 
+@metricas.instrumenta('fluig.verifica_existencia_arquivo_pasta')
+def verifica_existencia_arquivo_pasta(nome_arquivo, parent_id):
+    """Função para verificar a existência do arquivo pelo nome dentro de uma pasta específica"""
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
+    #Url da api do Fluig para procurar arquivo filtrando pela pasta
+    url= f'{opcoes.DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&constraintsField=documentDescription&constraintsField=documentType&constraintsField=deleted&constraintsField=parentDocumentId&constraintsInitialValue={nome_arquivo}&constraintsInitialValue={PESQUISA_ARQUIVO}&constraintsInitialValue=false&constraintsInitialValue={parent_id}&constraintsFinalValue={nome_arquivo}&constraintsFinalValue={PESQUISA_ARQUIVO}&constraintsFinalValue=false&constraintsFinalValue={parent_id}&constraintsType=MUST&constraintsType=MUST&constraintsType=MUST'
+    #Chamada a api
+    logging.info(f"Chamada a api para verificar existencia de arquivo ({nome_arquivo}) na pasta ({parent_id}), url: {url}")
+    response = oauth.get(url)
+    return response
+
+@metricas.instrumenta('fluig.verifica_existencia_pasta')
 def verifica_existencia_pasta(item_lista, parent_id):
     """Função para verificar a existência de uma pasta pelo nome, partindo da origem como sempre sendo '3013 - ENGETEC OPERAÇÃO' """
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET)
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
     #Url da api do Fluig para procurar pasta
-    url= f'{DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&constraintsField=documentDescription&constraintsField=documentType&constraintsField=deleted&constraintsField=parentDocumentId&constraintsInitialValue={item_lista}&constraintsInitialValue={PESQUISA_PASTA}&constraintsInitialValue=false&constraintsInitialValue={parent_id}&constraintsFinalValue={item_lista}&constraintsFinalValue={PESQUISA_PASTA}&constraintsFinalValue=false&constraintsFinalValue={parent_id}&constraintsType=MUST&constraintsType=MUST&constraintsType=MUST'
+    url= f'{opcoes.DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&constraintsField=documentDescription&constraintsField=documentType&constraintsField=deleted&constraintsField=parentDocumentId&constraintsInitialValue={item_lista}&constraintsInitialValue={PESQUISA_PASTA}&constraintsInitialValue=false&constraintsInitialValue={parent_id}&constraintsFinalValue={item_lista}&constraintsFinalValue={PESQUISA_PASTA}&constraintsFinalValue=false&constraintsFinalValue={parent_id}&constraintsType=MUST&constraintsType=MUST&constraintsType=MUST&constraintsType=MUST'
     #Chamada a api
     response = oauth.get(url)
     return response
 
+@metricas.instrumenta('fluig.get_documento')
 def get_documento(documento_id):
     """Pega dados do documento"""
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET)
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
     #Url da api do Fluig para pegar dados do documento
-    url = f'{DOMINIO}/content-management/api/v2/documents/{documento_id}'
+    url = f'{opcoes.DOMINIO}/content-management/api/v2/documents/{documento_id}'
     #Chamada a api    
     logging.info(f"Chamada a api para verificar documento ({documento_id}), url: {url}")
     response = oauth.get(url)
     return response 
 
-def update_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo):
-    """Atualiza o arquivo"""
-    # Inicialize a sessão OAuth1
-    oauth = OAuth1Session(CLIENT_KEY, CLIENT_SECRET, RESOURCE_OWNER_KEY, RESOURCE_OWNER_SECRET)
+@metricas.instrumenta('fluig.remove_documento')
+def remove_documento(documento_id):
+    """Remove o documento do fluig (arquivo removido do SharePoint)"""
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
+    url = f'{opcoes.DOMINIO}/content-management/api/v2/documents/{documento_id}'
+    logging.info(f"Chamada a api para deletar documento ({documento_id}), url: {url}")
+    response = oauth.delete(url)
+    return response
+
+def extrai_document_id(response):
+    """Pega o documentId da resposta de criação/envio do fluig"""
+    try:
+        resposta = response.json()
+    except ValueError:
+        return None
+    if 'documentId' in resposta:
+        return resposta['documentId']
+    return (resposta.get('content') or {}).get('id')
+
+def _url_dataset(campos, restricoes):
+    """Monta a url do dataset document, restricoes é uma lista de (campo, valor, tipo MUST/SHOULD);
+    valor pode ser uma tupla (inicial, final) para consultar um intervalo"""
+    intervalos = [valor if isinstance(valor, tuple) else (valor, valor) for _, valor, _ in restricoes]
+    params = [('datasetId', 'document')]
+    params += [('field', campo) for campo in campos]
+    params += [('constraintsField', campo) for campo, _, _ in restricoes]
+    params += [('constraintsInitialValue', inicial) for inicial, _ in intervalos]
+    params += [('constraintsFinalValue', final) for _, final in intervalos]
+    params += [('constraintsType', tipo) for _, _, tipo in restricoes]
+    return f'{opcoes.DOMINIO}/dataset/api/v2/dataset-handle/search?{urlencode(params)}'
+
+@metricas.instrumenta('fluig.consulta_dataset')
+def _consulta_dataset(url):
+    oauth = _sessao()
+    logging.info(f"Chamada a api do dataset, url: {url}")
+    response = oauth.get(url)
+    if response.status_code != 200:
+        raise Exception(f"Erro na consulta do dataset, status{response.status_code}, body: {response.text}")
+    return response.json()['values']
+
+def url_existencia_arquivos(nomes, parent_id=None):
+    """Consulta dos arquivos pelos nomes (restrições SHOULD), opcionalmente só dentro da pasta"""
+    restricoes = [('documentType', PESQUISA_ARQUIVO, 'MUST'), ('deleted', 'false', 'MUST')]
+    if parent_id is not None:
+        restricoes.append(('parentDocumentId', parent_id, 'MUST'))
+    restricoes += [('documentDescription', nome, 'SHOULD') for nome in nomes]
+    return _url_dataset(['documentPK.documentId', 'documentDescription'], restricoes)
+
+def verifica_existencia_arquivos(nomes, parent_id=None):
+    """Verifica vários arquivos em uma única consulta (restrições SHOULD pelo nome), retorna {nome: documentId}.
+    A consulta é dividida automaticamente se a url ficar grande demais ou se atingir o limite de resultados."""
+    nomes = list(dict.fromkeys(nomes))
+    if not nomes:
+        return {}
+    url = url_existencia_arquivos(nomes, parent_id)
+    values = None
+    if len(url) <= LIMITE_URL or len(nomes) == 1:
+        values = _consulta_dataset(url)
+    if values is None or (len(values) >= opcoes.LIMITE_RESULTADOS and len(nomes) > 1):
+        meio = len(nomes) // 2
+        encontrados = verifica_existencia_arquivos(nomes[:meio], parent_id)
+        encontrados.update(verifica_existencia_arquivos(nomes[meio:], parent_id))
+        return encontrados
+    return documentos_por_nome(values)
+
+def documentos_por_nome(values):
+    """{nome: documentId} do resultado do dataset, mantém o primeiro resultado para cada nome"""
+    documentos = {}
+    for valor in values:
+        documentos.setdefault(valor['documentDescription'], valor['documentPK.documentId'])
+    return documentos
+
+def url_arquivos_pasta(parent_id):
+    """Consulta de todos os arquivos ativos da pasta (arquivos_da_pasta)"""
+    restricoes = [('documentType', PESQUISA_ARQUIVO, 'MUST'), ('deleted', 'false', 'MUST'),
+                  ('parentDocumentId', parent_id, 'MUST')]
+    return _url_dataset(['documentPK.documentId', 'documentDescription'], restricoes)
+
+def arquivos_por_nome(values, parent_id):
+    """Resultado da consulta dos arquivos da pasta, None se atingiu o limite do dataset"""
+    if len(values) >= opcoes.LIMITE_RESULTADOS:
+        logging.info(f"Pasta {parent_id} atingiu o limite de resultados, consultando os arquivos pelo nome")
+        return None
+    return documentos_por_nome(values)
+
+def arquivos_da_pasta(parent_id):
+    """Todos os arquivos de uma pasta em uma única consulta, {nome: documentId}.
+    Retorna None se a pasta tiver mais arquivos que o limite do dataset (então os arquivos são consultados pelo nome,
+    com o verifica_existencia_arquivos)."""
+    return arquivos_por_nome(_consulta_dataset(url_arquivos_pasta(parent_id)), parent_id)
+
+def lista_arquivos():
+    """Todos os arquivos ativos em uma única consulta, lista de (documentId, nome, parentId).
+    Retorna None se a consulta atingir o limite do dataset (então os arquivos são consultados por pasta)"""
+    restricoes = [('documentType', PESQUISA_ARQUIVO, 'MUST'), ('deleted', 'false', 'MUST')]
+    values = _consulta_dataset(_url_dataset(['documentPK.documentId', 'documentDescription', 'parentDocumentId'],
+                                            restricoes))
+    if len(values) >= opcoes.LIMITE_RESULTADOS:
+        logging.info("Consulta de todos os arquivos atingiu o limite de resultados")
+        return None
+    return [(str(valor['documentPK.documentId']), valor['documentDescription'], str(valor['parentDocumentId']))
+            for valor in values]
+
+def url_documentos_modificados(desde, ate=None):
+    """Consulta dos arquivos (versão ativa) modificados entre as datas, a data é comparada por dia"""
+    ate = ate or datetime.now()
+    restricoes = [('documentType', PESQUISA_ARQUIVO, 'MUST'), ('deleted', 'false', 'MUST'),
+                  ('activeVersion', 'true', 'MUST'),
+                  ('lastModifiedDate', (desde.strftime('%Y-%m-%d'), ate.strftime('%Y-%m-%d')), 'MUST')]
+    return _url_dataset(['documentPK.documentId', 'documentPK.version', 'documentDescription', 'parentDocumentId'],
+                        restricoes)
+
+def documentos_modificados(desde, ate=None):
+    """Arquivos (versão ativa) modificados no fluig entre as datas, em uma única consulta ao dataset.
+    Retorna uma lista de dicts com documentId, versao, nome e parentId; a data é comparada por dia"""
+    return modificados_por_documento(_consulta_dataset(url_documentos_modificados(desde, ate)), desde)
+
+def modificados_por_documento(values, desde):
+    """Resultado da consulta dos documentos modificados"""
+    if len(values) >= opcoes.LIMITE_RESULTADOS:
+        logging.warning(f"Consulta de documentos modificados desde {desde} atingiu o limite de resultados")
+    return [
+        {'documentId': str(valor['documentPK.documentId']), 'versao': str(valor['documentPK.version']),
+         'nome': valor['documentDescription'], 'parentId': str(valor['parentDocumentId'])}
+        for valor in values
+    ]
+
+@metricas.instrumenta('fluig.baixa_documento')
+def baixa_documento(documento_id, destino, chunk_size=None):
+    """Baixa o conteúdo do documento em blocos direto para o disco (.part renomeado no fim).
+    Retorna o tamanho e o SHA-256 do conteúdo, calculado durante o download"""
+    chunk_size = chunk_size or opcoes.CHUNK_SIZE
+    oauth = _sessao()
+    url = f'{opcoes.DOMINIO}/content-management/api/v2/documents/{documento_id}/stream'
+    logging.info(f"Chamada a api para baixar documento ({documento_id}), url: {url}")
+    temporario = f'{destino}.part'
+    sha = hashlib.sha256()
+    tamanho = 0
+    with oauth.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Erro ao baixar o documento ({documento_id}), status{response.status_code}, body: {response.text}")
+        with open(temporario, 'wb') as f:
+            for bloco in response.iter_content(chunk_size=chunk_size):
+                f.write(bloco)
+                sha.update(bloco)
+                tamanho += len(bloco)
+    os.replace(temporario, destino)
+    return tamanho, sha.hexdigest()
+
+def _registra_arquivo_pasta(parent_id, nome_arquivo, documento_id):
+    """Atualiza o mapa de arquivos da pasta após gravar um arquivo"""
+    if documento_id is None:
+        return
+    with _lock_arquivos_pasta:
+        arquivos = _arquivos_pasta.get(str(parent_id))
+        if arquivos is None:
+            arquivos = _arquivos_consultados.get(str(parent_id))
+        if arquivos is not None:
+            arquivos[nome_arquivo] = documento_id
+
+def _carrega_arquivos_pasta(parent_id):
+    """Arquivos da pasta consultados de uma vez na primeira chamada, {nome: documentId} ou None acima do limite"""
+    with _lock_arquivos_pasta:
+        lock_pasta = _locks_consulta_pasta.setdefault(parent_id, threading.Lock())
+    with lock_pasta:
+        #Outra thread pode ter consultado a pasta enquanto esperava o lock
+        with _lock_arquivos_pasta:
+            carregada = parent_id in _arquivos_pasta
+        if not carregada:
+            arquivos = arquivos_da_pasta(parent_id)
+            with _lock_arquivos_pasta:
+                _arquivos_pasta.setdefault(parent_id, arquivos)
+    with _lock_arquivos_pasta:
+        return _arquivos_pasta[parent_id]
+
+def prepara_arquivos(diretorio, nomes):
+    """Consulta em lote os arquivos que vão ser gravados na pasta (diretório local, como no main).
+    Só muda algo nas pastas acima do limite do dataset: sem isso o localiza_arquivo consulta um arquivo por vez"""
+    try:
+        parent_id = get_cache_pastas().busca(partes_caminho(diretorio))
+        #Pasta ainda não existe no fluig, os arquivos também não
+        if parent_id is None:
+            return
+        parent_id = str(parent_id)
+        if _carrega_arquivos_pasta(parent_id) is not None:
+            return
+        with _lock_arquivos_pasta:
+            consultados = _arquivos_consultados.setdefault(parent_id, {})
+            pendentes = [nome for nome in nomes if nome not in consultados]
+        encontrados = verifica_existencia_arquivos(pendentes, parent_id)
+        with _lock_arquivos_pasta:
+            for nome in pendentes:
+                consultados.setdefault(nome, encontrados.get(nome))
+    except Exception as e:
+        #Os arquivos continuam sendo consultados um a um no localiza_arquivo
+        logging.warning(f"Erro ao consultar os arquivos de {diretorio} em lote: {e}")
+
+def localiza_arquivo(nome_arquivo, parent_id):
+    """documentId do arquivo com o nome dentro da pasta parent_id, ou None se não existir.
+    Os arquivos da pasta são consultados de uma vez na primeira chamada e reaproveitados para os próximos arquivos."""
+    parent_id = str(parent_id)
+    arquivos = _carrega_arquivos_pasta(parent_id)
+    if arquivos is not None:
+        return arquivos.get(nome_arquivo)
+    #Pasta grande demais para a consulta de todos os arquivos: nomes já consultados em lote pelo prepara_arquivos
+    with _lock_arquivos_pasta:
+        consultados = _arquivos_consultados.get(parent_id, {})
+        if nome_arquivo in consultados:
+            return consultados[nome_arquivo]
+    return verifica_existencia_arquivos([nome_arquivo], parent_id).get(nome_arquivo)
+
+def update_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo, tamanho=None, impressao=None):
+    """Atualiza o arquivo como nova versão do documento, retorna None se o conteúdo não mudou (nada é enviado).
+    impressao é o hash já calculado no download, evitando ler o arquivo de novo"""
+    if not hasattr(caminho_arquivo, 'read'):
+        repetido, impressao = conteudo_repetido(documento_id, caminho_arquivo, impressao)
+        if repetido:
+            return None
+    if opcoes.ATUALIZAR_VERSAO:
+        response = envia_versao(documento_id, nome_arquivo, caminho_arquivo, tamanho)
+        #Servidor sem a api de versão, volta para deletar e enviar de novo (só é possível com o arquivo local)
+        if response.status_code in (404, 405) and not hasattr(caminho_arquivo, 'read'):
+            logging.info(f"Api de versão indisponível ({response.status_code}), substituindo o documento ({documento_id})")
+            response = substitui_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo, tamanho)
+    else:
+        response = substitui_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo, tamanho)
+    if response.status_code == 200:
+        grava_hash(extrai_document_id(response) or documento_id, caminho_arquivo, impressao)
+    return response
+
+@metricas.instrumenta('fluig.substitui_arquivo')
+def substitui_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo, tamanho=None):
+    """Deleta o documento e envia o arquivo de novo"""
+    # Sessão OAuth1 compartilhada
+    oauth = _sessao()
     #Url da api do Fluig para deletar o documento
-    url = f'{DOMINIO}/content-management/api/v2/documents/{documento_id}' 
+    url = f'{opcoes.DOMINIO}/content-management/api/v2/documents/{documento_id}' 
     #Chamada a api de deletar
     logging.info(f"Chamada a api para deletar documento ({documento_id}), url: {url}")
     response = oauth.delete(url)
@@ -97,120 +598,165 @@ def update_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo):
         logging.info(f"Chamada a api para deletar documento ({documento_id}), url: {url}")
         #Chamada a api para gravar arquivo
         logging.info(f"Chamada a api para enviar documento ({documento_id}), url: {url}")
-        response = envia_arquivo(nome_arquivo, id_pasta, caminho_arquivo)
+        response = envia_arquivo(nome_arquivo, id_pasta, caminho_arquivo, tamanho)
         return response
     else:
         raise Exception(f"Arquivo não foi deletado, status_code:{response.status_code}")
 
-def verifica_pasta_anterior(lista:list, parent_id):
-    """Função para verificar se as pastas anteriores são do arquivo em questão, devido ao FLUIG cada pasta ter um ID """
-    lista = lista[:-1]
-    lista.reverse()
-    pasta_correta = True
-    logging.info(f"Lista com as pastas invertida {lista}")
-
-    for index, item in enumerate(lista):
-        #Verifica se não é a ultima pasta
-        if index != len(lista) - 1:
-            #Primeira pasta
-            response = get_documento(parent_id)
-            if response.status_code == 200:
-                resposta = response.json()
-                description = resposta['description']
-                parent_id = resposta['parentId']
-                #Segunda Pasta
-                proximo_item = lista[index + 1]
-                response = get_documento(parent_id)
-                if response.status_code == 200:
-                    resposta = response.json()
-                    description_pasta_anterior = resposta['description']
-                    #Verifica se a descrição da pasta atual bate com a descrição, e se a proxima pasta bate com a proxima descrição
-                    if description == item and description_pasta_anterior == proximo_item:
-                        logging.info("Pasta Correta")
-                        pasta_correta = True
-                    else:
-                        logging.info("Pasta errada")
-                        pasta_correta = False
-                        break
-                else:
-                    raise Exception(f"Erro na consulta de get_documento, status{response.status_code}, body: {response.text}")
-            else:
-                raise Exception(f"Erro na consulta de get_documento, status{response.status_code}, body: {response.text}")
-        else:
-            break
-    return pasta_correta       
-
-def main(diretorio_arquivo):
-    logging.info("Iniciando a verificação no fluig")
-    diretorio_str = str(diretorio_arquivo)
-    lista = []
+def _busca_pasta(nome_pasta, parent_id):
+    """documentId da pasta com o nome dentro do parent_id, ou None se não existir"""
+    response = verifica_existencia_pasta(nome_pasta, parent_id)
+    resposta = response.json()
+    if resposta['values']:
+        #Pega o primeiro resultado como parte sempre da mesma pasta, no máximo só pode ter um resultado, levando em consideração que está vindo do sharepoint, pois no fluig tem como sim ter duas pastas com mesmo nome
+        return resposta['values'][0]['documentPK.documentId']
+    return None
+
+def _cria_pasta(nome_pasta, parent_id):
+    """Cria a pasta e retorna o documentId"""
+    response = cria_pasta(nome_pasta, parent_id)
+    if response.status_code != 200:
+        if pasta_inexistente(response):
+            raise PastaInexistente(parent_id)
+        raise Exception(f"Erro ao criar a pasta {nome_pasta}, status{response.status_code}, body: {response.text}")
+    resposta = response.json()
+    return resposta['documentId']
+
+@metricas.instrumenta('fluig.lista_pastas')
+def lista_pastas():
+    """Consulta única de todas as pastas ativas, retorna (documentId, descrição, parentId) para montar o cache"""
+    oauth = _sessao()
+    url = f'{opcoes.DOMINIO}/dataset/api/v2/dataset-handle/search?datasetId=document&field=documentPK.documentId&field=documentDescription&field=parentDocumentId&constraintsField=documentType&constraintsField=deleted&constraintsInitialValue={PESQUISA_PASTA}&constraintsInitialValue=false&constraintsFinalValue={PESQUISA_PASTA}&constraintsFinalValue=false&constraintsType=MUST&constraintsType=MUST'
+    logging.info(f"Chamada a api para listar as pastas, url: {url}")
+    response = oauth.get(url)
+    if response.status_code != 200:
+        raise Exception(f"Erro ao listar as pastas, status{response.status_code}, body: {response.text}")
+    return [
+        (valor['documentPK.documentId'], valor['documentDescription'], valor['parentDocumentId'])
+        for valor in response.json()['values']
+    ]
+
+def limpar_cache_documentos():
+    """Descarta os arquivos por pasta consultados até agora (modo serviço, a cada ciclo),
+    assim alterações feitas direto no fluig são vistas; o cache de pastas é mantido"""
+    with _lock_arquivos_pasta:
+        _arquivos_pasta.clear()
+        _arquivos_consultados.clear()
+
+def limpar_arquivos_pasta(parent_id):
+    """Descarta os arquivos consultados da pasta (ex: pasta que não existe mais no fluig)"""
+    with _lock_arquivos_pasta:
+        _arquivos_pasta.pop(str(parent_id), None)
+        _arquivos_consultados.pop(str(parent_id), None)
+
+def get_cache_pastas():
+    """Cache das pastas do fluig da execução, pré-carregado com uma única consulta se configurado"""
+    global _cache_pastas
+    with _lock_cache:
+        if _cache_pastas is None:
+            _cache_pastas = CachePastas(opcoes.PARENT_ID_PASTA_ENGETEC, _busca_pasta, _cria_pasta, opcoes.ARQUIVO_CACHE_PASTAS)
+            if opcoes.PRECARREGAR_PASTAS:
+                _cache_pastas.carregar(lista_pastas())
+        return _cache_pastas
+
+def salvar_cache_pastas():
+    """Grava o cache de pastas em disco no fim da execução"""
+    if _cache_pastas is not None:
+        _cache_pastas.salvar()
+
+def partes_caminho(diretorio_arquivo):
+    """Pastas e nome do arquivo a partir da pasta de download, ex: ['COMUNICAO', 'sub', 'arquivo.pdf']"""
+    if opcoes.PASTA_DOWNLOAD:
+        try:
+            return list(PurePath(diretorio_arquivo).relative_to(opcoes.PASTA_DOWNLOAD).parts)
+        except ValueError:
+            pass
     #Lista criada a partir do nome das pastas, pegando a 6 pq ta seguindo essa maquina a 5 é download
     #ex: C:\Users\rpa\Documents\POC-SHAREPOINT\download\COMUNICAO
-    lista = diretorio_str.split("\\")[6:] 
-    #Nome Arquivo sempre será o ultimo elemento da lista
-    nome_arquivo = lista[-1]
-    #Procurar o arquivo
-    response = verifica_existencia_arquivo(nome_arquivo)
-    existe_arquivo = False
+    return str(diretorio_arquivo).split("\\")[6:]
+
+def grava_arquivo(nome_arquivo, parent_id, origem, documento_id=None, tamanho=None, impressao=None):
+    """Grava o arquivo na pasta já resolvida: nova versão do documento_id informado ou um documento novo.
+    Retorna o documentId gravado no fluig, None se não foi gravado"""
+    if documento_id is not None:
+        response = update_arquivo(documento_id, origem, parent_id, nome_arquivo, tamanho, impressao)
+        documento_gravado = resultado_atualizacao(response, documento_id)
+    else:
+        conta_duplicado(impressao)
+        response = envia_arquivo(nome_arquivo, parent_id, origem, tamanho)
+        documento_gravado = resultado_envio(response, parent_id, nome_arquivo, origem, impressao)
+    _registra_arquivo_pasta(parent_id, nome_arquivo, documento_gravado)
+    return documento_gravado
+
+def resultado_atualizacao(response, documento_id):
+    """documentId depois do update_arquivo, None se não foi gravado (resposta None é conteúdo igual)"""
+    if response is None:
+        #Conteúdo igual, o documento continua o mesmo
+        return documento_id
+    if response.status_code == 200:
+        return extrai_document_id(response) or documento_id
+    logging.error(f"Arquivo não atualizado")
+    logging.error(response.status_code)
+    logging.error(response.text)
+    return None
 
+def resultado_envio(response, parent_id, nome_arquivo, origem, impressao=None):
+    """documentId do documento novo publicado pelo envia_arquivo, None se não foi gravado.
+    Levanta PastaInexistente se a pasta de destino não existe mais"""
     if response.status_code == 200:
-        resposta_values = response.json()
-        logging.info(f"Requisição de verificar existencia do arquivo bem sucedida, resposta: {resposta_values}")
-        if resposta_values['values']:
-            values = resposta_values['values']
-            #Percorrendo cada valor pois pode ter nomes de arquivos iguais em pastas diferentes
-            for valor in values:
-                documento_id = valor['documentPK.documentId']
-                response = get_documento(documento_id)
-                #Verifica o status 
-                if response.status_code == 200:
-                    #Resposta do arquivo
-                    resposta = response.json()
-                    logging.info(f"Requisição de verificar o arquivo bem sucedida, resposta: {resposta} ")
-                    parent_id = resposta['parentId'] 
-                    pasta_correta = verifica_pasta_anterior(lista, parent_id)
-                    #Se o arquivo estiver na Pasta correta ele irá excluir o arquivo e subir o novo
-                    if pasta_correta:
-                        logging.info(f"Existe o arquivo na pasta correta: ({nome_arquivo})")
-                        update_arquivo(documento_id, diretorio_arquivo, parent_id, nome_arquivo)
-                        existe_arquivo = True
-                        break  
-                else:
-                    raise f"Erro na consulta do arquivo {response.status_code} - {response.text}"
-        #Se não retornar valor pra consulta de arquivo, ou se o arquivo nao existe na pasta correta (pode existir em outra pasta)  
-        if not resposta_values['values'] or (resposta_values and not existe_arquivo):
-            parent_id = PARENT_ID_PASTA_ENGETEC #TODO esta seguindo atualmente a pasta "Teste"
-            #Verificar se cada pasta existe a partir da pasta da ENGETEC
-            for item in lista[0:-1]:
-                response = verifica_existencia_pasta(item, parent_id)
-                resposta = response.json()
-
-                if resposta['values']:
-                    #Pega o primeiro resultado como parte sempre da mesma pasta, no máximo só pode ter um resultado, levando em consideração que está vindo do sharepoint, pois no fluig tem como sim ter duas pastas com mesmo nome
-                    documento_id = resposta['values'][0]['documentPK.documentId']
-                    #Se a Pasta existir ele atribui o valor dela como parent_id, pra procurar a próxima
-                    parent_id = documento_id
-                else:
-                    logging.info(f"Criando a pasta {item}")
-                    response = cria_pasta(item, parent_id)
-                    resposta = response.json()
-                    documento_id = resposta['documentId']
-                    parent_id = documento_id
-            
-            #Após criar pastas criar o arquivo
-            logging.info(f"Criando arquivo: {nome_arquivo} no diretorio {diretorio_arquivo}")
-            response = envia_arquivo(nome_arquivo, parent_id, diretorio_arquivo)
-
-            if response.status_code == 200:
-                logging.info(f"Arquivo ({nome_arquivo}) gravado com sucesso")
-            else:
-                logging.error(f"Arquivo não gravado")
-                logging.error(response.status_code)
-                logging.error(response.text)
+        logging.info(f"Arquivo ({nome_arquivo}) gravado com sucesso")
+        documento_gravado = extrai_document_id(response)
+        grava_hash(documento_gravado, origem, impressao)
+        return documento_gravado
+    if pasta_inexistente(response):
+        raise PastaInexistente(parent_id)
+    logging.error(f"Arquivo não gravado")
+    logging.error(response.status_code)
+    logging.error(response.text)
+    return None
+
+def main(diretorio_arquivo, conteudo=None, tamanho=None, impressao=None):
+    """Grava o arquivo no fluig; conteudo é um stream opcional usado no lugar do arquivo local (envio sem disco)
+    e impressao o hash do conteúdo, se já calculado no download"""
+    logging.info("Iniciando a verificação no fluig")
+    origem = conteudo if conteudo is not None else diretorio_arquivo
+    lista = partes_caminho(diretorio_arquivo)
+    cache_pastas = get_cache_pastas()
+    invalidadas = set()
+    while True:
+        try:
+            return _grava_no_caminho(lista, cache_pastas, origem, tamanho, impressao)
+        except PastaInexistente as e:
+            invalida_pasta(e, invalidadas, lista, cache_pastas)
+
+def invalida_pasta(erro, invalidadas, lista, cache_pastas):
+    """Tira do cache a pasta da PastaInexistente para o caminho ser resolvido de novo.
+    Cada pasta do caminho é invalidada uma vez, a segunda falha na mesma pasta é um erro de verdade"""
+    if erro.parent_id in invalidadas or len(invalidadas) >= len(lista):
+        raise erro
+    invalidadas.add(erro.parent_id)
+    caminho = cache_pastas.por_documento().get(erro.parent_id) or lista[0:-1]
+    logging.info(f"Pasta {'/'.join(caminho)} ({erro.parent_id}) não existe mais no fluig, resolvendo de novo")
+    cache_pastas.invalida(caminho)
+    limpar_arquivos_pasta(erro.parent_id)
+
+def _grava_no_caminho(lista, cache_pastas, origem, tamanho, impressao):
+    """Resolve a pasta do arquivo pelo cache e grava; levanta PastaInexistente se um id do cache não vale mais"""
+    #Nome Arquivo sempre será o ultimo elemento da lista
+    nome_arquivo = lista[-1]
+    #Procurar o arquivo direto na pasta de destino (se a pasta ainda não existe o arquivo também não)
+    parent_id = cache_pastas.busca(lista[0:-1])
+    documento_id = localiza_arquivo(nome_arquivo, parent_id) if parent_id is not None else None
 
+    #Se o arquivo estiver na Pasta correta ele envia uma nova versão do documento
+    if documento_id is not None:
+        logging.info(f"Existe o arquivo na pasta correta: ({nome_arquivo})")
     else:
-        logging.error("Requisição para verificação de arquivo falhou")
-        logging.error(response.text)                      
+        #Verificar se cada pasta existe a partir da pasta da ENGETEC, usando o cache de pastas
+        parent_id = cache_pastas.resolve(lista[0:-1])
+        logging.info(f"Criando arquivo: {nome_arquivo} no diretorio {'/'.join(lista[0:-1])}")
+    #documentId do arquivo gravado no fluig, None se não foi gravado
+    return grava_arquivo(nome_arquivo, parent_id, origem, documento_id, tamanho, impressao)
 
 
 if __name__ == '__main__':
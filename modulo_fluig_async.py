@@ -0,0 +1,418 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import PurePath
+import aiohttp
+from yarl import URL
+from oauthlib.oauth1 import Client as ClienteOAuth1
+from requests.utils import requote_uri
+import politica_retry
+import metricas
+import configuracao
+import modulo_fluig
+from modulo_fluig import PESQUISA_PASTA, _url_dataset, opcoes as opcoes_fluig
+from cache_pastas_fluig import CachePastasAsync
+from estado_sync import EstadoSync, ARQUIVO_ESTADO
+
+opcoes = configuracao.Opcoes(
+    # Requisições ao fluig em andamento ao mesmo tempo, as demais aguardam a vez
+    CONCORRENCIA=('fluig_async', 'concorrencia', 50),
+    # Conexões keep-alive mantidas no pool compartilhado
+    CONEXOES=('fluig_async', 'conexoes', 20),
+    # Segundos sem receber dados de uma requisição antes de desistir dela
+    TIMEOUT=('fluig_async', 'timeout', 300),
+    # Arquivos sendo publicados ao mesmo tempo pelo publica_varios
+    ARQUIVOS=('fluig_async', 'arquivos', 100),
+    MODO_INCREMENTAL=('estado', 'ativo', True),
+    ARQUIVO_ESTADO=('estado', 'arquivo', ARQUIVO_ESTADO),
+)
+# Falhas de conexão que valem nova tentativa, como o ConnectionError/Timeout do requests
+_ERROS_CONEXAO = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+def _falha_ao_conectar(erro):
+    """Conexão recusada ou DNS, o fluig não recebeu a requisição (POST pode ser repetido)"""
+    return isinstance(erro, aiohttp.ClientConnectorError)
+
+
+class RespostaFluig:
+    """Resposta já lida, com a interface do requests usada pelos scripts (status_code, text, json())"""
+
+    def __init__(self, status_code, headers, content, enviados=0):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.enviados = enviados
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _bytes_resposta(resposta):
+    """Bytes enviados e recebidos, para as métricas"""
+    return resposta.enviados + len(resposta.content)
+
+
+class ClienteFluigAsync:
+    """Mesmas operações do modulo_fluig em asyncio: uma sessão aiohttp com pool de conexões compartilhado,
+    assinatura OAuth1 por requisição e no máximo `concorrencia` requisições em andamento.
+
+    Uso:
+        async with ClienteFluigAsync() as fluig:
+            resultados = await fluig.publica_varios(caminhos)
+    """
+
+    def __init__(self, concorrencia=None, conexoes=None, timeout=None):
+        self.concorrencia = concorrencia or opcoes.CONCORRENCIA
+        self.conexoes = conexoes or opcoes.CONEXOES
+        self.timeout = timeout or opcoes.TIMEOUT
+        self._oauth = ClienteOAuth1(opcoes_fluig.CLIENT_KEY, client_secret=opcoes_fluig.CLIENT_SECRET,
+                                    resource_owner_key=opcoes_fluig.RESOURCE_OWNER_KEY,
+                                    resource_owner_secret=opcoes_fluig.RESOURCE_OWNER_SECRET)
+        self._sessao = None
+        self._semaforo = None
+        #parentId -> tarefa da consulta dos arquivos da pasta, as tarefas da mesma pasta esperam a mesma consulta
+        self._arquivos_pasta = {}
+        #Nome do arquivo -> lock, a área de upload do usuário guarda um arquivo por nome até o check-in
+        self._travas_upload = {}
+        self.cache_pastas = CachePastasAsync(opcoes_fluig.PARENT_ID_PASTA_ENGETEC, self._busca_pasta, self._cria_pasta,
+                                             opcoes_fluig.ARQUIVO_CACHE_PASTAS)
+
+    async def __aenter__(self):
+        conector = aiohttp.TCPConnector(limit=self.conexoes, limit_per_host=self.conexoes)
+        self._sessao = aiohttp.ClientSession(connector=conector,
+                                             timeout=aiohttp.ClientTimeout(total=None, sock_read=self.timeout))
+        self._semaforo = asyncio.Semaphore(self.concorrencia)
+        if opcoes_fluig.PRECARREGAR_PASTAS:
+            self.cache_pastas.carregar(await self.lista_pastas())
+        return self
+
+    async def __aexit__(self, *_):
+        self.cache_pastas.salvar()
+        await self._sessao.close()
+        self._sessao = None
+
+    def _assina(self, metodo, url):
+        """Assina a url já codificada (a mesma enviada), um nonce novo a cada tentativa"""
+        uri, headers, _ = self._oauth.sign(requote_uri(url), http_method=metodo)
+        return URL(uri, encoded=True), headers
+
+    async def _envia(self, metodo, url, corpo_json, arquivo, leitor):
+        uri, headers = self._assina(metodo, url)
+        dados = None
+        enviados = 0
+        aberto = None
+        try:
+            if arquivo is not None:
+                #Reaberto a cada tentativa, o aiohttp lê o arquivo em blocos fora do loop
+                aberto = open(arquivo, 'rb')
+                dados = aiohttp.FormData()
+                dados.add_field('file', aberto, filename='file', content_type='application/octet-stream')
+                enviados = os.path.getsize(arquivo)
+            async with self._sessao.request(metodo, uri, headers=headers, data=dados, json=corpo_json) as response:
+                if leitor is not None and response.status == 200:
+                    conteudo = await leitor(response)
+                else:
+                    conteudo = await response.read()
+                return RespostaFluig(response.status, response.headers, conteudo, enviados)
+        finally:
+            if aberto is not None:
+                aberto.close()
+
+    async def _requisicao(self, metodo, url, corpo_json=None, arquivo=None, leitor=None):
+        """Requisição com limite de taxa, limite de concorrência e novas tentativas da politica_retry.
+        leitor(response) consome o corpo das respostas 200 (ex: download para o disco)"""
+        for tentativa in range(politica_retry.TENTATIVAS):
+            ultima = tentativa == politica_retry.TENTATIVAS - 1
+            espera_taxa = politica_retry.reserva('fluig')
+            if espera_taxa:
+                await asyncio.sleep(espera_taxa)
+            try:
+                async with self._semaforo:
+                    resposta = await self._envia(metodo, url, corpo_json, arquivo, leitor)
+            except _ERROS_CONEXAO as e:
+                if ultima or not politica_retry.pode_reenviar(metodo, erro=e, antes_do_envio=_falha_ao_conectar):
+                    raise
+                segundos = politica_retry.espera(tentativa)
+                logging.info(f"Erro de conexão com o fluig: {e!r}, tentando novamente em {segundos:.1f}s")
+                await asyncio.sleep(segundos)
+                continue
+            if ultima or not politica_retry.pode_reenviar(metodo, response=resposta):
+                return resposta
+            segundos = politica_retry.espera(tentativa, resposta)
+            logging.info(f"Fluig respondeu {resposta.status_code}, tentando novamente em {segundos:.1f}s")
+            await asyncio.sleep(segundos)
+
+    # Operações da api, com os mesmos nomes e retornos do modulo_fluig
+
+    @metricas.instrumenta_async('fluig.envia_arquivo', _bytes_resposta)
+    async def envia_arquivo(self, nome_arquivo, id_pasta, caminho_arquivo):
+        """Envia e publica o arquivo local na pasta"""
+        url = fr'{opcoes_fluig.DOMINIO}/content-management/api/v2/documents/upload/{nome_arquivo}/{id_pasta}/publish'
+        return await self._requisicao('POST', url, arquivo=caminho_arquivo)
+
+    @metricas.instrumenta_async('fluig.envia_versao', _bytes_resposta)
+    async def envia_versao(self, documento_id, nome_arquivo, caminho_arquivo):
+        """Envia o conteúdo como nova versão do mesmo documento, mantendo o documentId e o histórico"""
+        async with self._trava_upload(nome_arquivo):
+            url = fr'{opcoes_fluig.DOMINIO}/content-management/api/v2/documents/upload/{nome_arquivo}'
+            logging.info(f"Chamada a api para enviar nova versão do documento ({documento_id}), url: {url}")
+            response = await self._requisicao('POST', url, arquivo=caminho_arquivo)
+            if response.status_code != 200:
+                return response
+            url = f'{opcoes_fluig.DOMINIO}/api/public/ecm/document/updateFile'
+            body = {"id": documento_id, "attachments": [{"fileName": nome_arquivo, "principal": True}]}
+            logging.info(f"Chamada a api para atualizar a versão do documento ({documento_id}), url: {url}")
+            return await self._requisicao('POST', url, corpo_json=body)
+
+    @asynccontextmanager
+    async def _trava_upload(self, nome_arquivo):
+        """modulo_fluig.trava_upload para as tarefas: a trava externa (sincronização distribuída) ou a do processo,
+        adquirida em uma thread para não parar o loop; o lock por nome faz as tarefas esperarem a vez no loop"""
+        async with self._travas_upload.setdefault(nome_arquivo, asyncio.Lock()):
+            trava = modulo_fluig.trava_upload(nome_arquivo)
+            await asyncio.to_thread(trava.__enter__)
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(trava.__exit__, None, None, None)
+
+    @metricas.instrumenta_async('fluig.cria_pasta', _bytes_resposta)
+    async def cria_pasta(self, nome_pasta, parent_id):
+        url = fr'{opcoes_fluig.DOMINIO}/content-management/api/v2/folders/{parent_id}'
+        logging.info(f"Chamada a api para criar pasta ({nome_pasta}), url: {url}")
+        return await self._requisicao('POST', url, corpo_json={"alias": nome_pasta})
+
+    @metricas.instrumenta_async('fluig.get_documento', _bytes_resposta)
+    async def get_documento(self, documento_id):
+        url = f'{opcoes_fluig.DOMINIO}/content-management/api/v2/documents/{documento_id}'
+        logging.info(f"Chamada a api para verificar documento ({documento_id}), url: {url}")
+        return await self._requisicao('GET', url)
+
+    @metricas.instrumenta_async('fluig.remove_documento', _bytes_resposta)
+    async def remove_documento(self, documento_id):
+        url = f'{opcoes_fluig.DOMINIO}/content-management/api/v2/documents/{documento_id}'
+        logging.info(f"Chamada a api para deletar documento ({documento_id}), url: {url}")
+        return await self._requisicao('DELETE', url)
+
+    @metricas.instrumenta_async('fluig.verifica_existencia_pasta', _bytes_resposta)
+    async def verifica_existencia_pasta(self, item_lista, parent_id):
+        restricoes = [('documentDescription', item_lista, 'MUST'), ('documentType', PESQUISA_PASTA, 'MUST'),
+                      ('deleted', 'false', 'MUST'), ('parentDocumentId', parent_id, 'MUST')]
+        return await self._requisicao('GET', _url_dataset(['documentPK.documentId'], restricoes))
+
+    @metricas.instrumenta_async('fluig.consulta_dataset')
+    async def _consulta_dataset(self, url):
+        logging.info(f"Chamada a api do dataset, url: {url}")
+        response = await self._requisicao('GET', url)
+        if response.status_code != 200:
+            raise Exception(f"Erro na consulta do dataset, status{response.status_code}, body: {response.text}")
+        return response.json()['values']
+
+    async def lista_pastas(self):
+        """Consulta única de todas as pastas ativas, (documentId, descrição, parentId) para o cache"""
+        restricoes = [('documentType', PESQUISA_PASTA, 'MUST'), ('deleted', 'false', 'MUST')]
+        values = await self._consulta_dataset(
+            _url_dataset(['documentPK.documentId', 'documentDescription', 'parentDocumentId'], restricoes))
+        return [(valor['documentPK.documentId'], valor['documentDescription'], valor['parentDocumentId'])
+                for valor in values]
+
+    async def arquivos_da_pasta(self, parent_id):
+        """Todos os arquivos da pasta em uma consulta, {nome: documentId}; None acima do limite do dataset"""
+        values = await self._consulta_dataset(modulo_fluig.url_arquivos_pasta(parent_id))
+        return modulo_fluig.arquivos_por_nome(values, parent_id)
+
+    async def documentos_modificados(self, desde, ate=None):
+        """Mesma consulta do modulo_fluig.documentos_modificados"""
+        values = await self._consulta_dataset(modulo_fluig.url_documentos_modificados(desde, ate))
+        return modulo_fluig.modificados_por_documento(values, desde)
+
+    @metricas.instrumenta_async('fluig.baixa_documento')
+    async def baixa_documento(self, documento_id, destino, chunk_size=None):
+        """Baixa o documento em blocos para o disco (.part renomeado no fim), retorna (tamanho, SHA-256)"""
+        chunk_size = chunk_size or opcoes_fluig.CHUNK_SIZE
+        url = f'{opcoes_fluig.DOMINIO}/content-management/api/v2/documents/{documento_id}/stream'
+        logging.info(f"Chamada a api para baixar documento ({documento_id}), url: {url}")
+        temporario = f'{destino}.part'
+        resultado = {}
+
+        async def _grava(response):
+            sha = hashlib.sha256()
+            tamanho = 0
+            with open(temporario, 'wb') as f:
+                async for bloco in response.content.iter_chunked(chunk_size):
+                    await asyncio.to_thread(f.write, bloco)
+                    sha.update(bloco)
+                    tamanho += len(bloco)
+            resultado.update(tamanho=tamanho, hash=sha.hexdigest())
+            return b''
+
+        response = await self._requisicao('GET', url, leitor=_grava)
+        if response.status_code != 200:
+            raise Exception(f"Erro ao baixar o documento ({documento_id}), status{response.status_code}, body: {response.text}")
+        os.replace(temporario, destino)
+        return resultado['tamanho'], resultado['hash']
+
+    # Resolução de pastas e arquivos, como no modulo_fluig.main
+
+    async def _busca_pasta(self, nome_pasta, parent_id):
+        response = await self.verifica_existencia_pasta(nome_pasta, parent_id)
+        values = response.json()['values']
+        return values[0]['documentPK.documentId'] if values else None
+
+    async def _cria_pasta(self, nome_pasta, parent_id):
+        response = await self.cria_pasta(nome_pasta, parent_id)
+        if response.status_code != 200:
+            if modulo_fluig.pasta_inexistente(response):
+                raise modulo_fluig.PastaInexistente(parent_id)
+            raise Exception(f"Erro ao criar a pasta {nome_pasta}, status{response.status_code}, body: {response.text}")
+        return response.json()['documentId']
+
+    async def localiza_arquivo(self, nome_arquivo, parent_id):
+        """documentId do arquivo na pasta ou None; a pasta é consultada uma vez e compartilhada entre as tarefas"""
+        parent_id = str(parent_id)
+        if parent_id not in self._arquivos_pasta:
+            self._arquivos_pasta[parent_id] = asyncio.ensure_future(self.arquivos_da_pasta(parent_id))
+        arquivos = await self._arquivos_pasta[parent_id]
+        if arquivos is not None:
+            return arquivos.get(nome_arquivo)
+        #Pasta grande demais para a consulta de todos os arquivos, consulta pelo nome
+        values = await self._consulta_dataset(modulo_fluig.url_existencia_arquivos([nome_arquivo], parent_id))
+        return modulo_fluig.documentos_por_nome(values).get(nome_arquivo)
+
+    async def _registra_arquivo_pasta(self, parent_id, nome_arquivo, documento_id):
+        tarefa = self._arquivos_pasta.get(str(parent_id))
+        if tarefa is not None and documento_id is not None:
+            arquivos = await tarefa
+            if arquivos is not None:
+                arquivos[nome_arquivo] = documento_id
+
+    @metricas.instrumenta_async('fluig.substitui_arquivo')
+    async def substitui_arquivo(self, documento_id, caminho_arquivo, id_pasta, nome_arquivo):
+        """Deleta o documento e envia o arquivo de novo"""
+        response = await self.remove_documento(documento_id)
+        if response.status_code != 204:
+            raise Exception(f"Arquivo não foi deletado, status_code:{response.status_code}")
+        logging.info(f"Arquivo deletado: ({documento_id})")
+        return await self.envia_arquivo(nome_arquivo, id_pasta, caminho_arquivo)
+
+    async def update_arquivo(self, documento_id, caminho_arquivo, id_pasta, nome_arquivo, impressao=None):
+        """Nova versão do documento, None se o conteúdo for igual ao último enviado (nada é enviado)"""
+        repetido, impressao = await asyncio.to_thread(modulo_fluig.conteudo_repetido, documento_id, caminho_arquivo,
+                                                      impressao)
+        if repetido:
+            return None
+        if opcoes_fluig.ATUALIZAR_VERSAO:
+            response = await self.envia_versao(documento_id, nome_arquivo, caminho_arquivo)
+            if response.status_code in (404, 405):
+                logging.info(f"Api de versão indisponível ({response.status_code}), substituindo o documento ({documento_id})")
+                response = await self.substitui_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo)
+        else:
+            response = await self.substitui_arquivo(documento_id, caminho_arquivo, id_pasta, nome_arquivo)
+        if response.status_code == 200:
+            modulo_fluig.grava_hash(modulo_fluig.extrai_document_id(response) or documento_id, caminho_arquivo, impressao)
+        return response
+
+    async def publica(self, diretorio_arquivo, impressao=None):
+        """Grava o arquivo local no fluig como o modulo_fluig.main, retorna o documentId ou None se não foi gravado"""
+        lista = modulo_fluig.partes_caminho(diretorio_arquivo)
+        invalidadas = set()
+        while True:
+            try:
+                return await self._publica_no_caminho(lista, diretorio_arquivo, impressao)
+            except modulo_fluig.PastaInexistente as e:
+                modulo_fluig.invalida_pasta(e, invalidadas, lista, self.cache_pastas)
+                self._arquivos_pasta.pop(str(e.parent_id), None)
+
+    async def _publica_no_caminho(self, lista, diretorio_arquivo, impressao):
+        nome_arquivo = lista[-1]
+        parent_id = await self.cache_pastas.busca(lista[0:-1])
+        documento_id = await self.localiza_arquivo(nome_arquivo, parent_id) if parent_id is not None else None
+
+        if documento_id is not None:
+            logging.info(f"Existe o arquivo na pasta correta: ({nome_arquivo})")
+            response = await self.update_arquivo(documento_id, diretorio_arquivo, parent_id, nome_arquivo, impressao)
+            documento_gravado = modulo_fluig.resultado_atualizacao(response, documento_id)
+        else:
+            parent_id = await self.cache_pastas.resolve(lista[0:-1])
+            modulo_fluig.conta_duplicado(impressao)
+            logging.info(f"Criando arquivo: {nome_arquivo} no diretorio {diretorio_arquivo}")
+            response = await self.envia_arquivo(nome_arquivo, parent_id, diretorio_arquivo)
+            documento_gravado = await asyncio.to_thread(modulo_fluig.resultado_envio, response, parent_id,
+                                                        nome_arquivo, diretorio_arquivo, impressao)
+        await self._registra_arquivo_pasta(parent_id, nome_arquivo, documento_gravado)
+        return documento_gravado
+
+    async def publica_varios(self, caminhos, arquivos=None):
+        """Publica os arquivos com no máximo `arquivos` em andamento ao mesmo tempo, os caminhos são consumidos
+        aos poucos (pode ser um gerador). Erros em um arquivo são logados e não interrompem os demais;
+        retorna {caminho: documentId ou None}"""
+        pendentes = iter(caminhos)
+        resultados = {}
+
+        async def _publica():
+            #next no mesmo loop, sem await entre pegar o caminho e registrá-lo
+            for caminho in pendentes:
+                try:
+                    resultados[caminho] = await self.publica(caminho)
+                except Exception as e:
+                    logging.error(f"Erro ao publicar {caminho} no fluig: {e!r}")
+                    resultados[caminho] = None
+
+        await asyncio.gather(*(_publica() for _ in range(arquivos or opcoes.ARQUIVOS)))
+        return resultados
+
+
+def publica_arquivos(caminhos, arquivos=None, **parametros):
+    """Ponto de entrada síncrono: publica os arquivos locais com o cliente asyncio, retorna {caminho: documentId}"""
+    async def _executa():
+        async with ClienteFluigAsync(**parametros) as fluig:
+            return await fluig.publica_varios(caminhos, arquivos)
+    return asyncio.run(_executa())
+
+
+def arquivos_locais(raiz):
+    """Arquivos baixados dentro da pasta, sem os temporários dos downloads em andamento"""
+    for diretorio, _, nomes in os.walk(raiz):
+        for nome in sorted(nomes):
+            if not nome.endswith('.part') and not nome.startswith('.'):
+                yield PurePath(diretorio, nome)
+
+
+def main(pasta=None):
+    """Publica no fluig os arquivos já baixados na pasta de download (ou em uma subpasta dela) com o cliente asyncio.
+    Retorna a exceção que interrompeu a execução, ou 1 se algum arquivo não foi publicado"""
+    configuracao.configura_log()
+    estado = None
+    if opcoes.MODO_INCREMENTAL:
+        estado = EstadoSync(opcoes.ARQUIVO_ESTADO)
+        modulo_fluig.configura_estado(estado)
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
+    start_time = time.time()
+    logging.info(f"Inicio: {datetime.now()}")
+    try:
+        raiz = PurePath(opcoes_fluig.PASTA_DOWNLOAD, pasta or '')
+        resultados = publica_arquivos(arquivos_locais(raiz))
+        falhas = sum(1 for documento_id in resultados.values() if documento_id is None)
+        logging.info(f"Arquivos publicados: {len(resultados) - falhas}, com erro: {falhas}")
+    except Exception as e:
+        logging.error(f"Erro: {e}")
+        return e
+    finally:
+        modulo_fluig.resumo_deduplicacao()
+        metricas.finaliza()
+        if estado is not None:
+            modulo_fluig.configura_estado(None)
+            estado.fechar()
+    logging.info(f"Tempo decorrido: {time.time() - start_time}")
+    logging.info(f"Fim: {datetime.now()}")
+    return 1 if falhas else 0
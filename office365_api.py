@@ -1,126 +1,363 @@
-from urllib import response
-from office365.sharepoint.client_context import ClientContext
-from office365.runtime.auth.user_credential import UserCredential
-from office365.sharepoint.files.file import File
-import datetime
-import yaml
+import gerenciador_sessao
+import politica_retry
+import metricas
+import configuracao
 import logging
-import time
-
-data_hoje = datetime.datetime.now().strftime(r"%d-%m-%Y")
-# Configuração básica do logger
-logging.basicConfig(
-    filename=f'log/app-{data_hoje}.log',  # Especifica o arquivo de log
-    level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
+import os
+import hashlib
+import uuid
+import requests
+from datetime import timezone
+
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    USERNAME=('sharepoint', 'sharepoint_email'),
+    PASSWORD=('sharepoint', 'sharepoint_password'),
+    SHAREPOINT_SITE=('sharepoint', 'sharepoint_url_site'),
+    SHAREPOINT_SITE_NAME=('sharepoint', 'sharepoint_site_name'),
+    SHAREPOINT_DOC=('sharepoint', 'sharepoint_doc_library'),
+    PASTA_DOWNLOAD=('sharepoint', 'pasta_local_download'),
+    # Token fixo (Bearer) no lugar do login com usuário e senha, usado com o SharePoint simulado do benchmark
+    ACCESS_TOKEN=('sharepoint', 'access_token', None),
+    # Itens por página no iter_files (cada página é uma consulta à lista)
+    TAMANHO_PAGINA=('listagem', 'tamanho_pagina', 500),
+    # Tamanho dos blocos lidos no download em stream
+    CHUNK_SIZE=('streaming', 'chunk_size', 1024 * 1024),
 )
 
-with open(r'C:\Users\rpa\Documents\POC-SHAREPOINT\config.yaml', 'r', encoding='utf=8') as params:
-    config = yaml.safe_load(params)
-    USERNAME = config['sharepoint']['sharepoint_email']
-    PASSWORD = config['sharepoint']['sharepoint_password']
-    SHAREPOINT_SITE = config['sharepoint']['sharepoint_url_site']
-    SHAREPOINT_SITE_NAME = config['sharepoint']['sharepoint_site_name']
-    SHAREPOINT_DOC = config['sharepoint']['sharepoint_doc_library']
-    PASTA_DOWNLOAD = config['sharepoint']['pasta_local_download']
+
+def _configura_sessoes(config):
+    """Ajusta as sessões e o retry quando a configuração é lida, antes da primeira requisição"""
+    gerenciador_sessao.configurar(**config.get('sessao', {}))
+    politica_retry.configurar(**config.get('retry', {}))
+
+configuracao.ao_carregar(_configura_sessoes)
+
+
+def _data_odata(data):
+    """Data no formato usado nos $filter do SharePoint, em UTC (datas sem fuso já são consideradas UTC)"""
+    if data.tzinfo is not None:
+        data = data.astimezone(timezone.utc)
+    return data.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 class SharePoint:
         
     def _auth(self):
-        conn = ClientContext(SHAREPOINT_SITE).with_credentials(
-            UserCredential(
-                USERNAME,
-                PASSWORD
-            )
-        )
+        # Reaproveita o contexto já autenticado e o pool de conexões do gerenciador de sessão
+        conn = gerenciador_sessao.contexto_sharepoint(opcoes.SHAREPOINT_SITE, opcoes.USERNAME, opcoes.PASSWORD,
+                                                      opcoes.ACCESS_TOKEN)
         return conn
+
+    def _renova_se_expirado(self, erro):
+        """Se o SharePoint recusou a autenticação, força um novo token na próxima tentativa"""
+        resposta = getattr(erro, 'response', None)
+        if resposta is not None and resposta.status_code in (401, 403):
+            logging.info("Autenticação recusada pelo SharePoint, renovando o token")
+            gerenciador_sessao.renovar_sharepoint()
     
+    @metricas.instrumenta('sharepoint.get_files_list')
     def _get_files_list(self, folder_name):
-        conn = self._auth()
+        _, files = self.get_folder_contents(folder_name)
+        logging.info(f"Consulta de arquivos executada com sucesso")
+        return files
+
+    @metricas.instrumenta('sharepoint.get_folder_contents')
+    def get_folder_contents(self, folder_name):
+        """Subpastas e arquivos da pasta com uma única consulta (expand de Folders e Files)"""
         target_folder_url = f'{folder_name}'
-        for _ in range(3):  # Tenta 3 vezes
-            try:
-                root_folder = conn.web.get_folder_by_server_relative_url(target_folder_url)
-                root_folder.expand(["Files", "Folders"]).get().execute_query()
-                logging.info(f"Consulta de arquivos executada com sucesso")
-                return root_folder.files
-            except Exception as e:
-                logging.error(f"Erro ao consultar arquivos da pasta: {e}")
-                logging.info("Tentando baixar novamente em 10 segundos...")
-                time.sleep(10)  # Espera 5 segundos antes de tentar novamente
-        # Se todas as tentativas falharem, levanta uma exceção ou retorna None
-        logging.error("Não foi possível consultar os arquivos após várias tentativas.")
-        return e
-        
-    
+
+        def _consulta():
+            conn = self._auth()
+            root_folder = conn.web.get_folder_by_server_relative_url(target_folder_url)
+            root_folder.expand(["Files", "Folders"]).get().execute_query()
+            return root_folder.folders, root_folder.files
+
+        # Novas tentativas com backoff só para falhas temporárias, se todas falharem a exceção é levantada
+        return politica_retry.executa(_consulta, 'sharepoint', f'ao consultar arquivos da pasta {folder_name}',
+                                      self._renova_se_expirado)
+
+    @metricas.instrumenta('sharepoint.get_latest_files')
+    def get_latest_files(self, folder_name, quantidade=1, modificado_desde=None):
+        """Os arquivos mais recentes da pasta, ordenados e limitados no SharePoint ($orderby/$top/$filter),
+        sem trazer a lista inteira. Com modificado_desde, só os modificados a partir da data"""
+        def _consulta():
+            conn = self._auth()
+            files = conn.web.get_folder_by_server_relative_url(folder_name).files
+            if modificado_desde is not None:
+                files = files.filter(f"TimeLastModified ge datetime'{_data_odata(modificado_desde)}'")
+            return files.order_by('TimeLastModified desc').top(quantidade).get().execute_query()
+
+        return list(politica_retry.executa(_consulta, 'sharepoint', f'ao consultar arquivos recentes de {folder_name}',
+                                           self._renova_se_expirado))
+
+    def iter_files(self, folder_name, modificado_desde=None, tamanho_pagina=None):
+        """Percorre os arquivos da pasta (sem subpastas) página a página, sem montar a lista inteira em memória.
+        Com modificado_desde, o filtro de data é feito no SharePoint"""
+        filtro = f"FileDirRef eq '/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}' and FSObjType eq 0"
+        if modificado_desde is not None:
+            filtro += f" and Modified ge datetime'{_data_odata(modificado_desde)}'"
+        for item in self.iter_list_items(folder_name.split('/')[0], filtro, tamanho_pagina=tamanho_pagina):
+            yield item.file
+
+    def iter_list_items(self, biblioteca, filtro=None, campos=None, tamanho_pagina=None):
+        """Percorre os itens da biblioteca página a página, em ordem de Id e com o File expandido.
+        Cada página continua do último Id lido, então uma falha repete só a página e nenhuma página
+        fica guardada depois de percorrida"""
+        tamanho_pagina = tamanho_pagina or opcoes.TAMANHO_PAGINA
+        campos = campos or ['Id', 'File']
+        ultimo_id = 0
+        while True:
+            filtro_pagina = f'({filtro}) and Id gt {ultimo_id}' if filtro else f'Id gt {ultimo_id}'
+            pagina = self._pagina_itens(biblioteca, filtro_pagina, campos, tamanho_pagina)
+            yield from pagina
+            if len(pagina) < tamanho_pagina:
+                return
+            ultimo_id = pagina[len(pagina) - 1].properties['Id']
+
+    @metricas.instrumenta('sharepoint.pagina_itens')
+    def _pagina_itens(self, biblioteca, filtro, campos, tamanho_pagina):
+        """Uma página de itens da biblioteca, em ordem de Id, com o File expandido"""
+        def _consulta():
+            conn = self._auth()
+            itens = conn.web.get_list(f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{biblioteca}').items.select(campos).expand(['File'])
+            return itens.filter(filtro).order_by('Id').top(tamanho_pagina).get().execute_query()
+
+        return politica_retry.executa(_consulta, 'sharepoint', f'ao consultar os itens de {biblioteca}',
+                                      self._renova_se_expirado)
+
+    @metricas.instrumenta('sharepoint.get_folder_list')
     def get_folder_list(self, folder_name):
-        conn = self._auth()
         target_folder_url = f'{folder_name}'
-        
-        for _ in range(3):  # Tenta 3 vezes
-            try:
-                root_folder = conn.web.get_folder_by_server_relative_url(target_folder_url)
-                root_folder.expand(["Folders"]).get().execute_query()
-                return root_folder.folders
-            except Exception as e:
-                logging.error(f"Erro ao consultar lista de pastas: {e}")
-                logging.info("Tentando consultar novamente em 10 segundos...")
-                time.sleep(10)  # Espera 5 segundos antes de tentar novamente
-        # Se todas as tentativas falharem, levanta uma exceção ou retorna None
-        logging.error("Não foi possível consultar as pastas após várias tentativas.")
-        return e
 
+        def _consulta():
+            conn = self._auth()
+            root_folder = conn.web.get_folder_by_server_relative_url(target_folder_url)
+            root_folder.expand(["Folders"]).get().execute_query()
+            return root_folder.folders
+
+        return politica_retry.executa(_consulta, 'sharepoint', f'ao consultar lista de pastas de {folder_name}',
+                                      self._renova_se_expirado)
+
+    @metricas.instrumenta('sharepoint.download_file')
     def download_file(self, file_name, folder_name):  
+        from office365.sharepoint.files.file import File
+        file_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}/{file_name}'
+
+        def _download():
+            conn = self._auth()
+            file = File.open_binary(conn, file_url)
+            file.raise_for_status()
+            return file.content
+
+        content = politica_retry.executa(_download, 'sharepoint', f'ao baixar arquivo {file_name}',
+                                         self._renova_se_expirado)
+        logging.info(f"Download feito com sucesso, arquivo: {file_name}")
+        return content
+    
+    @metricas.instrumenta('sharepoint.open_stream')
+    def open_stream(self, file_name, folder_name, inicio=0):
+        """Abre o conteúdo do arquivo como stream, sem carregar em memória; inicio permite ler a partir de um byte (Range)"""
+        from office365.runtime.http.request_options import RequestOptions
+        from office365.runtime.http.http_method import HttpMethod
+        file_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}/{file_name}'
         conn = self._auth()
-        file_url = f'/sites/{SHAREPOINT_SITE_NAME}/{folder_name}/{file_name}'
+        request = RequestOptions(
+            "{0}/web/getFileByServerRelativePath(DecodedUrl='{1}')/$value".format(conn.service_root_url(), file_url)
+        )
+        request.method = HttpMethod.Get
+        request.stream = True
+        if inicio:
+            request.set_header('Range', f'bytes={inicio}-')
+        response = conn.pending_request().execute_request_direct(request)
+        response.raise_for_status()
+        return response
 
-        for _ in range(3):  # Tenta 3 vezes
+    @metricas.instrumenta('sharepoint.download_file_to_path')
+    def download_file_to_path(self, file_name, folder_name, destino, chunk_size=None, retomar=False):
+        """Baixa o arquivo em blocos direto para o disco, a memória usada não depende do tamanho do arquivo.
+        Grava em um arquivo temporário (.part) e só renomeia para o destino quando o download termina.
+        As novas tentativas continuam o .part da tentativa anterior (Range); com retomar, a primeira tentativa também
+        continua o .part deixado por uma execução interrompida, só deve ser usado quando ele é da mesma versão do arquivo.
+        Retorna o tamanho e o SHA-256 do conteúdo, calculado durante o download."""
+        chunk_size = chunk_size or opcoes.CHUNK_SIZE
+        temporario = f'{destino}.part'
+        #Sem retomar, o .part de uma execução anterior é descartado; depois da primeira tentativa ele é desta execução
+        continua = retomar
+
+        def _download():
+            nonlocal continua
+            inicio = os.path.getsize(temporario) if continua and os.path.exists(temporario) else 0
             try:
-                file = File.open_binary(conn, file_url)
-                logging.info(f"Download feito com sucesso, arquivo: {file_name}")
-                return file.content
-            except Exception as e:
-                logging.error(f"Erro ao baixar arquivo: {e}")
-                logging.info("Tentando baixar novamente em 10 segundos...")
-                time.sleep(10)  # Espera 5 segundos antes de tentar novamente
-        
-        # Se todas as tentativas falharem, levanta uma exceção ou retorna None
-        logging.error("Não foi possível baixar o arquivo após várias tentativas.")
-        return e
-    
+                response = self.open_stream(file_name, folder_name, inicio)
+            except requests.HTTPError as e:
+                #416: o .part já tem o tamanho do arquivo (ou mais), baixa de novo do início
+                if not inicio or e.response is None or e.response.status_code != 416:
+                    raise
+                inicio = 0
+                response = self.open_stream(file_name, folder_name)
+            #Servidor ignorou o Range e mandou o arquivo inteiro
+            if inicio and response.status_code != 206:
+                inicio = 0
+            if inicio:
+                logging.info(f"Retomando o download de {file_name} a partir de {inicio} bytes")
+            sha = hashlib.sha256()
+            tamanho = inicio
+            with response, open(temporario, 'ab' if inicio else 'wb') as f:
+                continua = True
+                if inicio:
+                    #O hash inclui o que já estava baixado
+                    with open(temporario, 'rb') as parcial:
+                        for chunk in iter(lambda: parcial.read(chunk_size), b''):
+                            sha.update(chunk)
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    sha.update(chunk)
+                    tamanho += len(chunk)
+            os.replace(temporario, destino)
+            return tamanho, sha.hexdigest()
+
+        resultado = politica_retry.executa(_download, 'sharepoint', f'ao baixar arquivo {file_name}',
+                                           self._renova_se_expirado)
+        logging.info(f"Download feito com sucesso, arquivo: {file_name}")
+        return resultado
+
+    @metricas.instrumenta('sharepoint.download_latest_file')
     def download_latest_file(self, folder_name):
-        date_format = "%Y-%m-%dT%H:%M:%SZ"
-        files_list = self._get_files_list(folder_name)
-        file_dict = {}
-        for file in files_list:
-            dt_obj = datetime.datetime.strptime(file.time_last_modified, date_format)
-            file_dict[file.name] = dt_obj
-        # sort dict object to get the latest file
-        file_dict_sorted = {key:value for key, value in sorted(file_dict.items(), key=lambda item:item[1], reverse=True)}    
-        latest_file_name = next(iter(file_dict_sorted))
+        # O SharePoint ordena e devolve só o mais recente, a pasta não é listada inteira
+        latest_files = self.get_latest_files(folder_name, 1)
+        if not latest_files:
+            logging.info(f"Nenhum arquivo na pasta {folder_name}")
+            return None, None
+        latest_file_name = latest_files[0].name
         content = self.download_file(latest_file_name, folder_name)
         return latest_file_name, content
-        
 
+
+    @metricas.instrumenta('sharepoint.get_file_properties')
+    def get_file_properties(self, file_name, folder_name):
+        """Propriedades atuais do arquivo (file_properties), ou None se ele não existe no SharePoint"""
+        from office365.runtime.client_request_exception import ClientRequestException
+        file_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}/{file_name}'
+
+        def _consulta():
+            conn = self._auth()
+            try:
+                return conn.web.get_file_by_server_relative_path(file_url).get().execute_query()
+            except ClientRequestException as e:
+                #Arquivo inexistente não é erro, não passa pelas novas tentativas
+                if e.response is not None and e.response.status_code == 404:
+                    return None
+                raise
+
+        file = politica_retry.executa(_consulta, 'sharepoint', f'ao consultar arquivo {file_name}',
+                                      self._renova_se_expirado)
+        return None if file is None else self.file_properties(file)
+
+    @metricas.instrumenta('sharepoint.ensure_folder')
+    def ensure_folder(self, folder_name):
+        """Cria as pastas do caminho que ainda não existem (Folders.Add devolve a pasta se ela já existe)"""
+        partes = folder_name.split('/')
+        for i in range(1, len(partes)):
+            pai = f"/sites/{opcoes.SHAREPOINT_SITE_NAME}/{'/'.join(partes[:i])}"
+
+            def _cria(pai=pai, nome=partes[i]):
+                conn = self._auth()
+                return conn.web.get_folder_by_server_relative_path(pai).folders.add(nome).execute_query()
+
+            politica_retry.executa(_cria, 'sharepoint', f'ao criar a pasta {partes[i]}', self._renova_se_expirado)
+
+    @metricas.instrumenta('sharepoint.upload_file')
     def upload_file(self, file_name, folder_name, content):
         conn = self._auth()
-        target_folder_url = f'/sites/{SHAREPOINT_SITE_NAME}/{folder_name}'
+        target_folder_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}'
         target_folder = conn.web.get_folder_by_server_relative_path(target_folder_url)
         response = target_folder.upload_file(file_name, content).execute_query()
         return response
     
-    def upload_file_in_chunks(self, file_path, folder_name, chunk_size, chunk_uploaded=None, **kwargs):
-        conn = self._auth()
-        target_folder_url = f'/sites/{SHAREPOINT_SITE_NAME}/{folder_name}'
-        target_folder = conn.web.get_folder_by_server_relative_path(target_folder_url)
-        response = target_folder.files.create_upload_session(
-            source_path=file_path,
-            chunk_size=chunk_size,
-            chunk_uploaded=chunk_uploaded,
-            **kwargs
-        ).execute_query()
-        return response
-    
+    @metricas.instrumenta('sharepoint.upload_file_in_chunks')
+    def upload_file_in_chunks(self, file_path, folder_name, chunk_size, chunk_uploaded=None, estado=None, **kwargs):
+        """Envia o arquivo em blocos. Com estado (EstadoSync), a sessão de upload (uploadId e offset) é gravada
+        a cada bloco e uma execução interrompida continua do último bloco confirmado"""
+        if estado is None:
+            conn = self._auth()
+            target_folder_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}'
+            target_folder = conn.web.get_folder_by_server_relative_path(target_folder_url)
+            response = target_folder.files.create_upload_session(
+                file_path,
+                chunk_size,
+                chunk_uploaded,
+                **kwargs
+            ).execute_query()
+            return response
+        return self._upload_retomavel(file_path, folder_name, chunk_size, chunk_uploaded, estado, **kwargs)
+
+    def _upload_retomavel(self, file_path, folder_name, chunk_size, chunk_uploaded, estado, **kwargs):
+        """Upload em blocos com StartUpload/ContinueUpload/FinishUpload, retomando a sessão gravada no estado"""
+        from office365.runtime.client_request_exception import ClientRequestException
+        target_folder_url = f'/sites/{opcoes.SHAREPOINT_SITE_NAME}/{folder_name}'
+        file_name = os.path.basename(file_path)
+        destino = f'{target_folder_url}/{file_name}'
+        tamanho = os.path.getsize(file_path)
+
+        with open(file_path, 'rb') as f:
+            if tamanho <= chunk_size:
+                def _envia_inteiro():
+                    #Cada tentativa lê o arquivo do início, a anterior já consumiu o conteúdo
+                    f.seek(0)
+                    conn = self._auth()
+                    pasta = conn.web.get_folder_by_server_relative_path(target_folder_url)
+                    return pasta.files.add(file_name, f.read(), True).execute_query()
+                return politica_retry.executa(_envia_inteiro, 'sharepoint', f'ao enviar arquivo {file_name}',
+                                              self._renova_se_expirado)
+
+            sessao = estado.sessao_upload(destino)
+            if sessao is not None and sessao[2] == tamanho:
+                upload_id, offset = sessao[0], sessao[1]
+                logging.info(f"Retomando o upload de {file_name} a partir de {offset} bytes")
+            else:
+                upload_id, offset = str(uuid.uuid4()), 0
+
+            def _bloco(upload_id, offset):
+                """Envia o bloco que começa em offset, retorna o novo offset"""
+                conn = self._auth()
+                f.seek(offset)
+                conteudo = f.read(chunk_size)
+                if offset == 0:
+                    pasta = conn.web.get_folder_by_server_relative_path(target_folder_url)
+                    pasta.files.add(file_name, None, True).start_upload(upload_id, conteudo)
+                else:
+                    arquivo = conn.web.get_file_by_server_relative_path(destino)
+                    if offset + len(conteudo) < tamanho:
+                        arquivo.continue_upload(upload_id, offset, conteudo)
+                    else:
+                        arquivo.finish_upload(upload_id, offset, conteudo)
+                conn.execute_query()
+                return offset + len(conteudo)
+
+            retomando = offset > 0
+            while offset < tamanho:
+                try:
+                    offset = politica_retry.executa(lambda: _bloco(upload_id, offset), 'sharepoint',
+                                                    f'ao enviar bloco de {file_name}', self._renova_se_expirado)
+                except ClientRequestException:
+                    if not retomando:
+                        raise
+                    #Sessão gravada não existe mais no SharePoint (expirada ou cancelada), recomeça do início
+                    logging.info(f"Sessão de upload de {file_name} não foi aceita, enviando do início")
+                    upload_id, offset, retomando = str(uuid.uuid4()), 0, False
+                    continue
+                retomando = False
+                if offset < tamanho:
+                    estado.grava_sessao_upload(destino, upload_id, offset, tamanho)
+                if callable(chunk_uploaded):
+                    chunk_uploaded(offset, **kwargs)
+        estado.remove_sessao_upload(destino)
+        logging.info(f"Upload em blocos concluído, arquivo: {file_name}")
+        return politica_retry.executa(
+            lambda: self._auth().web.get_file_by_server_relative_path(destino).get().execute_query(),
+            'sharepoint', f'ao consultar arquivo {file_name}', self._renova_se_expirado)
+
+    @metricas.instrumenta('sharepoint.get_list')
     def get_list(self, list_name):
         conn = self._auth()
         target_list = conn.web.lists.get_by_title(list_name)
@@ -131,17 +368,20 @@ class SharePoint:
         files_list = self._get_files_list(folder_name)
         properties_list = []
         for file in files_list:
-            file_dict = {
-                'file_id': file.unique_id,
-                'file_name': file.name,
-                'major_version': file.major_version,
-                'minor_version': file.minor_version,
-                'file_size': file.length,
-                'time_created': file.time_created,
-                'time_last_modified': file.time_last_modified
-            }
-            properties_list.append(file_dict)
-            file_dict = {}
+            properties_list.append(self.file_properties(file))
         return properties_list
+
+    @staticmethod
+    def file_properties(file):
+        """Propriedades do arquivo usadas para controlar a sincronização"""
+        return {
+            'file_id': file.unique_id,
+            'file_name': file.name,
+            'major_version': file.major_version,
+            'minor_version': file.minor_version,
+            'file_size': file.length,
+            'time_created': file.time_created,
+            'time_last_modified': file.time_last_modified
+        }
     
 
@@ -0,0 +1,149 @@
+import threading
+import queue
+import time
+import logging
+
+# Marca de fim de fila para os workers
+_FIM = object()
+
+
+class EstatisticaEtapa:
+    """Contadores de uma etapa do pipeline"""
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.itens = 0
+        self.bytes = 0
+        self.erros = 0
+        self.inicio = None
+        self.fim = None
+        self._lock = threading.Lock()
+
+    def registra(self, n_bytes=0, erro=False):
+        with self._lock:
+            agora = time.time()
+            if self.inicio is None:
+                self.inicio = agora
+            self.fim = agora
+            if erro:
+                self.erros += 1
+            else:
+                self.itens += 1
+                self.bytes += n_bytes or 0
+
+    def resumo(self):
+        duracao = (self.fim - self.inicio) if self.inicio else 0
+        itens_s = self.itens / duracao if duracao else 0
+        mb_s = self.bytes / 1024 / 1024 / duracao if duracao else 0
+        return (f"Etapa {self.nome}: {self.itens} itens, {self.erros} erros, "
+                f"{self.bytes / 1024 / 1024:.2f} MB em {duracao:.1f}s "
+                f"({itens_s:.2f} itens/s, {mb_s:.2f} MB/s)")
+
+
+def executar(pastas_iniciais, listar, baixar, publicar, workers_listagem=2, workers_download=4,
+             workers_upload=4, tamanho_fila=50):
+    """Executa listagem, download e envio ao Fluig em etapas paralelas ligadas por filas limitadas.
+
+    listar(pasta) -> (subpastas, arquivos), cada arquivo é repassado para baixar(arquivo)
+    baixar(arquivo) -> (baixado, tamanho), o baixado é repassado para publicar(baixado);
+    baixado None indica que não há nada a publicar (ex: já publicado numa execução interrompida)
+    Erros em um arquivo são registrados e não interrompem os demais, como no save_file.
+    """
+    fila_pastas = queue.Queue()
+    fila_download = queue.Queue(maxsize=tamanho_fila)
+    fila_upload = queue.Queue(maxsize=tamanho_fila)
+    est_listagem = EstatisticaEtapa('listagem')
+    est_download = EstatisticaEtapa('download')
+    est_upload = EstatisticaEtapa('upload')
+
+    #Pastas ainda não listadas (inclui as que estão em processamento)
+    pendentes = [0]
+    lock_pendentes = threading.Lock()
+
+    def adiciona_pasta(pasta):
+        with lock_pendentes:
+            pendentes[0] += 1
+        fila_pastas.put(pasta)
+
+    def worker_listagem():
+        while True:
+            pasta = fila_pastas.get()
+            if pasta is _FIM:
+                break
+            try:
+                subpastas, arquivos = listar(pasta)
+                for subpasta in subpastas:
+                    adiciona_pasta(subpasta)
+                for arquivo in arquivos:
+                    fila_download.put(arquivo)
+                est_listagem.registra()
+            except Exception as e:
+                logging.error(f"Erro ao listar a pasta {pasta}: {e}")
+                est_listagem.registra(erro=True)
+            finally:
+                with lock_pendentes:
+                    pendentes[0] -= 1
+                    terminou = pendentes[0] == 0
+                if terminou:
+                    #Última pasta listada, libera todos os workers de listagem
+                    for _ in range(workers_listagem):
+                        fila_pastas.put(_FIM)
+
+    def worker_download():
+        while True:
+            arquivo = fila_download.get()
+            if arquivo is _FIM:
+                break
+            try:
+                baixado, tamanho = baixar(arquivo)
+                est_download.registra(tamanho)
+                if baixado is not None:
+                    fila_upload.put((baixado, tamanho))
+            except Exception as e:
+                logging.error(f"Erro ao baixar o arquivo {arquivo}: {e}")
+                est_download.registra(erro=True)
+
+    def worker_upload():
+        while True:
+            item = fila_upload.get()
+            if item is _FIM:
+                break
+            baixado, tamanho = item
+            try:
+                publicar(baixado)
+                est_upload.registra(tamanho)
+            except Exception as e:
+                logging.error(f"Erro na hora de gravar no fluig: {e}")
+                est_upload.registra(erro=True)
+
+    def inicia(alvo, quantidade, nome):
+        threads = [threading.Thread(target=alvo, name=f'{nome}-{i}', daemon=True) for i in range(quantidade)]
+        for t in threads:
+            t.start()
+        return threads
+
+    if not pastas_iniciais:
+        return [est_listagem, est_download, est_upload]
+
+    for pasta in pastas_iniciais:
+        adiciona_pasta(pasta)
+    threads_listagem = inicia(worker_listagem, workers_listagem, 'listagem')
+    threads_download = inicia(worker_download, workers_download, 'download')
+    threads_upload = inicia(worker_upload, workers_upload, 'upload')
+
+    #Encerra cada etapa em ordem, quando a anterior terminar
+    for t in threads_listagem:
+        t.join()
+    for _ in threads_download:
+        fila_download.put(_FIM)
+    for t in threads_download:
+        t.join()
+    for _ in threads_upload:
+        fila_upload.put(_FIM)
+    for t in threads_upload:
+        t.join()
+
+    estatisticas = [est_listagem, est_download, est_upload]
+    for est in estatisticas:
+        logging.info(est.resumo())
+    return estatisticas
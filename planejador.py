@@ -0,0 +1,353 @@
+from office365_api import SharePoint, opcoes as opcoes_sharepoint
+import os
+import argparse
+from pathlib import PurePath
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import modulo_fluig
+import gerenciador_sessao
+import metricas
+from inventario import monta_inventario
+from estado_sync import EstadoSync, ARQUIVO_ESTADO
+import logging
+import configuracao
+
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    #Biblioteca do SharePoint sincronizada, o caminho no fluig é o mesmo a partir da pasta raiz
+    FOLDER_NAME=('sharepoint', 'sharepoint_doc_library'),
+    FOLDER_DEST=('sharepoint', 'pasta_local_download'),
+    # Arquivo do índice de estado
+    ARQUIVO_ESTADO=('estado', 'arquivo', ARQUIVO_ESTADO),
+    # Parâmetros do inventário do SharePoint (limite de memória, arquivo temporário)
+    INVENTARIO=lambda config: config.get('inventario') or {},
+    # Pastas criadas ao mesmo tempo em cada nível da árvore
+    WORKERS_PASTAS=('planejador', 'workers_pastas', 8),
+    # Arquivos baixados e enviados ao mesmo tempo
+    WORKERS_ARQUIVOS=('planejador', 'workers', 8),
+    # Executa as remoções do plano (arquivos do fluig que não existem mais no SharePoint)
+    REMOVER=lambda config: (config.get('planejador') or {}).get(
+        'remover', (config.get('estado') or {}).get('remover_no_fluig', False)),
+)
+# Requisições estimadas por operação: download + envio; download + envio + check-in da versão (ou remoção + envio)
+REQUISICOES = {'pasta': 1, 'envio': 2, 'atualizacao': 3, 'remocao': 1}
+# Índice de estado da execução, aberto no main
+estado = None
+sharepoint = SharePoint()
+
+
+class Operacao:
+    """Uma operação do plano; caminho é a tupla de pastas (e o nome, para arquivos) a partir da raiz do fluig"""
+    __slots__ = ('tipo', 'caminho', 'tamanho', 'entrada', 'documento_id')
+
+    def __init__(self, tipo, caminho, tamanho=0, entrada=None, documento_id=None):
+        self.tipo = tipo
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.entrada = entrada
+        self.documento_id = documento_id
+
+    def __repr__(self):
+        return f"{self.tipo.upper():<12} {'/'.join(self.caminho)}" + (f' ({self.tamanho} bytes)' if self.tamanho else '')
+
+
+class Escopo:
+    """Parte da biblioteca tratada por um worker na sincronização distribuída. Cada pasta pertence à raiz mais
+    próxima entre todas as raízes da partição (todas); o escopo contém as pastas cuja raiz está em raizes.
+    Sem arquivos, é a preparação: só as pastas listadas em raizes são criadas, sem arquivos nem remoções"""
+
+    def __init__(self, raizes, todas=None, arquivos=True):
+        self.raizes = frozenset(raizes)
+        self.todas = frozenset(todas if todas is not None else raizes)
+        self.arquivos = arquivos
+
+    def contem(self, pasta):
+        """True se a pasta (caminho relativo ao site) pertence ao escopo"""
+        partes = pasta.split('/')
+        for nivel in range(len(partes), 0, -1):
+            prefixo = '/'.join(partes[:nivel])
+            if prefixo in self.todas:
+                return prefixo in self.raizes
+        return False
+
+    def cria(self, pasta):
+        """True se a pasta deve ser criada por esse escopo"""
+        return self.contem(pasta) if self.arquivos else pasta in self.raizes
+
+    def para_dict(self):
+        return {'raizes': sorted(self.raizes), 'todas': sorted(self.todas), 'arquivos': self.arquivos}
+
+    @classmethod
+    def de_dict(cls, dados):
+        return cls(dados['raizes'], dados['todas'], dados['arquivos'])
+
+
+class Plano:
+    """Diferença entre o SharePoint e o fluig: pastas a criar por nível, arquivos a enviar, atualizar e remover"""
+
+    def __init__(self):
+        self.pastas = defaultdict(list)
+        self.envios = []
+        self.atualizacoes = []
+        self.remocoes = []
+        self.sem_alteracao = 0
+
+    @property
+    def niveis(self):
+        """Pastas a criar agrupadas por profundidade, da raiz para as folhas"""
+        return [self.pastas[nivel] for nivel in sorted(self.pastas)]
+
+    def operacoes(self):
+        """Operações na ordem de execução"""
+        for nivel in self.niveis:
+            yield from nivel
+        yield from self.envios
+        yield from self.atualizacoes
+        yield from self.remocoes
+
+    def estimativa(self):
+        """Quantidade de operações, requisições e bytes (baixados do SharePoint + enviados ao fluig)"""
+        pastas = sum(len(nivel) for nivel in self.niveis)
+        quantidades = {'pasta': pastas, 'envio': len(self.envios), 'atualizacao': len(self.atualizacoes),
+                       'remocao': len(self.remocoes)}
+        transferidos = sum(operacao.tamanho for operacao in self.envios + self.atualizacoes)
+        return {
+            **quantidades,
+            'sem_alteracao': self.sem_alteracao,
+            'requisicoes': sum(REQUISICOES[tipo] * quantidade for tipo, quantidade in quantidades.items()),
+            'bytes': 2 * transferidos,
+        }
+
+    def imprime(self):
+        for operacao in self.operacoes():
+            print(operacao)
+        estimativa = self.estimativa()
+        print(f"Pastas a criar: {estimativa['pasta']} em {len(self.niveis)} níveis")
+        print(f"Arquivos: {estimativa['envio']} a enviar, {estimativa['atualizacao']} a atualizar, "
+              f"{estimativa['remocao']} a remover, {estimativa['sem_alteracao']} sem alteração")
+        print(f"Estimativa: {estimativa['requisicoes']} requisições, {estimativa['bytes'] / 1024 / 1024:.2f} MB")
+
+
+def inventario_fluig(inventario=None):
+    """Pastas e arquivos do fluig abaixo da pasta raiz, pelo caminho: ({pastas: documentId}, {arquivos: documentId}).
+    Duas consultas ao dataset; se os arquivos passarem do limite do dataset, uma consulta por pasta e, nas pastas
+    que também passam do limite, a consulta em lote pelos nomes dos arquivos do inventário do SharePoint"""
+    cache_pastas = modulo_fluig.get_cache_pastas()
+    if not modulo_fluig.opcoes.PRECARREGAR_PASTAS:
+        cache_pastas.carregar(modulo_fluig.lista_pastas())
+    caminhos = {documento_id: tuple(caminho) for documento_id, caminho in cache_pastas.por_documento().items()}
+    caminhos[str(modulo_fluig.opcoes.PARENT_ID_PASTA_ENGETEC)] = ()
+    pastas = {caminho: documento_id for documento_id, caminho in caminhos.items()}
+    arquivos = {}
+    todos = modulo_fluig.lista_arquivos()
+    if todos is None:
+        todos = []
+        grandes = {}
+        for documento_id, caminho in caminhos.items():
+            da_pasta = modulo_fluig.arquivos_da_pasta(documento_id)
+            if da_pasta is None:
+                grandes[caminho] = documento_id
+                continue
+            todos.extend((arquivo_id, nome, documento_id) for nome, arquivo_id in da_pasta.items())
+        if grandes:
+            #Só os nomes que existem no SharePoint são consultados: arquivos só no fluig dessas pastas não são removidos
+            logging.warning(f"{len(grandes)} pastas com mais arquivos que o limite do dataset, consultando pelos nomes")
+            for pasta, entradas in (inventario.por_pasta() if inventario is not None else ()):
+                documento_id = grandes.get(tuple(pasta.split('/')))
+                if documento_id is not None:
+                    encontrados = modulo_fluig.verifica_existencia_arquivos([e.nome for e in entradas], documento_id)
+                    todos.extend((arquivo_id, nome, documento_id) for nome, arquivo_id in encontrados.items())
+    for documento_id, nome, parent_id in todos:
+        #Arquivos fora da pasta raiz não fazem parte da sincronização
+        if parent_id in caminhos:
+            arquivos.setdefault(caminhos[parent_id] + (nome,), documento_id)
+    logging.info(f"Inventário do fluig: {len(pastas)} pastas, {len(arquivos)} arquivos")
+    return pastas, arquivos
+
+
+def planeja(inventario, pastas_sharepoint, pastas_fluig, arquivos_fluig, biblioteca=None, escopo=None):
+    """Monta o plano a partir dos dois inventários, os caminhos do fluig seguem o caminho relativo ao site.
+    Com escopo, só as pastas e arquivos dele entram no plano"""
+    biblioteca = biblioteca or opcoes.FOLDER_NAME
+    plano = Plano()
+    existentes = set(pastas_fluig)
+
+    def _adiciona_pastas(caminho):
+        #Pastas intermediárias também, caso a listagem não traga alguma
+        for nivel in range(1, len(caminho) + 1):
+            if caminho[:nivel] not in existentes and (escopo is None or escopo.cria('/'.join(caminho[:nivel]))):
+                existentes.add(caminho[:nivel])
+                plano.pastas[nivel].append(Operacao('pasta', caminho[:nivel]))
+
+    for caminho in sorted({tuple(pasta.caminho.split('/')) for pasta in pastas_sharepoint} | {(biblioteca,)}):
+        _adiciona_pastas(caminho)
+
+    vistos = set()
+    for entrada in inventario:
+        pastas_arquivo = tuple(entrada.pasta.split('/'))
+        if escopo is not None and not (escopo.arquivos and escopo.contem(entrada.pasta)):
+            #Na preparação, só as pastas dos arquivos
+            if not escopo.arquivos:
+                _adiciona_pastas(pastas_arquivo)
+            continue
+        _adiciona_pastas(pastas_arquivo)
+        caminho = pastas_arquivo + (entrada.nome,)
+        vistos.add(caminho)
+        documento_id = arquivos_fluig.get(caminho)
+        if documento_id is None:
+            plano.envios.append(Operacao('envio', caminho, entrada.tamanho, entrada))
+        elif estado is None or estado.mudou(entrada.propriedades()):
+            plano.atualizacoes.append(Operacao('atualizacao', caminho, entrada.tamanho, entrada, documento_id))
+        else:
+            plano.sem_alteracao += 1
+
+    for caminho, documento_id in sorted(arquivos_fluig.items()):
+        if caminho[0] == biblioteca and caminho not in vistos and (
+                escopo is None or (escopo.arquivos and escopo.contem('/'.join(caminho[:-1])))):
+            plano.remocoes.append(Operacao('remocao', caminho, documento_id=documento_id))
+    for nivel in plano.niveis:
+        nivel.sort(key=lambda operacao: operacao.caminho)
+    return plano
+
+
+def cria_pastas(plano, pastas_fluig, workers=None):
+    """Cria as pastas nível a nível, as de um mesmo nível em paralelo (os pais já existem)"""
+    cache_pastas = modulo_fluig.get_cache_pastas()
+
+    def _cria(operacao):
+        parent_id = pastas_fluig.get(operacao.caminho[:-1])
+        if parent_id is None:
+            #A pasta pai não pôde ser criada
+            return operacao, None
+        try:
+            response = modulo_fluig.cria_pasta(operacao.caminho[-1], parent_id)
+            return operacao, str(response.json()['documentId'])
+        except Exception as e:
+            logging.error(f"Erro ao criar a pasta {'/'.join(operacao.caminho)} no fluig: {e}")
+            return operacao, None
+
+    with ThreadPoolExecutor(max_workers=workers or opcoes.WORKERS_PASTAS, thread_name_prefix='pastas') as executor:
+        for nivel in plano.niveis:
+            for operacao, documento_id in executor.map(_cria, nivel):
+                if documento_id is not None:
+                    pastas_fluig[operacao.caminho] = documento_id
+                    cache_pastas.registra(operacao.caminho, documento_id)
+
+
+def transfere(operacao, pastas_fluig):
+    """Baixa o arquivo do SharePoint e grava no fluig direto na pasta do plano, sem novas consultas"""
+    entrada = operacao.entrada
+    parent_id = pastas_fluig.get(operacao.caminho[:-1])
+    if parent_id is None:
+        raise Exception("pasta não existe no fluig")
+    os.makedirs(PurePath(opcoes.FOLDER_DEST, entrada.pasta), exist_ok=True)
+    caminho_local = PurePath(opcoes.FOLDER_DEST, entrada.pasta, entrada.nome)
+    _, impressao = sharepoint.download_file_to_path(entrada.nome, entrada.pasta, caminho_local)
+    documento_id = modulo_fluig.grava_arquivo(entrada.nome, parent_id, caminho_local, operacao.documento_id,
+                                              impressao=impressao)
+    if documento_id is not None and estado is not None:
+        estado.registra(entrada.propriedades(), entrada.pasta, caminho_local, documento_id)
+    return documento_id
+
+
+def executa(plano, pastas_fluig, remover=None, workers=None):
+    """Executa o plano: pastas primeiro (por nível), depois envios e atualizações em paralelo e por fim as remoções.
+    Retorna os totais por resultado"""
+    cria_pastas(plano, pastas_fluig)
+    totais = {'gravado': 0, 'removido': 0, 'erro': 0}
+
+    def _arquivo(operacao):
+        try:
+            return 'gravado' if transfere(operacao, pastas_fluig) is not None else 'erro'
+        except Exception as e:
+            logging.error(f"Erro ao transferir {'/'.join(operacao.caminho)}: {e}")
+            return 'erro'
+
+    def _remove(operacao):
+        response = modulo_fluig.remove_documento(operacao.documento_id)
+        if response.status_code not in (200, 204, 404):
+            logging.error(f"Erro ao remover documento {operacao.documento_id} do fluig: {response.status_code}")
+            return 'erro'
+        return 'removido'
+
+    if remover is None:
+        remover = opcoes.REMOVER
+    with ThreadPoolExecutor(max_workers=workers or opcoes.WORKERS_ARQUIVOS, thread_name_prefix='plano') as executor:
+        for resultado in executor.map(_arquivo, plano.envios + plano.atualizacoes):
+            totais[resultado] += 1
+        if remover:
+            for resultado in executor.map(_remove, plano.remocoes):
+                totais[resultado] += 1
+    logging.info(f"Plano executado: {totais}")
+    return totais
+
+
+def pesos(inventario, pastas_sharepoint, escopo=None):
+    """Arquivos e bytes de cada pasta do inventário (só os arquivos diretamente nela), {pasta: [arquivos, bytes]};
+    usado para equilibrar a partição da próxima sincronização distribuída"""
+    resultado = {pasta.caminho: [0, 0] for pasta in pastas_sharepoint if escopo is None or escopo.contem(pasta.caminho)}
+    for entrada in inventario:
+        if escopo is None or escopo.contem(entrada.pasta):
+            soma = resultado.setdefault(entrada.pasta, [0, 0])
+            soma[0] += 1
+            soma[1] += entrada.tamanho
+    return resultado
+
+
+def sincroniza(escopo=None, dry_run=False, remover=None):
+    """Inventários, plano e execução (ou só impressão do plano, com dry_run).
+    Retorna (estimativa do plano, totais da execução, pesos das pastas do escopo)"""
+    global estado
+    estado = EstadoSync(opcoes.ARQUIVO_ESTADO)
+    modulo_fluig.configura_estado(estado)
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
+    inventario = None
+    try:
+        inventario, pastas_sharepoint = monta_inventario(sharepoint, opcoes.FOLDER_NAME, opcoes_sharepoint.SHAREPOINT_SITE_NAME,
+                                                         **opcoes.INVENTARIO)
+        pastas_fluig, arquivos_fluig = inventario_fluig(inventario)
+        plano = planeja(inventario, pastas_sharepoint, pastas_fluig, arquivos_fluig, escopo=escopo)
+        logging.info(f"Plano: {plano.estimativa()}")
+        totais = None
+        if dry_run:
+            plano.imprime()
+        else:
+            totais = executa(plano, pastas_fluig, remover)
+        return plano.estimativa(), totais, pesos(inventario, pastas_sharepoint, escopo)
+    finally:
+        if inventario is not None:
+            inventario.fechar()
+        modulo_fluig.resumo_deduplicacao()
+        modulo_fluig.salvar_cache_pastas()
+        metricas.finaliza()
+        gerenciador_sessao.fechar()
+        estado.fechar()
+
+
+def main(argv=None):
+    configuracao.configura_log()
+    parser = argparse.ArgumentParser(description='Sincronização SharePoint -> fluig planejada a partir dos inventários')
+    parser.add_argument('--dry-run', action='store_true', help='só imprime o plano e a estimativa, sem executar')
+    parser.add_argument('--remover', action='store_true', default=opcoes.REMOVER,
+                        help='remove do fluig os arquivos que não existem mais no SharePoint')
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+    logging.info(f"Inicio: {datetime.now()}")
+    try:
+        sincroniza(dry_run=args.dry_run, remover=args.remover)
+    except Exception as e:
+        logging.error(f"Erro: {e}")
+        return e
+
+    elapsed_time = time.time() - start_time
+    logging.info(f"Tempo decorrido: {elapsed_time}")
+    logging.info(f"Fim: {datetime.now()}")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logging.error(f"Erro: {e}")
@@ -0,0 +1,163 @@
+import threading
+import time
+import random
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# Status que indicam falha temporária (throttling ou indisponibilidade), os demais são erros definitivos
+STATUS_RETENTAVEIS = (408, 429, 500, 502, 503, 504)
+# Status em que o servidor recusou a requisição sem processá-la, os únicos repetidos em métodos não idempotentes (POST)
+STATUS_NAO_PROCESSADOS = (429, 503)
+# Métodos que podem ser repetidos em qualquer falha temporária sem duplicar nada no servidor
+METODOS_IDEMPOTENTES = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Quantidade de tentativas e tempos de espera (segundos) do backoff exponencial
+TENTATIVAS = 5
+ESPERA_BASE = 1
+ESPERA_MAXIMA = 60
+
+_lock = threading.Lock()
+_limitadores = {}
+
+
+class LimitadorTaxa:
+    """Token bucket compartilhado entre as threads, limita as requisições por segundo de um serviço"""
+
+    def __init__(self, taxa, capacidade=None):
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade or taxa)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguarda(self):
+        """Bloqueia até existir um token disponível"""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+    def reserva(self):
+        """Reserva um token sem bloquear e retorna os segundos até ele estar disponível (uso em asyncio)"""
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.taxa)
+
+
+def configurar(tentativas=None, espera_base=None, espera_maxima=None, limites=None):
+    """Ajusta a política a partir do yaml; limites é {servico: {'taxa': req/s, 'capacidade': rajada}}"""
+    global TENTATIVAS, ESPERA_BASE, ESPERA_MAXIMA
+    if tentativas:
+        TENTATIVAS = int(tentativas)
+    if espera_base is not None:
+        ESPERA_BASE = float(espera_base)
+    if espera_maxima is not None:
+        ESPERA_MAXIMA = float(espera_maxima)
+    with _lock:
+        for servico, limite in (limites or {}).items():
+            _limitadores[servico] = LimitadorTaxa(limite['taxa'], limite.get('capacidade'))
+
+
+def limita(servico):
+    """Aguarda o limite de taxa do serviço, se configurado"""
+    limitador = _limitadores.get(servico)
+    if limitador is not None:
+        limitador.aguarda()
+
+
+def reserva(servico):
+    """Segundos a esperar pelo limite de taxa do serviço sem bloquear a thread (0 se não configurado)"""
+    limitador = _limitadores.get(servico)
+    if limitador is None:
+        return 0.0
+    return limitador.reserva()
+
+
+def _resposta(erro):
+    return getattr(erro, 'response', None)
+
+
+def retentavel(erro=None, response=None):
+    """Indica se a falha é temporária e vale tentar de novo"""
+    if response is None and erro is not None:
+        #ChunkedEncodingError: conexão caiu no meio da resposta (ex: download em stream)
+        if isinstance(erro, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+            return True
+        response = _resposta(erro)
+    if response is None:
+        return False
+    return response.status_code in STATUS_RETENTAVEIS
+
+
+def falha_antes_do_envio(erro):
+    """Indica se a conexão nem chegou a ser aberta (recusada, DNS, timeout de conexão): o servidor não recebeu nada"""
+    if isinstance(erro, requests.ConnectTimeout):
+        return True
+    motivo = getattr(erro.args[0], 'reason', None) if erro.args else None
+    return isinstance(motivo, (NewConnectionError, ConnectTimeoutError))
+
+
+def pode_reenviar(metodo, erro=None, response=None, antes_do_envio=falha_antes_do_envio):
+    """Indica se a requisição pode ser repetida. Métodos idempotentes em qualquer falha temporária; POST só se o
+    servidor não a processou (429/503 ou falha ao conectar), um timeout depois do commit duplicaria pastas e versões"""
+    if metodo.upper() in METODOS_IDEMPOTENTES:
+        return retentavel(erro, response)
+    if response is not None:
+        return response.status_code in STATUS_NAO_PROCESSADOS
+    return erro is not None and antes_do_envio(erro)
+
+
+def espera_retry_after(response):
+    """Segundos pedidos pelo servidor no cabeçalho Retry-After (número ou data HTTP)"""
+    if response is None:
+        return None
+    valor = response.headers.get('Retry-After')
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def espera(tentativa, response=None):
+    """Tempo de espera antes da próxima tentativa: Retry-After se informado, senão backoff exponencial com jitter"""
+    retry_after = espera_retry_after(response)
+    if retry_after is not None:
+        return min(retry_after, ESPERA_MAXIMA)
+    return random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa))
+
+
+def executa(funcao, servico, descricao='', ao_falhar=None):
+    """Executa a função com novas tentativas para falhas temporárias (o limite de taxa é aplicado em cada requisição HTTP).
+    Erros definitivos e a última falha são levantados para quem chamou."""
+    for tentativa in range(TENTATIVAS):
+        try:
+            return funcao()
+        except Exception as e:
+            if callable(ao_falhar):
+                ao_falhar(e)
+            ultima = tentativa == TENTATIVAS - 1
+            #401/403 são tratados pelo ao_falhar (renovação do token) e tentados mais uma vez
+            status = getattr(_resposta(e), 'status_code', None)
+            if ultima or not (retentavel(e) or (status in (401, 403) and tentativa == 0)):
+                logging.error(f"Erro em {servico} {descricao}: {e}")
+                raise
+            segundos = espera(tentativa, _resposta(e))
+            logging.info(f"Erro temporário em {servico} {descricao}: {e}, tentando novamente em {segundos:.1f}s")
+            time.sleep(segundos)
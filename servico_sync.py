@@ -0,0 +1,208 @@
+import os
+import json
+import signal
+import threading
+import time
+import logging
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import download_all_files_with_subfolder as sincronizacao
+import sincroniza_fluig_sharepoint as reverso
+import modulo_fluig
+import gerenciador_sessao
+import metricas
+import configuracao
+from estado_sync import EstadoSync
+
+
+class _LogDiario(logging.FileHandler):
+    """Log em log/app-<data>.log como nos scripts, trocando de arquivo quando o dia muda (serviço fica dias no ar)"""
+
+    def __init__(self):
+        super().__init__(self._nome_arquivo(), encoding='utf-8', delay=True)
+
+    @staticmethod
+    def _nome_arquivo():
+        return os.path.abspath(f"log/app-{datetime.now().strftime(r'%d-%m-%Y')}.log")
+
+    def emit(self, record):
+        nome = self._nome_arquivo()
+        if nome != self.baseFilename:
+            self.acquire()
+            try:
+                self.close()
+                self.baseFilename = nome
+            finally:
+                self.release()
+        super().emit(record)
+
+
+def configura_log():
+    """Log diário do serviço, no lugar do configuracao.configura_log dos scripts (que não faz nada se já existe handler)"""
+    logging.basicConfig(
+        handlers=[_LogDiario()],
+        level=logging.INFO,  # Define o nível mínimo de gravidade das mensagens a serem registradas
+        format='%(asctime)s - %(levelname)s - %(message)s'  # Formato das mensagens de log
+    )
+
+
+opcoes = configuracao.Opcoes(
+    # Segundos entre as consultas ao change log quando nenhuma notificação chega
+    INTERVALO=('servico', 'intervalo', 60),
+    # Endereço do endpoint de saúde e do webhook (o SharePoint exige HTTPS público, normalmente atrás de um proxy)
+    HOST=('servico', 'host', '127.0.0.1'),
+    PORTA=('servico', 'porta', 8085),
+    # Executa também a sincronização fluig -> SharePoint em cada ciclo
+    REVERSO=('servico', 'reverso', False),
+    # Ciclos seguidos com erro antes do endpoint de saúde responder 503
+    MAX_ERROS=('servico', 'max_erros', 3),
+)
+
+
+class ServicoSync:
+    """Sincronização residente: mantém sessões, cache de pastas e estado abertos e processa só as mudanças
+    do change log do SharePoint, a cada intervalo ou logo após uma notificação do webhook"""
+
+    def __init__(self, intervalo=None, reverso=None):
+        self.intervalo = intervalo or opcoes.INTERVALO
+        self.reverso = opcoes.REVERSO if reverso is None else reverso
+        self._parar = threading.Event()
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._saude = {'iniciado_em': datetime.now().isoformat(), 'ciclos': 0, 'erros_consecutivos': 0,
+                       'executando': False, 'ultimo_ciclo': None, 'ultimo_sucesso': None, 'ultimo_erro': None,
+                       'notificacoes': 0}
+
+    def notifica(self):
+        """Antecipa o próximo ciclo (notificação do webhook), várias notificações seguidas viram um único ciclo"""
+        with self._lock:
+            self._saude['notificacoes'] += 1
+        self._acordar.set()
+
+    def parar(self):
+        """Encerra depois do ciclo em andamento"""
+        logging.info("Encerramento solicitado, aguardando o ciclo em andamento")
+        self._parar.set()
+        self._acordar.set()
+
+    def saude(self):
+        """Estado do serviço para o endpoint de saúde, com o resumo das métricas"""
+        with self._lock:
+            dados = dict(self._saude)
+        dados['status'] = 'degradado' if dados['erros_consecutivos'] >= opcoes.MAX_ERROS else 'ok'
+        dados['metricas'] = metricas.resumo()
+        return dados
+
+    def _atualiza(self, **valores):
+        with self._lock:
+            self._saude.update(valores)
+
+    def executa_ciclo(self):
+        """Processa as mudanças do SharePoint (e do fluig, se configurado); erros não derrubam o serviço"""
+        inicio = time.time()
+        self._atualiza(executando=True, ultimo_ciclo=datetime.now().isoformat())
+        try:
+            #Documentos podem ter sido alterados direto no fluig entre os ciclos
+            modulo_fluig.limpar_cache_documentos()
+            sincronizacao.main_delta()
+            if self.reverso:
+                reverso.ciclo()
+            modulo_fluig.salvar_cache_pastas()
+        except Exception as e:
+            logging.error(f"Erro no ciclo de sincronização: {e}")
+            with self._lock:
+                self._saude['erros_consecutivos'] += 1
+                self._saude['ultimo_erro'] = str(e)
+        else:
+            self._atualiza(erros_consecutivos=0, ultimo_sucesso=datetime.now().isoformat())
+        finally:
+            with self._lock:
+                self._saude['ciclos'] += 1
+                self._saude['executando'] = False
+            logging.info(f"Ciclo de sincronização em {time.time() - inicio:.1f}s")
+
+    def executar(self):
+        """Laço principal, roda até parar() ser chamado"""
+        while not self._parar.is_set():
+            self._acordar.clear()
+            self.executa_ciclo()
+            self._acordar.wait(self.intervalo)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """GET /saude e POST /webhook (notificações do SharePoint, com a validação do validationtoken)"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responde(self, status, corpo=b'', tipo='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/saude':
+            return self._responde(404)
+        dados = self.server.servico.saude()
+        status = 503 if dados['status'] != 'ok' else 200
+        self._responde(status, json.dumps(dados, ensure_ascii=False).encode('utf-8'))
+
+    def do_POST(self):
+        partes = urlsplit(self.path)
+        if partes.path != '/webhook':
+            return self._responde(404)
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        #Na criação da assinatura o SharePoint espera o validationtoken de volta em texto em até 5 segundos
+        token = parse_qs(partes.query).get('validationtoken')
+        if token:
+            return self._responde(200, token[0].encode('utf-8'), 'text/plain')
+        self.server.servico.notifica()
+        self._responde(202)
+
+
+def inicia_endpoint(servico, host=None, porta=None):
+    """Sobe o endpoint HTTP em uma thread, retorna o servidor para ser encerrado no fim"""
+    servidor = ThreadingHTTPServer((host or opcoes.HOST, opcoes.PORTA if porta is None else porta), _Handler)
+    servidor.daemon_threads = True
+    servidor.servico = servico
+    threading.Thread(target=servidor.serve_forever, name='endpoint', daemon=True).start()
+    endereco, porta = servidor.server_address[:2]
+    logging.info(f"Endpoint de saúde e webhook em http://{endereco}:{porta}")
+    return servidor
+
+
+def main():
+    configura_log()
+    estado = EstadoSync(sincronizacao.opcoes.ARQUIVO_ESTADO)
+    sincronizacao.estado = estado
+    sincronizacao.configura_lote()
+    reverso.estado = estado
+    modulo_fluig.configura_estado(estado)
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
+    logging.info(f"Serviço de sincronização iniciado, intervalo de {opcoes.INTERVALO}s")
+
+    servico = ServicoSync()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sinal, lambda *_: servico.parar())
+    endpoint = inicia_endpoint(servico)
+    try:
+        servico.executar()
+    finally:
+        endpoint.shutdown()
+        endpoint.server_close()
+        modulo_fluig.resumo_deduplicacao()
+        modulo_fluig.salvar_cache_pastas()
+        metricas.finaliza()
+        gerenciador_sessao.fechar()
+        estado.fechar()
+        logging.info(f"Serviço de sincronização encerrado: {datetime.now()}")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logging.error(f"Erro: {e}")
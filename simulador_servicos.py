@@ -0,0 +1,793 @@
+import threading
+import hashlib
+import random
+import json
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+
+# Formatos de árvore usados no benchmark: largura (subpastas por pasta), profundidade, arquivos por pasta e tamanho
+FORMATOS = {
+    'largo': {'largura': 40, 'profundidade': 1, 'arquivos_por_pasta': 10, 'tamanho_arquivo': 32 * 1024},
+    'profundo': {'largura': 2, 'profundidade': 6, 'arquivos_por_pasta': 3, 'tamanho_arquivo': 32 * 1024},
+    'muitos_pequenos': {'largura': 4, 'profundidade': 2, 'arquivos_por_pasta': 60, 'tamanho_arquivo': 2 * 1024},
+    'poucos_grandes': {'largura': 1, 'profundidade': 1, 'arquivos_por_pasta': 2, 'tamanho_arquivo': 64 * 1024 * 1024},
+}
+# Tamanho do bloco de conteúdo gerado para os arquivos simulados
+BLOCO_CONTEUDO = 64 * 1024
+# Pasta raiz do fluig usada pelo modulo_fluig (PASTA_RAIZ_PADRAO, sem pasta_raiz na configuração)
+RAIZ_FLUIG = '1553'
+FORMATO_DATA = '%Y-%m-%dT%H:%M:%SZ'
+# Arquivo endereçado pelo caminho (getFileByServerRelativeUrl/Path) ou pelo UniqueId (GetFileById)
+ROTA_ARQUIVO = (r"web/(?:getfilebyserverrelative(?:path\(decodedurl=|url\()'(?P<caminho>.*?)'"
+                r"|getfilebyid\('(?P<id>[^']*)')\)")
+
+
+def _data(valor):
+    return valor.strftime(FORMATO_DATA)
+
+
+def _conteudo_multipart(corpo):
+    """Conteúdo do arquivo de um corpo multipart/form-data com uma única parte"""
+    inicio = corpo.find(b'\r\n\r\n')
+    fim = corpo.rfind(b'\r\n--')
+    return corpo[inicio + 4:fim] if 0 <= inicio < fim else corpo
+
+
+def _erro(mensagem):
+    """Corpo de erro no formato do SharePoint (lido pela office365 ao levantar a exceção)"""
+    return {'error': {'code': '-1, Microsoft.SharePoint.SPException', 'message': {'lang': 'pt-BR', 'value': mensagem}}}
+
+
+class _FalhaSimulada(Exception):
+    """Requisição escolhida para falhar (Simulador.falhar), respondida com o status sem ser processada"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class _Arquivo:
+    """Arquivo da biblioteca simulada, o conteúdo é gerado a partir do id e da versão"""
+
+    def __init__(self, item_id, nome, pasta, tamanho, modificado):
+        self.item_id = item_id
+        self.nome = nome
+        self.pasta = pasta
+        self.tamanho = tamanho
+        self.modificado = modificado
+        self.criado = modificado
+        self.versao = 1
+        self.unique_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f'{pasta}/{nome}'))
+        #Conteúdo recebido por upload, no lugar do gerado
+        self.dados = None
+
+    def bloco(self):
+        semente = hashlib.sha256(f'{self.unique_id}:{self.versao}'.encode()).digest()
+        return (semente * (BLOCO_CONTEUDO // len(semente) + 1))[:BLOCO_CONTEUDO]
+
+    def conteudo(self, inicio=0, fim=None):
+        """Gera o conteúdo do intervalo em blocos, sem montar o arquivo em memória"""
+        fim = self.tamanho if fim is None else min(fim, self.tamanho)
+        if self.dados is not None:
+            yield self.dados[inicio:fim]
+            return
+        bloco = self.bloco()
+        posicao = inicio
+        while posicao < fim:
+            deslocamento = posicao % BLOCO_CONTEUDO
+            parte = bloco[deslocamento:deslocamento + fim - posicao]
+            posicao += len(parte)
+            yield parte
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Roteia as requisições para o simulador do servidor (SharePoint ou Fluig)"""
+    protocol_version = 'HTTP/1.1'
+    #Cabeçalhos e corpo saem em escritas separadas, sem isso o Nagle atrasa cada resposta em ~40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _corpo(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            partes = []
+            while True:
+                tamanho = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if tamanho == 0:
+                    self.rfile.readline()
+                    break
+                partes.append(self.rfile.read(tamanho))
+                self.rfile.readline()
+            return b''.join(partes)
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(tamanho) if tamanho else b''
+
+    def _atende(self):
+        simulador = self.server.simulador
+        corpo = self._corpo()
+        simulador.conta_recebido(len(corpo))
+        if simulador.latencia:
+            time.sleep(simulador.latencia)
+        if simulador.taxa_throttling and simulador.aleatorio() < simulador.taxa_throttling:
+            simulador.conta(f'{self.server.servico}.throttling')
+            return self.responde(429, _erro('throttled'), {'Retry-After': str(simulador.retry_after)})
+        try:
+            self.server.rotear(self, corpo)
+        except _FalhaSimulada as falha:
+            self.responde(falha.status, _erro('falha simulada'))
+        except (BrokenPipeError, ConnectionResetError):
+            #Cliente encerrado no meio da resposta (ex: execução interrompida)
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _atende
+
+    def responde(self, status, dados=None, cabecalhos=None):
+        corpo = b'' if dados is None else json.dumps(dados).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;odata=verbose;charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(corpo)
+        self.server.simulador.conta_enviado(len(corpo))
+
+    def responde_bytes(self, dados):
+        """Envia um conteúdo binário já em memória (documentos do fluig)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+        self.server.simulador.conta_enviado(len(dados), conteudo=True)
+
+    def responde_conteudo(self, arquivo):
+        """Envia o conteúdo do arquivo, respeitando o cabeçalho Range"""
+        inicio, fim, status = 0, arquivo.tamanho, 200
+        intervalo = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if intervalo:
+            inicio = int(intervalo.group(1))
+            if inicio >= arquivo.tamanho:
+                return self.responde(416, _erro('intervalo inválido'),
+                                     {'Content-Range': f'bytes */{arquivo.tamanho}'})
+            fim = int(intervalo.group(2)) + 1 if intervalo.group(2) else arquivo.tamanho
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(max(0, fim - inicio)))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {inicio}-{fim - 1}/{arquivo.tamanho}')
+        self.end_headers()
+        for parte in arquivo.conteudo(inicio, fim):
+            self.wfile.write(parte)
+        self.server.simulador.conta_enviado(max(0, fim - inicio), conteudo=True)
+
+
+class _RespostaLote:
+    """Handler de uma requisição de dentro do $batch: atende pelas mesmas rotas e guarda a resposta"""
+
+    def __init__(self, metodo, caminho, cabecalhos):
+        self.command = metodo
+        self.path = caminho
+        self.headers = cabecalhos
+        self.status = 500
+        self.tipo = 'application/json;odata=verbose;charset=utf-8'
+        self.corpo = b''
+
+    def responde(self, status, dados=None, cabecalhos=None):
+        self.status = status
+        self.corpo = b'' if dados is None else json.dumps(dados).encode('utf-8')
+
+    def responde_bytes(self, dados):
+        self.status, self.tipo, self.corpo = 200, 'application/octet-stream', bytes(dados)
+
+    def responde_conteudo(self, arquivo):
+        self.status, self.tipo, self.corpo = 200, 'application/octet-stream', b''.join(arquivo.conteudo())
+
+    def serializa(self):
+        motivo = {200: 'OK', 204: 'No Content', 404: 'Not Found', 429: 'Too Many Requests'}.get(self.status, 'Error')
+        return (f'HTTP/1.1 {self.status} {motivo}\r\nCONTENT-TYPE: {self.tipo}\r\n\r\n').encode('utf-8') + self.corpo
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, simulador, servico, rotear):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.simulador = simulador
+        self.servico = servico
+        self.rotear = rotear
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class Simulador:
+    """SharePoint e Fluig simulados em servidores HTTP locais.
+
+    Atende as chamadas REST usadas pelo office365_api/crawler_sharepoint (pastas, arquivos, itens da lista,
+    change log) e as apis content-management/dataset do modulo_fluig, com latência e throttling (429) configuráveis.
+    Conta as requisições por operação e os bytes trafegados para o relatório do benchmark.
+    """
+
+    def __init__(self, formato='largo', latencia_ms=0, taxa_throttling=0.0, retry_after=1, fracao_recentes=0.5,
+                 site='bench', biblioteca='Documentos', semente=0, **ajustes):
+        parametros = dict(FORMATOS[formato])
+        parametros.update(ajustes)
+        self.formato = formato
+        self.parametros = parametros
+        self.latencia = latencia_ms / 1000
+        self.taxa_throttling = taxa_throttling
+        self.retry_after = retry_after
+        self.site = site
+        self.biblioteca = biblioteca
+        self._aleatorio = random.Random(semente)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._contagem = {}
+        self._bytes = {'enviados': 0, 'recebidos': 0, 'conteudo': 0}
+        #Operação -> [vezes, status] das próximas requisições que falham (falhar)
+        self._falhas = {}
+        self._servidores = []
+        #Biblioteca do SharePoint: pasta -> subpastas e arquivos, change log com (número, tipo, arquivo)
+        self.pastas = {}
+        self.arquivos = {}
+        self.mudancas = []
+        self.sessoes_upload = {}
+        self._monta_arvore(fracao_recentes)
+        #Documentos do fluig: documentId -> dados
+        self.documentos = {RAIZ_FLUIG: {'descricao': 'RAIZ', 'tipo': '1', 'pai': '0', 'removido': False, 'versao': 1,
+                                        'modificado': datetime.now(), 'dados': b''}}
+        self._proximo_documento = 10000
+        #Arquivos enviados para a área temporária do fluig (nome -> conteúdo), publicados pelo updateFile
+        self._temporarios = {}
+
+    # Estrutura simulada
+
+    def _monta_arvore(self, fracao_recentes):
+        agora = datetime.now(timezone.utc).replace(microsecond=0)
+        pendentes = [(self.biblioteca, 0)]
+        item_id = 0
+        while pendentes:
+            pasta, nivel = pendentes.pop(0)
+            subpastas = []
+            if nivel < self.parametros['profundidade']:
+                subpastas = [f'pasta_{nivel}_{i}' for i in range(self.parametros['largura'])]
+                pendentes.extend((f'{pasta}/{nome}', nivel + 1) for nome in subpastas)
+            arquivos = []
+            for i in range(self.parametros['arquivos_por_pasta']):
+                item_id += 1
+                recente = self._aleatorio.random() < fracao_recentes
+                modificado = agora - (timedelta(hours=1) if recente else timedelta(days=30))
+                arquivo = _Arquivo(item_id, f'arquivo_{i}.bin', pasta, self.parametros['tamanho_arquivo'], modificado)
+                arquivos.append(arquivo)
+                self.arquivos[arquivo.item_id] = arquivo
+            self.pastas[pasta] = {'pastas': subpastas, 'arquivos': arquivos}
+
+    def modificar(self, fracao, semente=1):
+        """Altera uma fração dos arquivos (nova versão e conteúdo), registrando no change log"""
+        sorteio = random.Random(semente)
+        agora = datetime.now(timezone.utc).replace(microsecond=0)
+        alterados = [arquivo for arquivo in self.arquivos.values() if sorteio.random() < fracao]
+        with self._lock:
+            for arquivo in alterados:
+                arquivo.versao += 1
+                arquivo.modificado = agora
+                self.mudancas.append((len(self.mudancas) + 1, 'update', arquivo))
+        return len(alterados)
+
+    def editar_fluig(self, fracao, semente=2):
+        """Simula a edição de uma fração dos documentos no fluig (nova versão com outro conteúdo)"""
+        sorteio = random.Random(semente)
+        with self._lock:
+            editados = [documento for documento in self.documentos.values()
+                        if documento['tipo'] == '2' and not documento['removido'] and sorteio.random() < fracao]
+            for documento in editados:
+                documento['versao'] += 1
+                documento['dados'] = f"editado no fluig v{documento['versao']}\n".encode() + documento['dados']
+                documento['modificado'] = datetime.now()
+        return len(editados)
+
+    @property
+    def total_arquivos(self):
+        return len(self.arquivos)
+
+    @property
+    def total_bytes(self):
+        return sum(arquivo.tamanho for arquivo in self.arquivos.values())
+
+    # Ciclo de vida
+
+    def iniciar(self):
+        for servico, rotear in (('sharepoint', self._rota_sharepoint), ('fluig', self._rota_fluig)):
+            servidor = _Servidor(self, servico, rotear)
+            threading.Thread(target=servidor.serve_forever, name=f'simulador-{servico}', daemon=True).start()
+            self._servidores.append(servidor)
+        return self
+
+    def parar(self):
+        for servidor in self._servidores:
+            servidor.shutdown()
+            servidor.server_close()
+        self._servidores = []
+
+    @property
+    def url_sharepoint(self):
+        return f'{self._servidores[0].url}/sites/{self.site}'
+
+    @property
+    def url_fluig(self):
+        return self._servidores[1].url
+
+    # Contadores
+
+    def aleatorio(self):
+        with self._lock:
+            return self._aleatorio.random()
+
+    def falhar(self, operacao, vezes=1, status=503):
+        """As próximas requisições da operação (nome usado nos contadores, ex: sharepoint.upload) são respondidas
+        com o status sem serem processadas, o corpo já foi recebido como em uma falha real do servidor"""
+        with self._lock:
+            self._falhas[operacao] = [vezes, status]
+
+    def conta(self, operacao):
+        #Requisições de dentro de um $batch são contadas à parte, não são requisições HTTP
+        operacao = getattr(self._local, 'prefixo', '') + operacao
+        with self._lock:
+            self._contagem[operacao] = self._contagem.get(operacao, 0) + 1
+            falha = self._falhas.get(operacao)
+            if falha and falha[0] > 0:
+                falha[0] -= 1
+                raise _FalhaSimulada(falha[1])
+
+    def conta_enviado(self, n_bytes, conteudo=False):
+        with self._lock:
+            self._bytes['enviados'] += n_bytes
+            if conteudo:
+                self._bytes['conteudo'] += n_bytes
+
+    def conta_recebido(self, n_bytes):
+        with self._lock:
+            self._bytes['recebidos'] += n_bytes
+
+    def contadores(self):
+        with self._lock:
+            return {'requisicoes': dict(sorted(self._contagem.items())), 'bytes': dict(self._bytes)}
+
+    def zerar_contadores(self):
+        with self._lock:
+            self._contagem = {}
+            self._bytes = {'enviados': 0, 'recebidos': 0, 'conteudo': 0}
+
+    # SharePoint
+
+    def _relativo(self, caminho):
+        """Caminho da pasta/arquivo relativo ao site"""
+        caminho = caminho.strip('/')
+        prefixo = f'sites/{self.site}/'
+        return caminho[len(prefixo):] if caminho.startswith(prefixo) else caminho
+
+    def _json_arquivo(self, arquivo):
+        return {
+            '__metadata': {'type': 'SP.File'},
+            'Name': arquivo.nome,
+            'ServerRelativeUrl': f'/sites/{self.site}/{arquivo.pasta}/{arquivo.nome}',
+            'UniqueId': arquivo.unique_id,
+            'Length': str(arquivo.tamanho),
+            'MajorVersion': arquivo.versao,
+            'MinorVersion': 0,
+            'TimeCreated': _data(arquivo.criado),
+            'TimeLastModified': _data(arquivo.modificado),
+        }
+
+    def _json_pasta(self, pasta):
+        return {
+            '__metadata': {'type': 'SP.Folder'},
+            'Name': pasta.rsplit('/', 1)[-1],
+            'ServerRelativeUrl': f'/sites/{self.site}/{pasta}',
+            'ItemCount': len(self.pastas[pasta]['arquivos']) + len(self.pastas[pasta]['pastas']),
+        }
+
+    def _busca_arquivo(self, rota):
+        """Arquivo da rota, pelo caminho relativo ao servidor ou pelo UniqueId"""
+        if rota.group('id'):
+            return next((a for a in self.arquivos.values() if a.unique_id == rota.group('id')), None)
+        pasta, _, nome = self._relativo(rota.group('caminho')).rpartition('/')
+        for arquivo in self.pastas.get(pasta, {}).get('arquivos', []):
+            if arquivo.nome == nome:
+                return arquivo
+        return None
+
+    def _itens_lista(self, parametros):
+        """Itens da biblioteca (arquivos e pastas) com o $filter por data, pasta ou ids"""
+        filtro = parametros.get('$filter', [''])[0]
+        itens = [(arquivo.item_id, arquivo) for arquivo in self.arquivos.values()]
+        pasta = re.search(r"FileDirRef eq '([^']*)'", filtro)
+        if pasta:
+            itens = [(item_id, arquivo) for item_id, arquivo in itens if arquivo.pasta == self._relativo(pasta.group(1))]
+        depois = re.search(r'Id gt (\d+)', filtro)
+        if depois:
+            itens = [(item_id, arquivo) for item_id, arquivo in itens if item_id > int(depois.group(1))]
+        data = re.search(r"Modified ge datetime'([^']+)'", filtro)
+        if data:
+            limite = datetime.strptime(data.group(1), FORMATO_DATA).replace(tzinfo=timezone.utc)
+            itens = [(item_id, arquivo) for item_id, arquivo in itens if arquivo.modificado >= limite]
+        ids = {int(valor) for valor in re.findall(r'Id eq (\d+)', filtro)}
+        if ids:
+            itens = [(item_id, arquivo) for item_id, arquivo in itens if item_id in ids]
+        return sorted(itens, key=lambda item: item[0])
+
+    def _json_item(self, arquivo):
+        return {
+            '__metadata': {'type': f'SP.Data.{self.biblioteca}Item'},
+            'Id': arquivo.item_id,
+            'FileRef': f'/sites/{self.site}/{arquivo.pasta}/{arquivo.nome}',
+            'FSObjType': 0,
+            'File': self._json_arquivo(arquivo),
+        }
+
+    def _grava_arquivo(self, pasta, nome, dados):
+        """Cria ou substitui o arquivo com o conteúdo enviado, registrando no change log"""
+        if pasta not in self.pastas:
+            return None
+        agora = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            arquivo = next((a for a in self.pastas[pasta]['arquivos'] if a.nome == nome), None)
+            if arquivo is None:
+                arquivo = _Arquivo(max(self.arquivos, default=0) + 1, nome, pasta, 0, agora)
+                self.pastas[pasta]['arquivos'].append(arquivo)
+                self.arquivos[arquivo.item_id] = arquivo
+            else:
+                arquivo.versao += 1
+            arquivo.dados = bytes(dados)
+            arquivo.tamanho = len(dados)
+            arquivo.modificado = agora
+            self.mudancas.append((len(self.mudancas) + 1, 'update', arquivo))
+        return arquivo
+
+    def _sessao_upload(self, handler, rota, acao, argumentos, corpo):
+        """StartUpload/ContinueUpload/FinishUpload, os blocos precisam chegar no offset esperado"""
+        self.conta(f'sharepoint.{acao}')
+        upload_id = re.search(r"uploadid='([^']*)'", argumentos, re.I).group(1)
+        offset = re.search(r'fileoffset=(\d+)', argumentos, re.I)
+        with self._lock:
+            if acao == 'startupload':
+                self.sessoes_upload[upload_id] = bytearray()
+            recebido = self.sessoes_upload.get(upload_id)
+            valida = recebido is not None and (not offset or int(offset.group(1)) == len(recebido))
+            if valida:
+                recebido.extend(corpo)
+                if acao == 'finishupload':
+                    del self.sessoes_upload[upload_id]
+        if not valida:
+            return handler.responde(400, _erro('sessão de upload inválida'))
+        if acao == 'finishupload':
+            destino = self._busca_arquivo(rota)
+            if destino is None:
+                return handler.responde(404, _erro('arquivo não encontrado'))
+            arquivo = self._grava_arquivo(destino.pasta, destino.nome, recebido)
+            return handler.responde(200, {'d': self._json_arquivo(arquivo)})
+        nome_funcao = {'startupload': 'StartUpload', 'continueupload': 'ContinueUpload'}[acao]
+        return handler.responde(200, {'d': {nome_funcao: str(len(recebido))}})
+
+    def _lote(self, handler, corpo):
+        """$batch (OData v3): cada parte application/http é atendida pelas rotas normais, as respostas
+        voltam na mesma ordem em um multipart/mixed; uma parte pode falhar sem afetar as demais"""
+        self.conta('sharepoint.batch')
+        limite = re.search(r'boundary="?([^";]+)"?', handler.headers.get('Content-Type', ''))
+        if not limite:
+            return handler.responde(400, _erro('boundary ausente'))
+        delimitador = b'--' + limite.group(1).encode()
+        respostas = []
+        for parte in corpo.split(delimitador)[1:]:
+            if parte.startswith(b'--'):
+                break
+            _, _, requisicao = parte.partition(b'\r\n\r\n')
+            cabecalho, _, _ = requisicao.partition(b'\r\n\r\n')
+            linhas = cabecalho.decode('utf-8').split('\r\n')
+            metodo, url, _ = linhas[0].split(' ', 2)
+            cabecalhos = dict(linha.split(':', 1) for linha in linhas[1:] if ':' in linha)
+            sub = _RespostaLote(metodo, urlsplit(url)._replace(scheme='', netloc='').geturl(),
+                                {nome.strip(): valor.strip() for nome, valor in cabecalhos.items()})
+            if self.taxa_throttling and self.aleatorio() < self.taxa_throttling:
+                self.conta('sharepoint.throttling_lote')
+                sub.responde(429, _erro('throttled'))
+            else:
+                self._local.prefixo = 'lote:'
+                try:
+                    self._rota_sharepoint(sub, b'')
+                except _FalhaSimulada as falha:
+                    sub.responde(falha.status, _erro('falha simulada'))
+                finally:
+                    self._local.prefixo = ''
+            respostas.append(sub)
+        limite_resposta = f'batchresponse_{uuid.uuid4()}'
+        dados = b''.join(b'--' + limite_resposta.encode() + b'\r\nContent-Type: application/http\r\n'
+                         b'Content-Transfer-Encoding: binary\r\n\r\n' + sub.serializa() + b'\r\n'
+                         for sub in respostas) + b'--' + limite_resposta.encode() + b'--\r\n'
+        handler.send_response(200)
+        handler.send_header('Content-Type', f'multipart/mixed; boundary={limite_resposta}')
+        handler.send_header('Content-Length', str(len(dados)))
+        handler.end_headers()
+        handler.wfile.write(dados)
+        conteudo = sum(len(sub.corpo) for sub in respostas if sub.tipo == 'application/octet-stream')
+        self.conta_enviado(len(dados) - conteudo)
+        self.conta_enviado(conteudo, conteudo=True)
+
+    def _token(self, numero):
+        return {'__metadata': {'type': 'SP.ChangeToken'}, 'StringValue': f'1;3;{self.biblioteca};0;{numero}'}
+
+    def _rota_sharepoint(self, handler, corpo):
+        partes = urlsplit(handler.path)
+        caminho = unquote(partes.path)
+        parametros = parse_qs(partes.query)
+        base = f'/sites/{self.site}/_api/'
+        if not caminho.lower().startswith(base.lower()):
+            return handler.responde(404, _erro('site desconhecido'))
+        rota = caminho[len(base):]
+        rota_min = rota.lower()
+
+        if rota_min == '$batch':
+            return self._lote(handler, corpo)
+
+        if rota_min == 'contextinfo':
+            self.conta('sharepoint.contextinfo')
+            return handler.responde(200, {'d': {'GetContextWebInformation': {
+                'FormDigestValue': '0xBENCHMARK', 'FormDigestTimeoutSeconds': 1800,
+                'WebFullUrl': self.url_sharepoint, 'SiteFullUrl': self.url_sharepoint}}})
+
+        upload = re.match(ROTA_ARQUIVO + r"/(startupload|continueupload|finishupload)\((.*)\)$", rota, re.I)
+        if upload:
+            return self._sessao_upload(handler, upload, upload.group(3).lower(), upload.group(4), corpo)
+
+        adiciona = re.match(r"web/getfolderbyserverrelative(?:url\(|path\(decodedurl=)'(.*)'\)/files/add\((.*)\)$", rota, re.I)
+        if adiciona:
+            self.conta('sharepoint.upload')
+            nome = re.search(r"url='([^']*)'", adiciona.group(2)).group(1)
+            arquivo = self._grava_arquivo(self._relativo(adiciona.group(1)), nome, corpo)
+            if arquivo is None:
+                return handler.responde(404, _erro('pasta não encontrada'))
+            return handler.responde(200, {'d': self._json_arquivo(arquivo)})
+
+        propriedades = re.match(ROTA_ARQUIVO + '$', rota, re.I)
+        if propriedades:
+            self.conta('sharepoint.arquivo')
+            arquivo = self._busca_arquivo(propriedades)
+            if arquivo is None:
+                return handler.responde(404, _erro('arquivo não encontrado'))
+            return handler.responde(200, {'d': self._json_arquivo(arquivo)})
+
+        conteudo = re.match(ROTA_ARQUIVO + r"/\\?\$value$", rota, re.I)
+        if conteudo:
+            self.conta('sharepoint.download_parcial' if handler.headers.get('Range') else 'sharepoint.download')
+            arquivo = self._busca_arquivo(conteudo)
+            if arquivo is None:
+                return handler.responde(404, _erro('arquivo não encontrado'))
+            return handler.responde_conteudo(arquivo)
+
+        nova_pasta = re.match(r"web/getfolderbyserverrelative(?:url\(|path\(decodedurl=)'(.*)'\)/folders/add\('([^']*)'\)$", rota, re.I)
+        if nova_pasta:
+            self.conta('sharepoint.cria_pasta')
+            pai = self._relativo(nova_pasta.group(1))
+            nome = nova_pasta.group(2)
+            with self._lock:
+                if pai not in self.pastas:
+                    pai = None
+                elif nome not in self.pastas[pai]['pastas']:
+                    #Como no SharePoint, adicionar uma pasta que já existe devolve a pasta existente
+                    self.pastas[pai]['pastas'].append(nome)
+                    self.pastas[f'{pai}/{nome}'] = {'pastas': [], 'arquivos': []}
+            if pai is None:
+                return handler.responde(404, _erro('pasta não encontrada'))
+            return handler.responde(200, {'d': self._json_pasta(f'{pai}/{nome}')})
+
+        arquivos_pasta = re.match(r"web/getfolderbyserverrelative(?:url\(|path\(decodedurl=)'(.*)'\)/files$", rota, re.I)
+        if arquivos_pasta:
+            self.conta('sharepoint.arquivos_pasta')
+            relativo = self._relativo(arquivos_pasta.group(1))
+            if relativo not in self.pastas:
+                return handler.responde(404, _erro('pasta não encontrada'))
+            arquivos = list(self.pastas[relativo]['arquivos'])
+            data = re.search(r"TimeLastModified ge datetime'([^']+)'", parametros.get('$filter', [''])[0])
+            if data:
+                limite = datetime.strptime(data.group(1), FORMATO_DATA).replace(tzinfo=timezone.utc)
+                arquivos = [arquivo for arquivo in arquivos if arquivo.modificado >= limite]
+            #A office365 manda $orderBy, o SharePoint aceita as opções sem diferenciar maiúsculas
+            ordem = next((valores[0] for chave, valores in parametros.items() if chave.lower() == '$orderby'), '')
+            if ordem.lower() == 'timelastmodified desc':
+                arquivos.sort(key=lambda arquivo: arquivo.modificado, reverse=True)
+            if '$top' in parametros:
+                arquivos = arquivos[:int(parametros['$top'][0])]
+            return handler.responde(200, {'d': {'results': [self._json_arquivo(a) for a in arquivos]}})
+
+        pasta = re.match(r"web/getfolderbyserverrelative(?:url\(|path\(decodedurl=)'(.*)'\)$", rota, re.I)
+        if pasta:
+            self.conta('sharepoint.pasta')
+            relativo = self._relativo(pasta.group(1))
+            if relativo not in self.pastas:
+                return handler.responde(404, _erro('pasta não encontrada'))
+            dados = self._json_pasta(relativo)
+            expandir = parametros.get('$expand', [''])[0]
+            if 'Files' in expandir:
+                dados['Files'] = {'results': [self._json_arquivo(a) for a in self.pastas[relativo]['arquivos']]}
+            if 'Folders' in expandir:
+                dados['Folders'] = {'results': [self._json_pasta(f'{relativo}/{nome}')
+                                                for nome in self.pastas[relativo]['pastas']]}
+            return handler.responde(200, {'d': dados})
+
+        lista = re.match(r"web/getlist\('(.*)'\)(/items|/getchanges)?$", rota, re.I)
+        if lista:
+            acao = (lista.group(2) or '').lower()
+            if acao == '/items':
+                self.conta('sharepoint.itens_lista')
+                itens = self._itens_lista(parametros)
+                tamanho_pagina = int(parametros.get('$top', ['100'])[0])
+                depois = int(parametros.get('$skiptoken', ['Paged=TRUE&p_ID=0'])[0].rsplit('=', 1)[-1])
+                pagina = [arquivo for item_id, arquivo in itens if item_id > depois][:tamanho_pagina]
+                dados = {'results': [self._json_item(arquivo) for arquivo in pagina]}
+                if len(pagina) == tamanho_pagina and pagina[-1].item_id < itens[-1][0]:
+                    query = dict((chave, valores[0]) for chave, valores in parametros.items())
+                    query['$skiptoken'] = f'Paged=TRUE&p_ID={pagina[-1].item_id}'
+                    dados['__next'] = f"{self.url_sharepoint}/_api/{quote(rota)}?" + '&'.join(
+                        f'{chave}={quote(valor)}' for chave, valor in query.items())
+                return handler.responde(200, {'d': dados})
+            if acao == '/getchanges':
+                self.conta('sharepoint.get_changes')
+                consulta = json.loads(corpo or b'{}').get('query', {})
+                inicio = int(((consulta.get('ChangeTokenStart') or {}).get('StringValue') or '0;0').rsplit(';', 1)[-1])
+                limite = int(consulta.get('FetchLimit') or 1000)
+                with self._lock:
+                    mudancas = [m for m in self.mudancas if m[0] > inicio][:limite]
+                return handler.responde(200, {'d': {'results': [{
+                    '__metadata': {'type': 'SP.ChangeItem'},
+                    'ChangeType': 2,
+                    'ChangeToken': self._token(numero),
+                    'ItemId': arquivo.item_id,
+                    'UniqueId': arquivo.unique_id,
+                    'ListId': str(uuid.uuid5(uuid.NAMESPACE_URL, self.biblioteca)),
+                    'WebId': str(uuid.uuid5(uuid.NAMESPACE_URL, self.site)),
+                } for numero, _, arquivo in mudancas]}})
+            self.conta('sharepoint.lista')
+            return handler.responde(200, {'d': {
+                '__metadata': {'type': 'SP.List'},
+                'Title': self.biblioteca,
+                'CurrentChangeToken': self._token(len(self.mudancas)),
+            }})
+
+        self.conta('sharepoint.desconhecida')
+        return handler.responde(404, _erro(f'rota não simulada: {handler.command} {rota}'))
+
+    # Fluig
+
+    def _novo_documento(self, descricao, tipo, pai, dados=b''):
+        with self._lock:
+            self._proximo_documento += 1
+            documento_id = str(self._proximo_documento)
+            self.documentos[documento_id] = {'descricao': descricao, 'tipo': tipo, 'pai': str(pai), 'removido': False,
+                                             'versao': 1, 'modificado': datetime.now(), 'dados': bytes(dados)}
+        return documento_id
+
+    def _pasta_ativa(self, pasta_id):
+        """Pasta de destino existe e não foi removida (o fluig responde 404 para criar ou enviar nela)"""
+        if str(pasta_id) == RAIZ_FLUIG:
+            return True
+        with self._lock:
+            pasta = self.documentos.get(str(pasta_id))
+        return pasta is not None and pasta['tipo'] == '1' and not pasta['removido']
+
+    def _campo(self, documento_id, documento, campo):
+        return {
+            'documentPK.documentId': documento_id,
+            'documentDescription': documento['descricao'],
+            'parentDocumentId': documento['pai'],
+            'documentType': documento['tipo'],
+            'deleted': 'true' if documento['removido'] else 'false',
+            'documentPK.version': documento['versao'],
+            'activeVersion': 'true',
+            'lastModifiedDate': documento['modificado'].strftime('%Y-%m-%d'),
+        }.get(campo)
+
+    @staticmethod
+    def _atende_restricao(valor, inicial, final):
+        """Valor igual ao inicial ou, com valores diferentes, dentro do intervalo"""
+        return valor == inicial if inicial == final else inicial <= valor <= final
+
+    def _dataset(self, parametros):
+        """Consulta do dataset document: restrições MUST combinadas com "e" e SHOULD com "ou" """
+        campos = parametros.get('field', [])
+        restricoes = list(zip(parametros.get('constraintsField', []), parametros.get('constraintsInitialValue', []),
+                              parametros.get('constraintsFinalValue', []), parametros.get('constraintsType', [])))
+        valores = []
+        with self._lock:
+            documentos = list(self.documentos.items())
+        for documento_id, documento in documentos:
+            atende = [(self._atende_restricao(str(self._campo(documento_id, documento, c)), inicial, final), t)
+                      for c, inicial, final, t in restricoes]
+            obrigatorias = [ok for ok, t in atende if t != 'SHOULD']
+            opcionais = [ok for ok, t in atende if t == 'SHOULD']
+            if all(obrigatorias) and (not opcionais or any(opcionais)):
+                valores.append({campo: self._campo(documento_id, documento, campo) for campo in campos})
+        return {'values': valores}
+
+    def _rota_fluig(self, handler, corpo):
+        partes = urlsplit(handler.path)
+        caminho = unquote(partes.path)
+        metodo = handler.command
+
+        if caminho == '/dataset/api/v2/dataset-handle/search':
+            self.conta('fluig.dataset')
+            return handler.responde(200, self._dataset(parse_qs(partes.query)))
+
+        pasta = re.match(r'/content-management/api/v2/folders/(\w+)$', caminho)
+        if pasta and metodo == 'POST':
+            self.conta('fluig.cria_pasta')
+            if not self._pasta_ativa(pasta.group(1)):
+                return handler.responde(404, {'message': f'pasta {pasta.group(1)} não encontrada'})
+            descricao = json.loads(corpo or b'{}').get('alias')
+            return handler.responde(200, {'documentId': self._novo_documento(descricao, '1', pasta.group(1))})
+
+        envio = re.match(r'/content-management/api/v2/documents/upload/([^/]+)(?:/(\w+)/publish)?$', caminho)
+        if envio and metodo == 'POST':
+            if envio.group(2) is None:
+                #Arquivo enviado para a área temporária, publicado depois pelo updateFile
+                self.conta('fluig.upload_temporario')
+                with self._lock:
+                    self._temporarios[envio.group(1)] = _conteudo_multipart(corpo)
+                return handler.responde(200, {'content': None, 'message': None})
+            self.conta('fluig.upload')
+            if not self._pasta_ativa(envio.group(2)):
+                return handler.responde(404, {'message': f'pasta {envio.group(2)} não encontrada'})
+            documento_id = self._novo_documento(envio.group(1), '2', envio.group(2), _conteudo_multipart(corpo))
+            return handler.responde(200, {'content': {'id': int(documento_id), 'description': envio.group(1)}})
+
+        if caminho == '/api/public/ecm/document/updateFile' and metodo == 'POST':
+            self.conta('fluig.nova_versao')
+            dados = json.loads(corpo or b'{}')
+            documento_id = str(dados.get('id'))
+            nome = (dados.get('attachments') or [{}])[0].get('fileName')
+            with self._lock:
+                documento = self.documentos.get(documento_id)
+                if documento is not None:
+                    documento['versao'] += 1
+                    documento['dados'] = self._temporarios.pop(nome, documento['dados'])
+                    documento['modificado'] = datetime.now()
+            if documento is None:
+                return handler.responde(404, {'message': 'documento não encontrado'})
+            return handler.responde(200, {'content': {'id': int(documento_id), 'version': documento['versao']}})
+
+        conteudo = re.match(r'/content-management/api/v2/documents/(\w+)/stream$', caminho)
+        if conteudo and metodo == 'GET':
+            self.conta('fluig.download')
+            with self._lock:
+                dados = self.documentos.get(conteudo.group(1))
+            if dados is None or dados['removido']:
+                return handler.responde(404, {'message': 'documento não encontrado'})
+            return handler.responde_bytes(dados['dados'])
+
+        documento = re.match(r'/content-management/api/v2/documents/(\w+)$', caminho)
+        if documento:
+            documento_id = documento.group(1)
+            with self._lock:
+                dados = self.documentos.get(documento_id)
+            if dados is None or dados['removido']:
+                self.conta(f'fluig.documento_{metodo.lower()}')
+                return handler.responde(404, {'message': 'documento não encontrado'})
+            if metodo == 'DELETE':
+                self.conta('fluig.remove_documento')
+                with self._lock:
+                    dados['removido'] = True
+                return handler.responde(204)
+            self.conta('fluig.documento')
+            return handler.responde(200, {'id': int(documento_id), 'description': dados['descricao'],
+                                          'parentId': int(dados['pai']), 'type': dados['tipo']})
+
+        self.conta('fluig.desconhecida')
+        return handler.responde(404, {'message': f'rota não simulada: {metodo} {caminho}'})
@@ -0,0 +1,190 @@
+from office365_api import SharePoint
+import os
+from pathlib import PurePath
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import modulo_fluig
+import gerenciador_sessao
+import metricas
+from estado_sync import EstadoSync, ARQUIVO_ESTADO
+import logging
+import configuracao
+
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    #Pasta local onde os documentos do fluig são baixados antes de enviar ao SharePoint (a mesma do download)
+    FOLDER_DEST=('sharepoint', 'pasta_local_download'),
+    # Arquivo do índice de estado
+    ARQUIVO_ESTADO=('estado', 'arquivo', ARQUIVO_ESTADO),
+    # Documentos tratados ao mesmo tempo (download do fluig + upload para o SharePoint)
+    WORKERS=('reverso', 'workers', 4),
+    # Tamanho dos blocos do upload em sessão para o SharePoint, arquivos menores vão em uma única requisição
+    CHUNK_SIZE=('reverso', 'chunk_size', 10 * 1024 * 1024),
+    # Sem checkpoint gravado, considera os documentos modificados nos últimos dias
+    DIAS_INICIAIS=('reverso', 'dias_iniciais', 2),
+    # Documento alterado no fluig e no SharePoint: 'copia' envia uma cópia com o nome do conflito, 'ignorar' só loga
+    CONFLITO=('reverso', 'conflito', 'copia'),
+    # Chave do checkpoint no índice de estado (tabela de tokens)
+    CHAVE_CHECKPOINT=lambda config: f'fluig:{modulo_fluig.opcoes.PARENT_ID_PASTA_ENGETEC}',
+)
+# Índice de estado da execução, aberto no main
+estado = None
+# Instância única, o contexto autenticado é reaproveitado em todas as chamadas
+sharepoint = SharePoint()
+# Pastas do SharePoint já garantidas nessa execução
+_pastas_criadas = set()
+_lock_pastas = threading.Lock()
+
+
+def nome_conflito(nome, versao):
+    """Nome da cópia enviada quando o arquivo foi alterado nos dois lados, ex: relatorio (fluig v3).pdf"""
+    base, extensao = os.path.splitext(nome)
+    return f"{base} (fluig v{versao}){extensao}"
+
+def garante_pasta(folder):
+    """Cria a pasta no SharePoint uma única vez por execução"""
+    with _lock_pastas:
+        if folder in _pastas_criadas:
+            return
+    sharepoint.ensure_folder(folder)
+    with _lock_pastas:
+        _pastas_criadas.add(folder)
+
+def envia_arquivo(caminho_local, folder):
+    """Envia o arquivo em blocos (sessão retomável) e confere se o SharePoint ficou com o tamanho enviado,
+    um envio incompleto não pode ser gravado no estado como sincronizado"""
+    garante_pasta(folder)
+    file = sharepoint.upload_file_in_chunks(str(caminho_local), folder, opcoes.CHUNK_SIZE, estado=estado)
+    tamanho = os.path.getsize(caminho_local)
+    if int(file.length) != tamanho:
+        raise Exception(f"{folder}/{file.name} ficou com {file.length} bytes no SharePoint, enviados {tamanho}")
+    return file
+
+def envia_sharepoint(caminho_local, folder, documento_id, impressao, tamanho):
+    """Envia o arquivo e grava no estado como sincronizado,
+    assim o download do SharePoint não manda o mesmo conteúdo de volta ao fluig"""
+    file = envia_arquivo(caminho_local, folder)
+    estado.registra(SharePoint.file_properties(file), folder, caminho_local, documento_id)
+    estado.grava_hash_documento(documento_id, impressao, tamanho)
+    logging.info(f"Documento ({documento_id}) enviado para o SharePoint em {folder}/{file.name}")
+
+def sincroniza_documento(documento, pastas):
+    """Leva a versão do documento do fluig para o SharePoint, se ela ainda não foi tratada.
+    Retorna 'enviado', 'conflito' ou 'ignorado'"""
+    documento_id, versao, nome = documento['documentId'], documento['versao'], documento['nome']
+    caminho_pastas = pastas.get(documento['parentId'])
+    #Fora da pasta sincronizada ou direto na raiz (o download sempre cria a pasta da biblioteca)
+    if not caminho_pastas:
+        return 'ignorado'
+    if estado.versao_reversa(documento_id) == versao:
+        return 'ignorado'
+    folder = '/'.join(caminho_pastas)
+    os.makedirs(PurePath(opcoes.FOLDER_DEST, folder), exist_ok=True)
+    caminho_local = PurePath(opcoes.FOLDER_DEST, folder, nome)
+    #Baixado à parte: o caminho_local é o arquivo de trabalho do download do SharePoint e só é substituído
+    #depois da decisão de conflito
+    temporario = PurePath(opcoes.FOLDER_DEST, folder, f'.{nome}.fluig-{documento_id}.tmp')
+    try:
+        return _sincroniza_baixado(documento, folder, caminho_local, temporario)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def _sincroniza_baixado(documento, folder, caminho_local, temporario):
+    """Baixa a versão do fluig no arquivo temporário e decide o que fazer com ela"""
+    documento_id, versao, nome = documento['documentId'], documento['versao'], documento['nome']
+    tamanho, impressao = modulo_fluig.baixa_documento(documento_id, temporario)
+
+    #Mesmo conteúdo enviado pelo download do SharePoint, não é uma alteração feita no fluig
+    if estado.hash_documento(documento_id) == impressao:
+        logging.info(f"Documento ({documento_id}) {nome} sem alteração no fluig")
+        estado.grava_versao_reversa(documento_id, versao, impressao)
+        return 'ignorado'
+
+    atual = sharepoint.get_file_properties(nome, folder)
+    sincronizado = estado.busca_por_documento(documento_id)
+    #Arquivo do SharePoint alterado depois da última sincronização (ou existente e nunca sincronizado)
+    if atual is not None and (sincronizado is None or sincronizado[0] != atual['file_id'] or estado.mudou(atual)):
+        if opcoes.CONFLITO != 'copia':
+            logging.warning(f"Conflito: {folder}/{nome} alterado no fluig e no SharePoint, documento ({documento_id}) não enviado")
+            estado.grava_versao_reversa(documento_id, versao, impressao)
+            return 'conflito'
+        copia = PurePath(opcoes.FOLDER_DEST, folder, nome_conflito(nome, versao))
+        os.replace(temporario, copia)
+        logging.warning(f"Conflito: {folder}/{nome} alterado no fluig e no SharePoint, enviando a versão do fluig como {copia.name}")
+        envia_arquivo(copia, folder)
+        estado.grava_versao_reversa(documento_id, versao, impressao)
+        return 'conflito'
+
+    #Sem conflito a versão do fluig passa a ser a do SharePoint, substitui o arquivo de trabalho antes do envio
+    os.replace(temporario, caminho_local)
+    envia_sharepoint(caminho_local, folder, documento_id, impressao, tamanho)
+    estado.grava_versao_reversa(documento_id, versao, impressao)
+    return 'enviado'
+
+def sincroniza(desde):
+    """Trata os documentos modificados no fluig desde a data, retorna os totais por resultado e se houve erro"""
+    #Caminho de cada pasta do fluig a partir da pasta raiz, com uma única consulta
+    cache_pastas = modulo_fluig.get_cache_pastas()
+    cache_pastas.carregar(modulo_fluig.lista_pastas())
+    pastas = cache_pastas.por_documento()
+    documentos = modulo_fluig.documentos_modificados(desde)
+    logging.info(f"{len(documentos)} documentos modificados no fluig desde {desde}")
+
+    totais = {'enviado': 0, 'conflito': 0, 'ignorado': 0, 'erro': 0}
+
+    def _trata(documento):
+        try:
+            return sincroniza_documento(documento, pastas)
+        except Exception as e:
+            logging.error(f"Erro ao sincronizar o documento ({documento['documentId']}) {documento['nome']}: {e}")
+            return 'erro'
+
+    with ThreadPoolExecutor(max_workers=opcoes.WORKERS, thread_name_prefix='reverso') as executor:
+        for resultado in executor.map(_trata, documentos):
+            totais[resultado] += 1
+    logging.info(f"Sincronização fluig -> SharePoint: {totais}")
+    return totais
+
+def ciclo():
+    """Sincroniza a partir do checkpoint gravado e avança o checkpoint se nenhum documento falhou"""
+    inicio = datetime.now()
+    checkpoint = estado.get_token(opcoes.CHAVE_CHECKPOINT)
+    desde = datetime.fromisoformat(checkpoint) if checkpoint else inicio - timedelta(days=opcoes.DIAS_INICIAIS)
+    totais = sincroniza(desde)
+    #Com erro, o próximo ciclo consulta o mesmo período de novo (as versões já tratadas são ignoradas)
+    if not totais['erro']:
+        estado.grava_token(opcoes.CHAVE_CHECKPOINT, inicio.isoformat())
+    return totais
+
+def main():
+    global estado
+    configuracao.configura_log()
+    estado = EstadoSync(opcoes.ARQUIVO_ESTADO)
+    modulo_fluig.configura_estado(estado)
+    metricas.configurar(**configuracao.carregar().get('metricas', {}))
+    start_time = time.time()
+    logging.info(f"Inicio: {datetime.now()}")
+
+    try:
+        ciclo()
+    except Exception as e:
+        logging.error(f"Erro: {e}")
+        return e
+    finally:
+        modulo_fluig.salvar_cache_pastas()
+        metricas.finaliza()
+        gerenciador_sessao.fechar()
+        estado.fechar()
+
+    elapsed_time = time.time() - start_time
+    logging.info(f"Tempo decorrido: {elapsed_time}")
+    logging.info(f"Fim: {datetime.now()}")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logging.error(f"Erro: {e}")
@@ -0,0 +1,125 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+import configuracao
+#Os módulos de sincronização são importados só no comando escolhido, depois do --config,
+#assim a inicialização não carrega a office365 nem os clientes que o comando não usa
+
+
+def _data(texto):
+    """Data da linha de comando, no formato AAAA-MM-DD ou AAAA-MM-DDTHH:MM"""
+    for formato in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"data inválida: {texto} (use AAAA-MM-DD ou AAAA-MM-DDTHH:MM)")
+
+
+def full(args):
+    import download_all_files_with_subfolder
+    return download_all_files_with_subfolder.main()
+
+
+def recent_since(args):
+    import download_files_recentes
+    desde = args.desde
+    if desde is None and args.dias is not None:
+        desde = datetime.now() - timedelta(days=args.dias)
+    return download_files_recentes.main(desde=desde)
+
+
+def latest(args):
+    import download_files_recentes
+    pasta = args.pasta or download_files_recentes.opcoes.FOLDER_NAME
+    return download_files_recentes.main(pasta_mais_recente=pasta)
+
+
+def reverse(args):
+    import sincroniza_fluig_sharepoint
+    return sincroniza_fluig_sharepoint.main()
+
+
+def publish(args):
+    import modulo_fluig_async
+    return modulo_fluig_async.main(pasta=args.pasta)
+
+
+def plan(args):
+    import planejador
+    return planejador.main(args.argumentos)
+
+
+def distributed(args):
+    import sync_distribuido
+    return sync_distribuido.main(args.argumentos)
+
+
+def service(args):
+    import servico_sync
+    return servico_sync.main()
+
+
+def check(args):
+    """Confere o arquivo de configuração sem importar os clientes nem abrir conexões"""
+    try:
+        faltando = configuracao.valida()
+    except Exception as e:
+        print(f"Erro ao ler {configuracao.caminho()}: {e}")
+        return 1
+    if faltando:
+        print(f"{configuracao.caminho()}: faltam as chaves {', '.join(faltando)}")
+        return 1
+    print(f"{configuracao.caminho()}: configuração ok")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sync', description='Sincronização SharePoint <-> fluig')
+    parser.add_argument('--config', help='arquivo de configuração (padrão: SYNC_CONFIG ou o config.yaml padrão)')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    comandos.add_parser('full', help='copia a biblioteca inteira do SharePoint para o fluig').set_defaults(funcao=full)
+
+    recentes = comandos.add_parser('recent-since', help='copia os arquivos modificados recentemente')
+    periodo = recentes.add_mutually_exclusive_group()
+    periodo.add_argument('--dias', type=float, help='modificados nos últimos N dias (padrão: DIAS_RECENTES)')
+    periodo.add_argument('--desde', type=_data, help='modificados a partir da data (AAAA-MM-DD[THH:MM])')
+    recentes.set_defaults(funcao=recent_since)
+
+    mais_recente = comandos.add_parser('latest', help='copia só o arquivo mais recente da pasta')
+    mais_recente.add_argument('--pasta', help='pasta do SharePoint (padrão: a biblioteca configurada)')
+    mais_recente.set_defaults(funcao=latest)
+
+    comandos.add_parser('reverse', help='envia ao SharePoint as alterações feitas no fluig').set_defaults(funcao=reverse)
+
+    publicar = comandos.add_parser('publish', help='publica no fluig os arquivos já baixados (cliente asyncio)')
+    publicar.add_argument('--pasta', help='subpasta da pasta de download (padrão: a pasta inteira)')
+    publicar.set_defaults(funcao=publish)
+
+    for nome, funcao, ajuda in (('plan', plan, 'sincronização planejada (argumentos do planejador)'),
+                                ('distributed', distributed, 'sincronização distribuída (argumentos do sync_distribuido)')):
+        #Os argumentos desconhecidos seguem para o main do módulo
+        comandos.add_parser(nome, help=ajuda, add_help=False).set_defaults(funcao=funcao, repassa=True)
+
+    comandos.add_parser('service', help='executa o serviço de sincronização contínua').set_defaults(funcao=service)
+    comandos.add_parser('check', help='confere a configuração sem conectar').set_defaults(funcao=check)
+
+    args, argumentos = parser.parse_known_args(argv)
+    if argumentos and not getattr(args, 'repassa', False):
+        parser.error(f"argumentos não reconhecidos: {' '.join(argumentos)}")
+    args.argumentos = argumentos
+    if args.config:
+        configuracao.definir(args.config)
+    if not os.path.exists(configuracao.caminho()):
+        parser.error(f"arquivo de configuração não encontrado: {configuracao.caminho()} (use --config ou SYNC_CONFIG)")
+    resultado = args.funcao(args)
+    #Os mains devolvem a exceção que interrompeu a execução, ou um código de saída
+    if isinstance(resultado, BaseException):
+        return 1
+    return resultado if isinstance(resultado, int) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,557 @@
+import os
+import sys
+import copy
+import json
+import time
+import heapq
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import logging
+import yaml
+import configuracao
+
+# Configuração lida no primeiro uso (--config do sync, SYNC_CONFIG ou o config.yaml padrão), não na importação
+opcoes = configuracao.Opcoes(
+    # Fila de tarefas compartilhada pelos workers (SQLite); em vários nós, fica num compartilhamento com lock de arquivo
+    ARQUIVO_FILA=('distribuido', 'fila', 'fila_sync.db'),
+    # Processos de sincronização por nó
+    PROCESSOS=('distribuido', 'processos', 4),
+    # Processos somando todos os nós, o limite de taxa de cada serviço é dividido entre eles
+    PROCESSOS_TOTAL=lambda config: (config.get('distribuido') or {}).get('processos_total', opcoes.PROCESSOS),
+    # Partes (tarefas) em que cada job é dividido
+    SHARDS=lambda config: (config.get('distribuido') or {}).get('shards', 2 * opcoes.PROCESSOS),
+    # Segundos que uma tarefa fica reservada para o worker sem renovação, depois outro worker pode pegá-la
+    LEASE=('distribuido', 'lease', 300),
+    # Execuções de uma tarefa antes de ser marcada como erro
+    TENTATIVAS=('distribuido', 'tentativas', 3),
+    # Bytes equivalentes ao custo fixo (requisições) de um arquivo, no equilíbrio das partes
+    PESO_ARQUIVO=('distribuido', 'peso_arquivo', 64 * 1024),
+    # Segundos que a trava de um nome na área de upload do fluig vale, se o processo que a tem parar
+    PRAZO_TRAVA=('distribuido', 'prazo_trava', 3600),
+)
+# Máximo de subárvores por parte, limita a divisão de árvores muito desequilibradas
+UNIDADES_POR_SHARD = 8
+# Segundos entre consultas à fila quando não há tarefa liberada
+ESPERA_FILA = 2
+# Segundos entre tentativas de pegar uma trava ocupada
+ESPERA_TRAVA = 0.05
+# Processos novos a cada tarefa, a configuração do job vale para o processo inteiro (sessões, caches, estado)
+_contexto = multiprocessing.get_context('spawn')
+
+
+def _mescla(base, extra):
+    """Mescla a configuração extra do job na configuração base (seção por seção)"""
+    for chave, valor in (extra or {}).items():
+        if isinstance(valor, dict) and isinstance(base.get(chave), dict):
+            _mescla(base[chave], valor)
+        else:
+            base[chave] = valor
+    return base
+
+
+def _com_sufixo(caminho, sufixo):
+    raiz, extensao = os.path.splitext(caminho)
+    return f'{raiz}-{sufixo}{extensao}'
+
+
+def jobs():
+    """Jobs da seção distribuido (site, biblioteca e subárvore opcional); sem jobs, a biblioteca do config"""
+    config = configuracao.carregar()
+    lista = (config.get('distribuido') or {}).get('jobs') or [{'nome': config['sharepoint']['sharepoint_doc_library']}]
+    return [dict(job, nome=str(job.get('nome') or i)) for i, job in enumerate(lista)]
+
+
+def raiz_job(job):
+    """Pasta raiz do job, relativa ao site"""
+    return (job.get('subarvore') or job.get('sharepoint_doc_library')
+            or configuracao.carregar()['sharepoint']['sharepoint_doc_library'])
+
+
+def config_job(job, sufixo=None):
+    """Configuração de um processo do job: site e biblioteca do job, pasta local, estado e pasta raiz no fluig
+    próprios e a fatia do limite de taxa que cabe a cada processo"""
+    #A seção distribuido fica: o processo da tarefa também usa a fila, as tentativas e o prazo das travas
+    cfg = copy.deepcopy(configuracao.carregar())
+    for chave in ('sharepoint_url_site', 'sharepoint_site_name', 'sharepoint_doc_library'):
+        if job.get(chave):
+            cfg['sharepoint'][chave] = job[chave]
+    cfg['sharepoint']['pasta_local_download'] = os.path.join(cfg['sharepoint']['pasta_local_download'], job['nome'])
+    estado = cfg.setdefault('estado', {})
+    estado['arquivo'] = _com_sufixo(estado.get('arquivo', 'estado_sync.db'), job['nome'])
+    if job.get('pasta_raiz_fluig'):
+        cfg['fluig']['pasta_raiz'] = job['pasta_raiz_fluig']
+    #O planejador consulta todas as pastas no início, o cache em disco seria disputado pelos processos
+    cfg['fluig'].pop('cache_pastas', None)
+    for chave in ('arquivo_json', 'arquivo_prometheus'):
+        if cfg.get('metricas', {}).get(chave):
+            cfg['metricas'][chave] = _com_sufixo(cfg['metricas'][chave], f"{job['nome']}-{sufixo or os.getpid()}")
+    for limite in cfg.get('retry', {}).get('limites', {}).values():
+        limite['taxa'] = limite['taxa'] / opcoes.PROCESSOS_TOTAL
+        if limite.get('capacidade'):
+            limite['capacidade'] = max(1, limite['capacidade'] // opcoes.PROCESSOS_TOTAL)
+    return _mescla(cfg, job.get('config'))
+
+
+@contextmanager
+def _configura_processo(job, sufixo=None):
+    """Grava a configuração do job num arquivo temporário e aponta o SYNC_CONFIG do processo para ele"""
+    descritor, caminho = tempfile.mkstemp(prefix=f"sync-{job['nome']}-", suffix='.yaml')
+    with os.fdopen(descritor, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config_job(job, sufixo), f, allow_unicode=True)
+    configuracao.definir(caminho)
+    try:
+        yield caminho
+    finally:
+        os.remove(caminho)
+
+
+class FilaTarefas:
+    """Fila das tarefas da sincronização distribuída em SQLite, compartilhada entre processos e nós.
+    Cada tarefa é reservada por um worker com prazo (lease) renovado enquanto ele trabalha; uma tarefa de
+    worker que parou volta para a fila quando o prazo vence. Guarda também os pesos das pastas da última
+    execução de cada job, usados para dividir a próxima"""
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho = caminho or opcoes.ARQUIVO_FILA
+        self._conn = sqlite3.connect(caminho, timeout=60, isolation_level=None)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rodadas (
+                id TEXT PRIMARY KEY,
+                criada TEXT
+            )"""
+        )
+        #Fase 0 é a preparação das pastas do job, as tarefas da fase 1 só são liberadas depois dela
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tarefas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                rodada TEXT,
+                job TEXT,
+                fase INTEGER,
+                escopo TEXT,
+                peso REAL,
+                estado TEXT,
+                dono TEXT,
+                expira REAL,
+                tentativas INTEGER,
+                resultado TEXT
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS historico (
+                job TEXT,
+                pasta TEXT,
+                arquivos INTEGER,
+                bytes INTEGER,
+                PRIMARY KEY (job, pasta)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tarefas_rodada ON tarefas (rodada, estado)")
+        #Nomes em uso na área de upload do fluig (mesmo usuário em todos os processos)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS travas (
+                nome TEXT PRIMARY KEY,
+                dono TEXT,
+                expira REAL
+            )"""
+        )
+
+    @contextmanager
+    def _transacao(self):
+        """Transação com lock de escrita desde o início, a reserva de tarefas não pode ser disputada"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def nova_rodada(self, tarefas):
+        """Cria a rodada com as tarefas [(job, fase, escopo, peso)], retorna o id"""
+        rodada = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        with self._transacao() as conn:
+            conn.execute("INSERT INTO rodadas VALUES (?, ?)", (rodada, datetime.now().isoformat()))
+            conn.executemany(
+                "INSERT INTO tarefas (rodada, job, fase, escopo, peso, estado, tentativas) VALUES (?, ?, ?, ?, ?, 'pendente', 0)",
+                [(rodada, job, fase, json.dumps(escopo, ensure_ascii=False), peso) for job, fase, escopo, peso in tarefas]
+            )
+        return rodada
+
+    def rodada_atual(self):
+        linha = self._conn.execute("SELECT id FROM rodadas ORDER BY criada DESC LIMIT 1").fetchone()
+        return linha[0] if linha else None
+
+    @staticmethod
+    def _filtro_jobs(jobs):
+        """Condição SQL e parâmetros que limitam as tarefas aos jobs (None: todos)"""
+        if jobs is None:
+            return '', ()
+        return f" AND job IN ({', '.join('?' * len(jobs))})", tuple(jobs)
+
+    def pega(self, rodada, dono, lease=None, jobs=None):
+        """Reserva a próxima tarefa liberada da rodada (a mais pesada primeiro), (id, job, escopo) ou None.
+        Com jobs, só as tarefas desses jobs (os que o nó conhece)"""
+        lease = lease or opcoes.LEASE
+        agora = time.time()
+        filtro, nomes = self._filtro_jobs(jobs)
+        with self._transacao() as conn:
+            conn.execute(
+                "UPDATE tarefas SET estado = 'erro', resultado = 'prazo vencido nas tentativas' "
+                "WHERE rodada = ? AND estado = 'executando' AND expira < ? AND tentativas >= ?",
+                (rodada, agora, opcoes.TENTATIVAS)
+            )
+            #Sem a preparação, as pastas das partes não existem
+            conn.execute(
+                "UPDATE tarefas SET estado = 'erro', resultado = 'preparação do job falhou' "
+                "WHERE rodada = ? AND estado = 'pendente' AND EXISTS (SELECT 1 FROM tarefas p WHERE p.rodada = tarefas.rodada "
+                "AND p.job = tarefas.job AND p.fase < tarefas.fase AND p.estado = 'erro')",
+                (rodada,)
+            )
+            linha = conn.execute(
+                "SELECT id, job, escopo FROM tarefas t WHERE rodada = ? "
+                "AND (estado = 'pendente' OR (estado = 'executando' AND expira < ?)) "
+                "AND NOT EXISTS (SELECT 1 FROM tarefas p WHERE p.rodada = t.rodada AND p.job = t.job "
+                f"AND p.fase < t.fase AND p.estado != 'concluida'){filtro} "
+                "ORDER BY fase, peso DESC, id LIMIT 1",
+                (rodada, agora) + nomes
+            ).fetchone()
+            if linha is None:
+                return None
+            conn.execute(
+                "UPDATE tarefas SET estado = 'executando', dono = ?, expira = ?, tentativas = tentativas + 1 WHERE id = ?",
+                (dono, agora + lease, linha[0])
+            )
+        return linha[0], linha[1], json.loads(linha[2])
+
+    def renova(self, tarefa_id, dono, lease=None):
+        lease = lease or opcoes.LEASE
+        with self._transacao() as conn:
+            conn.execute("UPDATE tarefas SET expira = ? WHERE id = ? AND dono = ? AND estado = 'executando'",
+                         (time.time() + lease, tarefa_id, dono))
+
+    def conclui(self, tarefa_id, dono, resultado):
+        """Marca a tarefa como concluída se a reserva ainda é do dono (o prazo pode ter vencido e outro worker
+        ter pegado a tarefa); retorna se foi marcada"""
+        with self._transacao() as conn:
+            cursor = conn.execute(
+                "UPDATE tarefas SET estado = 'concluida', resultado = ? WHERE id = ? AND dono = ?",
+                (json.dumps(resultado, ensure_ascii=False, default=str), tarefa_id, dono)
+            )
+        return cursor.rowcount > 0
+
+    def falha(self, tarefa_id, dono, erro):
+        """Devolve a tarefa para a fila, ou marca como erro se acabaram as tentativas; só se a reserva ainda é do dono"""
+        with self._transacao() as conn:
+            cursor = conn.execute(
+                "UPDATE tarefas SET estado = CASE WHEN tentativas >= ? THEN 'erro' ELSE 'pendente' END, "
+                "resultado = ?, expira = NULL WHERE id = ? AND dono = ?",
+                (opcoes.TENTATIVAS, str(erro), tarefa_id, dono)
+            )
+        return cursor.rowcount > 0
+
+    def pendentes(self, rodada, jobs=None):
+        """Tarefas da rodada ainda não terminadas (pendentes ou em execução), só dos jobs se informados"""
+        filtro, nomes = self._filtro_jobs(jobs)
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM tarefas WHERE rodada = ? AND estado IN ('pendente', 'executando'){filtro}",
+            (rodada,) + nomes
+        ).fetchone()[0]
+
+    def resumo(self, rodada):
+        return dict(self._conn.execute("SELECT estado, COUNT(*) FROM tarefas WHERE rodada = ? GROUP BY estado", (rodada,)))
+
+    def tarefas(self, rodada):
+        return self._conn.execute(
+            "SELECT id, job, fase, peso, estado, dono, tentativas, resultado FROM tarefas WHERE rodada = ? ORDER BY id",
+            (rodada,)
+        ).fetchall()
+
+    def pesos(self, job):
+        """{pasta: (arquivos, bytes)} gravados pela última execução do job"""
+        return {pasta: (arquivos, n_bytes) for pasta, arquivos, n_bytes in
+                self._conn.execute("SELECT pasta, arquivos, bytes FROM historico WHERE job = ?", (job,))}
+
+    def grava_pesos(self, job, pesos, contem=None):
+        """Substitui os pesos das pastas do job (só as que contem aceita, se informado) pelos do inventário atual"""
+        with self._transacao() as conn:
+            antigas = [pasta for (pasta,) in conn.execute("SELECT pasta FROM historico WHERE job = ?", (job,))
+                       if contem is None or contem(pasta)]
+            conn.executemany("DELETE FROM historico WHERE job = ? AND pasta = ?", [(job, pasta) for pasta in antigas])
+            conn.executemany("INSERT OR REPLACE INTO historico VALUES (?, ?, ?, ?)",
+                             [(job, pasta, arquivos, n_bytes) for pasta, (arquivos, n_bytes) in pesos.items()])
+
+    def fechar(self):
+        self._conn.close()
+
+
+class TravaUpload:
+    """Trava por nome de arquivo entre os processos (tabela travas da fila), usada no envio de versões ao fluig:
+    a área de upload é do usuário, dois processos enviando versões com o mesmo nome trocariam os conteúdos"""
+
+    def __init__(self, caminho=None, prazo=None):
+        self._conn = sqlite3.connect(caminho or opcoes.ARQUIVO_FILA, timeout=60, isolation_level=None,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        self._locais = {}
+        self.prazo = prazo or opcoes.PRAZO_TRAVA
+
+    def _tenta(self, nome, dono):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM travas WHERE nome = ? AND expira < ?", (nome, agora))
+                pega = self._conn.execute("INSERT OR IGNORE INTO travas VALUES (?, ?, ?)",
+                                          (nome, dono, agora + self.prazo)).rowcount == 1
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return pega
+
+    def _libera(self, nome, dono):
+        with self._lock:
+            self._conn.execute("DELETE FROM travas WHERE nome = ? AND dono = ?", (nome, dono))
+
+    @contextmanager
+    def __call__(self, nome):
+        #As threads do processo esperam num lock local, só uma por nome disputa a trava da fila
+        with self._lock:
+            local = self._locais.setdefault(nome, threading.Lock())
+        with local:
+            dono = f'{socket.gethostname()}:{os.getpid()}'
+            while not self._tenta(nome, dono):
+                time.sleep(ESPERA_TRAVA)
+            try:
+                yield
+            finally:
+                self._libera(nome, dono)
+
+
+def particiona(pesos, raiz, shards=None, peso_arquivo=None):
+    """Divide a árvore abaixo da raiz em até shards partes de peso parecido.
+
+    pesos é {pasta: (arquivos, bytes)} dos arquivos diretamente em cada pasta. A subárvore mais pesada é
+    dividida nas subárvores filhas (a pasta fica com os próprios arquivos) até todas ficarem abaixo do peso
+    ideal; as subárvores são distribuídas nas partes começando pelas maiores, sempre na parte mais leve.
+    Retorna (raízes, partes): raízes são as pastas que iniciam subárvores e partes é [(raízes da parte, peso)].
+    """
+    shards = shards or opcoes.SHARDS
+    peso_arquivo = opcoes.PESO_ARQUIVO if peso_arquivo is None else peso_arquivo
+    proprio = defaultdict(int)
+    for pasta, (arquivos, n_bytes) in pesos.items():
+        if pasta == raiz or pasta.startswith(raiz + '/'):
+            proprio[pasta] += n_bytes + arquivos * peso_arquivo
+            #Pastas intermediárias que não estejam no histórico
+            while pasta != raiz:
+                pasta = pasta.rsplit('/', 1)[0]
+                proprio[pasta] += 0
+    proprio[raiz] += 0
+    filhos = defaultdict(list)
+    for pasta in proprio:
+        if pasta != raiz:
+            filhos[pasta.rsplit('/', 1)[0]].append(pasta)
+    total = dict(proprio)
+    for pasta in sorted(proprio, key=lambda p: p.count('/'), reverse=True):
+        if pasta != raiz:
+            total[pasta.rsplit('/', 1)[0]] += total[pasta]
+
+    alvo = total[raiz] / shards
+    unidades = {raiz: total[raiz]}
+    candidatas = [(-total[raiz], raiz)]
+    while candidatas and len(unidades) < shards * UNIDADES_POR_SHARD:
+        peso, pasta = heapq.heappop(candidatas)
+        if -peso <= alvo:
+            break
+        if not filhos[pasta]:
+            continue
+        unidades[pasta] = proprio[pasta]
+        for filho in filhos[pasta]:
+            unidades[filho] = total[filho]
+            heapq.heappush(candidatas, (-total[filho], filho))
+
+    partes = [(0, i, []) for i in range(shards)]
+    for pasta, peso in sorted(unidades.items(), key=lambda item: (-item[1], item[0])):
+        soma, i, raizes = heapq.heappop(partes)
+        raizes.append(pasta)
+        heapq.heappush(partes, (soma + peso, i, raizes))
+    return sorted(unidades), [(raizes, soma) for soma, _, raizes in sorted(partes, key=lambda p: p[1]) if raizes]
+
+
+def _ancestrais(pasta):
+    partes = pasta.split('/')
+    return ['/'.join(partes[:nivel]) for nivel in range(1, len(partes) + 1)]
+
+
+def _inventaria(job):
+    """Pesos das pastas do job a partir de uma listagem nova, na primeira execução (processo do job)"""
+    configuracao.configura_log()
+    with _configura_processo(job):
+        import planejador
+        from inventario import monta_inventario
+        inventario, pastas = monta_inventario(planejador.sharepoint, planejador.opcoes.FOLDER_NAME,
+                                              planejador.opcoes_sharepoint.SHAREPOINT_SITE_NAME,
+                                              **planejador.opcoes.INVENTARIO)
+        try:
+            return planejador.pesos(inventario, pastas, planejador.Escopo([raiz_job(job)]))
+        finally:
+            inventario.fechar()
+
+
+def coordena(lista_jobs, shards=None, dry_run=False, fila=None):
+    """Divide cada job em partes pelos pesos da execução anterior e cria a rodada na fila.
+    Cada job tem uma tarefa de preparação (cria as pastas que iniciam as partes) e as tarefas das partes.
+    Retorna o id da rodada (None no dry_run, que só imprime a divisão)"""
+    fila = fila or FilaTarefas()
+    tarefas = []
+    for job in lista_jobs:
+        pesos = fila.pesos(job['nome'])
+        if not pesos:
+            logging.info(f"Job {job['nome']} sem histórico, listando a biblioteca para dividir")
+            with _contexto.Pool(1, maxtasksperchild=1) as pool:
+                pesos = pool.apply(_inventaria, (job,))
+            fila.grava_pesos(job['nome'], pesos)
+        raizes, partes = particiona(pesos, raiz_job(job), shards)
+        preparacao = sorted({ancestral for pasta in raizes for ancestral in _ancestrais(pasta)})
+        tarefas.append((job['nome'], 0, {'raizes': preparacao, 'todas': preparacao, 'arquivos': False}, 0))
+        for raizes_parte, peso in partes:
+            tarefas.append((job['nome'], 1, {'raizes': raizes_parte, 'todas': raizes, 'arquivos': True}, peso))
+        logging.info(f"Job {job['nome']}: {len(raizes)} subárvores em {len(partes)} partes, "
+                     f"pesos {[round(peso / 1024 / 1024, 2) for _, peso in partes]} MB")
+        if dry_run:
+            print(f"Job {job['nome']} ({raiz_job(job)}): {len(partes)} partes")
+            for raizes_parte, peso in partes:
+                print(f"  {peso / 1024 / 1024:10.2f} MB  {', '.join(raizes_parte)}")
+    if dry_run:
+        return None
+    rodada = fila.nova_rodada(tarefas)
+    logging.info(f"Rodada {rodada} criada com {len(tarefas)} tarefas")
+    return rodada
+
+
+def _executa_tarefa(caminho_fila, tarefa_id, dono, job, escopo, remover):
+    """Processo de uma tarefa: sessões, limites de taxa e caches próprios, lidos da configuração do job"""
+    configuracao.configura_log()
+    fila = FilaTarefas(caminho_fila)
+    try:
+        with _configura_processo(job, tarefa_id):
+            import planejador
+            planejador.modulo_fluig.configura_trava_upload(TravaUpload(caminho_fila))
+            escopo = planejador.Escopo.de_dict(escopo)
+            estimativa, totais, pesos = planejador.sincroniza(escopo, remover=remover or planejador.opcoes.REMOVER)
+        if escopo.arquivos:
+            fila.grava_pesos(job['nome'], pesos, escopo.contem)
+        if not fila.conclui(tarefa_id, dono, {'estimativa': estimativa, 'totais': totais}):
+            logging.warning(f"Tarefa {tarefa_id} do job {job['nome']} terminou depois de a reserva passar a outro worker")
+    except Exception as e:
+        logging.error(f"Erro na tarefa {tarefa_id} do job {job['nome']}: {e}")
+        fila.falha(tarefa_id, dono, e)
+    finally:
+        fila.fechar()
+
+
+def _worker(rodada, indice, lista_jobs, remover, caminho_fila):
+    """Pega tarefas da rodada até a fila acabar, cada uma num processo novo; renova a reserva enquanto ele roda.
+    Só pega as tarefas dos jobs da lista: os outros jobs da rodada ficam para os nós que os conhecem"""
+    fila = FilaTarefas(caminho_fila)
+    dono = f'{socket.gethostname()}:{os.getpid()}:{indice}'
+    por_nome = {job['nome']: job for job in lista_jobs}
+    try:
+        while True:
+            tarefa = fila.pega(rodada, dono, jobs=list(por_nome))
+            if tarefa is None:
+                if not fila.pendentes(rodada, list(por_nome)):
+                    return
+                time.sleep(ESPERA_FILA)
+                continue
+            tarefa_id, nome, escopo = tarefa
+            logging.info(f"Worker {dono} executando a tarefa {tarefa_id} do job {nome}")
+            processo = _contexto.Process(target=_executa_tarefa, name=f'tarefa-{tarefa_id}',
+                                         args=(caminho_fila, tarefa_id, dono, por_nome[nome], escopo, remover))
+            processo.start()
+            while True:
+                processo.join(opcoes.LEASE / 3)
+                if processo.exitcode is not None:
+                    break
+                fila.renova(tarefa_id, dono)
+            if processo.exitcode != 0:
+                logging.error(f"Tarefa {tarefa_id} do job {nome} terminou com código {processo.exitcode}")
+                fila.falha(tarefa_id, dono, f'processo terminou com código {processo.exitcode}')
+    finally:
+        fila.fechar()
+
+
+def trabalha(rodada=None, processos=None, lista_jobs=None, remover=False, caminho_fila=None):
+    """Executa as tarefas da rodada (a mais recente, por padrão) com até processos tarefas ao mesmo tempo.
+    Pode rodar em vários nós apontando para a mesma fila. Retorna o resumo da rodada por estado"""
+    caminho_fila = caminho_fila or opcoes.ARQUIVO_FILA
+    processos = processos or opcoes.PROCESSOS
+    fila = FilaTarefas(caminho_fila)
+    try:
+        rodada = rodada or fila.rodada_atual()
+        if rodada is None:
+            raise Exception("Nenhuma rodada na fila, execute o coordena antes")
+        threads = [threading.Thread(target=_worker, name=f'worker-{i}',
+                                    args=(rodada, i, lista_jobs or jobs(), remover, caminho_fila))
+                   for i in range(processos)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        resumo = fila.resumo(rodada)
+        logging.info(f"Rodada {rodada}: {resumo}")
+        return resumo
+    finally:
+        fila.fechar()
+
+
+def main(argv=None):
+    configuracao.configura_log()
+    parser = argparse.ArgumentParser(description='Sincronização SharePoint -> fluig dividida entre processos e nós')
+    parser.add_argument('comando', nargs='?', default='executa', choices=['executa', 'coordena', 'worker', 'status'],
+                        help='executa (coordena e trabalha neste nó), coordena (só cria a rodada), '
+                             'worker (trabalha na rodada atual) ou status')
+    parser.add_argument('--jobs', nargs='+', help='nomes dos jobs (padrão: todos)')
+    parser.add_argument('--shards', type=int, default=opcoes.SHARDS, help='partes por job')
+    parser.add_argument('--processos', type=int, default=opcoes.PROCESSOS, help='tarefas ao mesmo tempo neste nó')
+    parser.add_argument('--rodada', help='rodada a executar ou consultar (padrão: a mais recente)')
+    parser.add_argument('--remover', action='store_true', help='remove do fluig os arquivos que não existem mais')
+    parser.add_argument('--dry-run', action='store_true', help='só imprime a divisão dos jobs')
+    args = parser.parse_args(argv)
+
+    lista_jobs = [job for job in jobs() if not args.jobs or job['nome'] in args.jobs]
+    start_time = time.time()
+    logging.info(f"Inicio: {datetime.now()}")
+    try:
+        if args.comando == 'status':
+            fila = FilaTarefas()
+            rodada = args.rodada or fila.rodada_atual()
+            for linha in fila.tarefas(rodada):
+                print(*linha, sep='\t')
+            print(rodada, fila.resumo(rodada))
+            return None
+        rodada = args.rodada
+        if args.comando in ('executa', 'coordena'):
+            rodada = coordena(lista_jobs, args.shards, args.dry_run)
+        if args.comando in ('executa', 'worker') and not args.dry_run:
+            trabalha(rodada, args.processos, lista_jobs, args.remover)
+    except Exception as e:
+        logging.error(f"Erro: {e}")
+        return e
+
+    elapsed_time = time.time() - start_time
+    logging.info(f"Tempo decorrido: {elapsed_time}")
+    logging.info(f"Fim: {datetime.now()}")
+
+if __name__ == '__main__':
+    try:
+        sys.exit(1 if main() else 0)
+    except Exception as e:
+        logging.error(f"Erro: {e}")
@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+import benchmark
+import configuracao
+import gerenciador_sessao
+import modulo_fluig
+from simulador_servicos import Simulador
+
+
+class CasoSimulado(unittest.TestCase):
+    """Teste contra o SharePoint e o Fluig simulados: cada teste sobe o simulador, aponta a configuração
+    para ele e começa sem sessões e sem o cache de pastas do teste anterior"""
+
+    formato = 'largo'
+    # yaml mesclado na configuração gerada pelo benchmark
+    extra = None
+
+    def setUp(self):
+        self.simulador = Simulador(self.formato).iniciar()
+        self.addCleanup(self.simulador.parar)
+        self.diretorio = tempfile.mkdtemp(prefix='teste-sync-')
+        self.addCleanup(shutil.rmtree, self.diretorio, ignore_errors=True)
+        os.makedirs(os.path.join(self.diretorio, 'download'))
+        caminho = os.path.join(self.diretorio, 'config.yaml')
+        with open(caminho, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(benchmark.monta_config(self.simulador, self.diretorio, self.extra), f, allow_unicode=True)
+        configuracao.definir(caminho)
+        modulo_fluig._cache_pastas = None
+        self.addCleanup(gerenciador_sessao.fechar)
+
+    def arquivo_sharepoint(self, pasta, nome):
+        """Arquivo da biblioteca simulada, ou None se não existe"""
+        return next((arquivo for arquivo in self.simulador.pastas.get(pasta, {}).get('arquivos', [])
+                     if arquivo.nome == nome), None)
+
+    def requisicoes(self, operacao):
+        return self.simulador.contadores()['requisicoes'].get(operacao, 0)
@@ -0,0 +1,14 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from crawler_sharepoint import CrawlerSharePoint
+
+
+class TestFiltroData(unittest.TestCase):
+
+    def test_data_com_fuso_e_convertida_para_utc(self):
+        desde = datetime(2024, 3, 10, 9, 30, tzinfo=timezone(timedelta(hours=-3)))
+
+        self.assertEqual(CrawlerSharePoint._filtro_data(desde), "Modified ge datetime'2024-03-10T12:30:00Z'")
+
+    def test_sem_data_nao_filtra(self):
+        self.assertIsNone(CrawlerSharePoint._filtro_data(None))
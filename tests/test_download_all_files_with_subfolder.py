@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+import download_all_files_with_subfolder
+from estado_sync import EstadoSync
+
+
+def _propriedades(i, versao=1):
+    return {'file_id': f'id-{i}', 'file_name': f'arquivo_{i}.txt', 'time_last_modified': '2024-01-01T00:00:00Z',
+            'file_size': 10, 'major_version': versao, 'minor_version': 0}
+
+
+class TestArquivosAlterados(unittest.TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.mkdtemp(prefix='teste-estado-')
+        self.addCleanup(shutil.rmtree, diretorio, ignore_errors=True)
+        #Execução anterior com três arquivos sincronizados
+        anterior = EstadoSync(os.path.join(diretorio, 'estado_sync.db'))
+        for i in range(3):
+            anterior.registra(_propriedades(i), 'Documentos', f'arquivo_{i}.txt', f'{100 + i}')
+        anterior.fechar()
+        self.estado = EstadoSync(os.path.join(diretorio, 'estado_sync.db'))
+        self.addCleanup(self.estado.fechar)
+        download_all_files_with_subfolder.estado = self.estado
+        self.addCleanup(setattr, download_all_files_with_subfolder, 'estado', None)
+
+    def test_marca_os_vistos_em_um_commit_e_filtra_os_alterados(self):
+        listados = [_propriedades(0), _propriedades(1, versao=2), _propriedades(3)]
+        comandos = []
+        self.estado._conn.set_trace_callback(comandos.append)
+
+        alterados = list(download_all_files_with_subfolder.arquivos_alterados(listados))
+
+        self.assertEqual([propriedades['file_id'] for propriedades in alterados], ['id-1', 'id-3'])
+        self.assertEqual(comandos.count('COMMIT'), 1)
+        #Só o arquivo não listado fica como removido
+        self.assertEqual([linha[0] for linha in self.estado.removidos()], ['id-2'])
@@ -0,0 +1,30 @@
+import threading
+import gerenciador_sessao
+from office365_api import SharePoint
+from tests import CasoSimulado
+
+
+class TestFecharSessoes(CasoSimulado):
+
+    def test_contexto_de_outra_thread_e_recriado_depois_de_fechar(self):
+        pedidos = [threading.Event(), threading.Event()]
+        prontos = [threading.Event(), threading.Event()]
+        contextos = []
+
+        def trabalha():
+            for pedido, pronto in zip(pedidos, prontos):
+                pedido.wait(10)
+                contextos.append(SharePoint()._auth())
+                pronto.set()
+
+        thread = threading.Thread(target=trabalha)
+        thread.start()
+        pedidos[0].set()
+        prontos[0].wait(10)
+        #O fim da execução é chamado na thread principal, o contexto da outra thread usa a sessão fechada
+        gerenciador_sessao.fechar()
+        pedidos[1].set()
+        thread.join(10)
+
+        self.assertEqual(len(contextos), 2)
+        self.assertIsNot(contextos[0], contextos[1])
@@ -0,0 +1,82 @@
+import json
+import os
+import unittest
+from types import SimpleNamespace
+import requests
+import modulo_fluig
+import planejador
+from simulador_servicos import RAIZ_FLUIG
+from tests import CasoSimulado
+
+
+class TestConsultaEmLote(CasoSimulado):
+    # Limite baixo para as pastas do teste passarem do limite do dataset
+    extra = {'fluig': {'limite_resultados': 5}}
+
+    def setUp(self):
+        super().setUp()
+        modulo_fluig.limpar_cache_documentos()
+        self.addCleanup(modulo_fluig.limpar_cache_documentos)
+        self.pasta = self.simulador._novo_documento(self.simulador.biblioteca, '1', RAIZ_FLUIG)
+        self.documentos = {f'arquivo_{i}.txt': self.simulador._novo_documento(f'arquivo_{i}.txt', '2', self.pasta)
+                           for i in range(12)}
+
+    def test_divide_a_consulta_no_limite_de_resultados(self):
+        nomes = list(self.documentos) + ['inexistente.txt']
+
+        encontrados = modulo_fluig.verifica_existencia_arquivos(nomes, self.pasta)
+
+        self.assertEqual({nome: str(documento_id) for nome, documento_id in encontrados.items()}, self.documentos)
+        self.assertGreater(self.requisicoes('fluig.dataset'), 1)
+
+    def test_divide_a_consulta_no_tamanho_da_url(self):
+        nomes = [f'{"x" * 200}_{i}.txt' for i in range(60)] + ['arquivo_0.txt']
+
+        encontrados = modulo_fluig.verifica_existencia_arquivos(nomes, self.pasta)
+
+        self.assertEqual(encontrados, {'arquivo_0.txt': self.documentos['arquivo_0.txt']})
+        self.assertGreater(self.requisicoes('fluig.dataset'), 1)
+
+    def test_localiza_usa_os_nomes_preparados_na_pasta_acima_do_limite(self):
+        diretorio = os.path.join(self.diretorio, 'download', self.simulador.biblioteca)
+        modulo_fluig.prepara_arquivos(diretorio, list(self.documentos) + ['novo.txt'])
+        consultas = self.requisicoes('fluig.dataset')
+
+        for nome, documento_id in self.documentos.items():
+            self.assertEqual(str(modulo_fluig.localiza_arquivo(nome, self.pasta)), documento_id)
+        self.assertIsNone(modulo_fluig.localiza_arquivo('novo.txt', self.pasta))
+
+        self.assertEqual(self.requisicoes('fluig.dataset'), consultas)
+
+    def test_planejador_consulta_pelos_nomes_do_inventario(self):
+        biblioteca = self.simulador.biblioteca
+        entradas = [SimpleNamespace(nome=nome) for nome in list(self.documentos)[:8]]
+        inventario = SimpleNamespace(por_pasta=lambda: iter([(biblioteca, entradas)]))
+
+        pastas, arquivos = planejador.inventario_fluig(inventario)
+
+        self.assertEqual(pastas[(biblioteca,)], self.pasta)
+        self.assertEqual({caminho: str(documento_id) for caminho, documento_id in arquivos.items()},
+                         {(biblioteca, entrada.nome): self.documentos[entrada.nome] for entrada in entradas})
+
+
+class TestPastaInexistente(unittest.TestCase):
+
+    def _resposta(self, status_code, corpo):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(corpo).encode() if not isinstance(corpo, bytes) else corpo
+        return response
+
+    def test_404_e_erro_especifico_de_pasta(self):
+        self.assertTrue(modulo_fluig.pasta_inexistente(self._resposta(404, {'message': 'pasta 10 não encontrada'})))
+        self.assertTrue(modulo_fluig.pasta_inexistente(self._resposta(500, {'message': 'Pasta pai não encontrada'})))
+        self.assertTrue(modulo_fluig.pasta_inexistente(
+            self._resposta(500, {'message': {'message': 'Parent folder not found', 'detail': None}})))
+        self.assertTrue(modulo_fluig.pasta_inexistente(self._resposta(400, {'code': 'FOLDER_NOT_FOUND'})))
+
+    def test_outros_erros_nao_sao_pasta_inexistente(self):
+        self.assertFalse(modulo_fluig.pasta_inexistente(self._resposta(500, {'message': 'usuário não encontrado'})))
+        self.assertFalse(modulo_fluig.pasta_inexistente(self._resposta(500, {'message': 'Template not found'})))
+        self.assertFalse(modulo_fluig.pasta_inexistente(self._resposta(502, b'<html>not found</html>')))
+        self.assertFalse(modulo_fluig.pasta_inexistente(self._resposta(200, {'message': 'pasta não encontrada'})))
@@ -0,0 +1,81 @@
+import asyncio
+import os
+from contextlib import contextmanager
+import modulo_fluig
+import modulo_fluig_async
+from estado_sync import EstadoSync
+from simulador_servicos import RAIZ_FLUIG
+from tests import CasoSimulado
+
+
+class TestPublicacaoAsync(CasoSimulado):
+
+    def setUp(self):
+        super().setUp()
+        self.estado = EstadoSync(os.path.join(self.diretorio, 'estado_sync.db'))
+        self.addCleanup(self.estado.fechar)
+        modulo_fluig.configura_estado(self.estado)
+        self.addCleanup(modulo_fluig.configura_estado, None)
+        self.pasta = self.simulador._novo_documento(self.simulador.biblioteca, '1', RAIZ_FLUIG)
+
+    def _arquivo_local(self, nome, conteudo):
+        diretorio = os.path.join(self.diretorio, 'download', self.simulador.biblioteca)
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, nome)
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+        return caminho
+
+    def test_publica_e_ignora_o_conteudo_repetido(self):
+        caminhos = [self._arquivo_local(f'novo_{i}.txt', f'conteudo {i}\n'.encode() * 100) for i in range(5)]
+
+        resultados = modulo_fluig_async.publica_arquivos(caminhos)
+
+        self.assertEqual(len(resultados), 5)
+        self.assertNotIn(None, resultados.values())
+        self.assertEqual(self.requisicoes('fluig.upload'), 5)
+
+        #Segunda publicação: os documentos existem e o conteúdo é o mesmo já enviado
+        repetidos = modulo_fluig_async.publica_arquivos(caminhos)
+        self.assertEqual({caminho: str(documento_id) for caminho, documento_id in repetidos.items()},
+                         {caminho: str(documento_id) for caminho, documento_id in resultados.items()})
+        self.assertEqual(self.requisicoes('fluig.upload'), 5)
+
+    def test_nova_versao_usa_a_trava_externa(self):
+        documento_id = self.simulador._novo_documento('relatorio.txt', '2', self.pasta, b'antigo')
+        caminho = self._arquivo_local('relatorio.txt', b'novo conteudo')
+        travados = []
+
+        @contextmanager
+        def trava(nome):
+            travados.append(nome)
+            yield
+
+        modulo_fluig.configura_trava_upload(trava)
+        self.addCleanup(modulo_fluig.configura_trava_upload, None)
+
+        resultados = modulo_fluig_async.publica_arquivos([caminho])
+
+        self.assertEqual(str(resultados[caminho]), documento_id)
+        self.assertEqual(travados, ['relatorio.txt'])
+
+    def test_limita_os_arquivos_em_andamento(self):
+        caminhos = [f'arquivo_{i}.txt' for i in range(20)]
+        andamento = {'atual': 0, 'maximo': 0}
+
+        async def publica(caminho, impressao=None):
+            andamento['atual'] += 1
+            andamento['maximo'] = max(andamento['maximo'], andamento['atual'])
+            await asyncio.sleep(0.01)
+            andamento['atual'] -= 1
+            return caminho
+
+        async def executa():
+            cliente = modulo_fluig_async.ClienteFluigAsync()
+            cliente.publica = publica
+            return await cliente.publica_varios(iter(caminhos), arquivos=3)
+
+        resultados = asyncio.run(executa())
+
+        self.assertEqual(resultados, {caminho: caminho for caminho in caminhos})
+        self.assertEqual(andamento['maximo'], 3)
@@ -0,0 +1,40 @@
+import os
+from estado_sync import EstadoSync
+from office365_api import SharePoint
+from tests import CasoSimulado
+
+
+class TestUploadRetomavel(CasoSimulado):
+
+    def setUp(self):
+        super().setUp()
+        self.estado = EstadoSync(os.path.join(self.diretorio, 'estado_sync.db'))
+        self.addCleanup(self.estado.fechar)
+
+    def _arquivo_local(self, nome, conteudo):
+        caminho = os.path.join(self.diretorio, 'download', nome)
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+        return caminho
+
+    def test_envio_inteiro_repetido_manda_o_conteudo_completo(self):
+        conteudo = b'relatorio mensal\n' * 1000
+        caminho = self._arquivo_local('relatorio.txt', conteudo)
+        #Primeira tentativa recusada depois de o corpo já ter sido lido do arquivo
+        self.simulador.falhar('sharepoint.upload')
+
+        SharePoint().upload_file_in_chunks(caminho, self.simulador.biblioteca, 1024 * 1024, estado=self.estado)
+
+        self.assertEqual(self.requisicoes('sharepoint.upload'), 2)
+        self.assertEqual(self.arquivo_sharepoint(self.simulador.biblioteca, 'relatorio.txt').dados, conteudo)
+
+    def test_bloco_repetido_manda_o_conteudo_completo(self):
+        conteudo = bytes(range(256)) * 40
+        caminho = self._arquivo_local('planilha.bin', conteudo)
+        self.simulador.falhar('sharepoint.continueupload')
+
+        SharePoint().upload_file_in_chunks(caminho, self.simulador.biblioteca, 4096, estado=self.estado)
+
+        self.assertEqual(self.requisicoes('sharepoint.continueupload'), 2)
+        self.assertEqual(self.arquivo_sharepoint(self.simulador.biblioteca, 'planilha.bin').dados, conteudo)
+        self.assertIsNone(self.estado.sessao_upload(f'/sites/{self.simulador.site}/{self.simulador.biblioteca}/planilha.bin'))
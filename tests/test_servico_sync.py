@@ -0,0 +1,13 @@
+import servico_sync
+from tests import CasoSimulado
+
+
+class TestEndpoint(CasoSimulado):
+
+    def test_log_mostra_o_endereco_configurado(self):
+        with self.assertLogs(level='INFO') as logs:
+            servidor = servico_sync.inicia_endpoint(None, porta=0)
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+
+        self.assertIn(f'http://127.0.0.1:{servidor.server_address[1]}', logs.output[-1])
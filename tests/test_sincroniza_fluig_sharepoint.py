@@ -0,0 +1,55 @@
+import os
+from datetime import datetime, timedelta
+import modulo_fluig
+import sincroniza_fluig_sharepoint
+from estado_sync import EstadoSync
+from simulador_servicos import RAIZ_FLUIG
+from tests import CasoSimulado
+
+
+class TestSincronizacaoReversa(CasoSimulado):
+
+    def setUp(self):
+        super().setUp()
+        self.estado = EstadoSync(os.path.join(self.diretorio, 'estado_sync.db'))
+        self.addCleanup(self.estado.fechar)
+        sincroniza_fluig_sharepoint.estado = self.estado
+        sincroniza_fluig_sharepoint._pastas_criadas.clear()
+        modulo_fluig.configura_estado(self.estado)
+        self.addCleanup(modulo_fluig.configura_estado, None)
+        #Pasta do fluig com o nome da biblioteca, como a criada pelo download do SharePoint
+        self.pasta = self.simulador._novo_documento(self.simulador.biblioteca, '1', RAIZ_FLUIG)
+
+    def _sincroniza(self):
+        return sincroniza_fluig_sharepoint.sincroniza(datetime.now() - timedelta(days=1))
+
+    def test_envio_repetido_grava_o_conteudo_do_fluig(self):
+        conteudo = b'editado no fluig\n' * 500
+        documento_id = self.simulador._novo_documento('novo.txt', '2', self.pasta, conteudo)
+        self.simulador.falhar('sharepoint.upload')
+
+        totais = self._sincroniza()
+
+        self.assertEqual(totais['enviado'], 1)
+        self.assertEqual(totais['erro'], 0)
+        self.assertEqual(self.requisicoes('sharepoint.upload'), 2)
+        arquivo = self.arquivo_sharepoint(self.simulador.biblioteca, 'novo.txt')
+        self.assertEqual(arquivo.dados, conteudo)
+        #O estado registra o arquivo com o conteúdo que ficou no SharePoint
+        self.assertEqual(self.estado.busca_por_documento(documento_id)[0], arquivo.unique_id)
+        self.assertEqual(self.estado.hash_documento(documento_id), modulo_fluig.hash_arquivo(
+            os.path.join(self.diretorio, 'download', self.simulador.biblioteca, 'novo.txt')))
+
+    def test_copia_de_conflito_repetida_grava_o_conteudo_do_fluig(self):
+        #Arquivo do SharePoint nunca sincronizado com o mesmo nome: a versão do fluig vai como cópia
+        conteudo = b'alterado nos dois lados\n' * 500
+        self.simulador._novo_documento('arquivo_0.bin', '2', self.pasta, conteudo)
+        self.simulador.falhar('sharepoint.upload')
+
+        totais = self._sincroniza()
+
+        self.assertEqual(totais['conflito'], 1)
+        self.assertEqual(self.requisicoes('sharepoint.upload'), 2)
+        copia = self.arquivo_sharepoint(self.simulador.biblioteca, 'arquivo_0 (fluig v1).bin')
+        self.assertEqual(copia.dados, conteudo)
+        self.assertIsNone(self.arquivo_sharepoint(self.simulador.biblioteca, 'arquivo_0.bin').dados)
@@ -0,0 +1,45 @@
+import os
+import sync_distribuido
+from sync_distribuido import FilaTarefas
+from tests import CasoSimulado
+
+
+class TestFilaTarefas(CasoSimulado):
+
+    def setUp(self):
+        super().setUp()
+        self.caminho_fila = os.path.join(self.diretorio, 'fila.db')
+        self.fila = FilaTarefas(self.caminho_fila)
+        self.addCleanup(self.fila.fechar)
+        escopo = {'raizes': [], 'todas': [], 'arquivos': False}
+        self.rodada = self.fila.nova_rodada([('conhecido', 0, escopo, 0), ('outro_no', 0, escopo, 0)])
+
+    def test_pega_so_as_tarefas_dos_jobs_do_no(self):
+        tarefa = self.fila.pega(self.rodada, 'no-a', jobs=['conhecido'])
+
+        self.assertEqual(tarefa[1], 'conhecido')
+        self.assertIsNone(self.fila.pega(self.rodada, 'no-a', jobs=['conhecido']))
+        self.assertEqual(self.fila.pendentes(self.rodada, ['conhecido']), 1)
+        self.assertEqual(self.fila.pendentes(self.rodada), 2)
+
+    def test_worker_ignora_os_jobs_que_nao_conhece(self):
+        #O worker de um nó com outro --jobs termina sem pegar a tarefa do job que ele não tem
+        self.fila.conclui(*self._pega_conhecido(), {})
+
+        sync_distribuido._worker(self.rodada, 0, [{'nome': 'conhecido'}], False, self.caminho_fila)
+
+        self.assertEqual(self.fila.resumo(self.rodada), {'concluida': 1, 'pendente': 1})
+
+    def test_conclui_e_falha_so_do_dono_da_reserva(self):
+        tarefa_id, dono = self._pega_conhecido()
+
+        self.assertFalse(self.fila.conclui(tarefa_id, 'reserva-vencida', {}))
+        self.assertFalse(self.fila.falha(tarefa_id, 'reserva-vencida', 'erro'))
+        self.assertEqual(self.fila.tarefas(self.rodada)[0][4], 'executando')
+
+        self.assertTrue(self.fila.conclui(tarefa_id, dono, {}))
+        self.assertEqual(self.fila.tarefas(self.rodada)[0][4], 'concluida')
+
+    def _pega_conhecido(self):
+        tarefa_id, _, _ = self.fila.pega(self.rodada, 'no-a', jobs=['conhecido'])
+        return tarefa_id, 'no-a'